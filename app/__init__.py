@@ -89,6 +89,14 @@ def create_app(config_class=Config):
     migrate.init_app(app, db)
     login_manager.init_app(app)
 
+    # Optional write-behind event ingestion (background writer thread)
+    from .ingestion import init_write_behind
+    init_write_behind(app)
+
+    # In-process thread pool for background analysis jobs
+    from .jobs import init_jobs
+    init_jobs(app)
+
     # --- User Loader for Flask-Login ---
     # Import User model *inside* the factory to avoid potential circular imports
     # if models.py also imports 'app' or 'db'
@@ -0,0 +1,589 @@
+# app/aggregates.py
+"""
+Aggregates maintained incrementally as events are ingested.
+
+`apply_ingested_rows` runs in the same transaction as the raw INSERT (see
+`ingestion.store_event_rows`), so the aggregates never drift from the
+GameEvent rows they summarize. The `rebuild_*` functions recompute them
+from GameEvent history (used by the CLI after an upgrade or a change of
+configuration).
+"""
+
+import math
+from collections import Counter
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import Integer, case, cast, delete, distinct, false, func, insert, literal, select, true, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from . import db
+from .models import (
+    GameEvent, HeatmapDensity, LevelDataVersion, LevelEventTypeCount, LevelSession, LevelSummary, SessionSummary
+)
+from .event_search import remove_event_search, remove_event_search_for_event, remove_event_search_for_session
+from .positions import (
+    remove_position_sample_for_event, remove_position_samples_for_level, remove_position_samples_for_session
+)
+
+DEFAULT_DENSITY_CELL_SIZE = 1.0 # World units per heatmap_density cell
+ALL_SESSIONS = '' # heatmap_density.session_id of the level-wide rows
+
+_UPSERT_INSERTS = {
+    'sqlite': sqlite_insert,
+    'postgresql': postgresql_insert,
+}
+
+
+def density_cell_size():
+    return float(current_app.config.get('HEATMAP_DENSITY_CELL_SIZE', DEFAULT_DENSITY_CELL_SIZE))
+
+
+def _least(current, new):
+    return case((current.is_(None), new), (new < current, new), else_=current)
+
+
+def _greatest(current, new):
+    return case((current.is_(None), new), (new > current, new), else_=current)
+
+
+def upsert_add(table, key_columns, value_columns, params, min_columns=(), max_columns=()):
+    """
+    INSERT ... ON CONFLICT DO UPDATE SET value = value + excluded.value
+    (and column = least/greatest(column, excluded.column) for min_columns /
+    max_columns, e.g. first/last timestamps).
+
+    Uses the native upsert on SQLite and PostgreSQL and an UPDATE-then-INSERT
+    fallback elsewhere. Params are sorted by key so concurrent writers lock
+    rows in the same order.
+    """
+    if not params:
+        return
+    params = sorted(params, key=lambda p: tuple(p[c] for c in key_columns))
+
+    def merged(new):
+        values = {c: table.c[c] + new(c) for c in value_columns}
+        values.update({c: _least(table.c[c], new(c)) for c in min_columns})
+        values.update({c: _greatest(table.c[c], new(c)) for c in max_columns})
+        return values
+
+    dialect_insert = _UPSERT_INSERTS.get(db.session.get_bind().dialect.name)
+    if dialect_insert is not None:
+        statement = dialect_insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c[c] for c in key_columns],
+            set_=merged(lambda c: statement.excluded[c])
+        )
+        db.session.execute(statement, params)
+        return
+
+    for p in params:
+        key_filter = [table.c[c] == p[c] for c in key_columns]
+        result = db.session.execute(update(table).where(*key_filter).values(merged(lambda c: literal(p[c]))))
+        if result.rowcount == 0:
+            db.session.execute(insert(table), p)
+
+
+# --- Heatmap density (level_id, session_id, cell_x, cell_z, count) ---
+
+def _density_counts(rows, cell_size):
+    """Counts position_update rows per (level, session, cell) and per (level, '', cell)."""
+    counts = Counter()
+    for event_type, _ts, session_id, level_id, x, _y, z, _data in rows:
+        if event_type != 'position_update' or level_id is None or x is None or z is None:
+            continue
+        cell = (math.floor(x / cell_size), math.floor(z / cell_size))
+        counts[(level_id, ALL_SESSIONS) + cell] += 1
+        if session_id:
+            counts[(level_id, session_id) + cell] += 1
+    return counts
+
+
+def update_density(rows):
+    """Adds the position samples of freshly ingested rows to heatmap_density."""
+    counts = _density_counts(rows, density_cell_size())
+    upsert_add(
+        HeatmapDensity.__table__,
+        ('level_id', 'session_id', 'cell_x', 'cell_z'),
+        ('count',),
+        [
+            {"level_id": level_id, "session_id": session_id, "cell_x": cx, "cell_z": cz, "count": n}
+            for (level_id, session_id, cx, cz), n in counts.items()
+        ]
+    )
+
+
+def floor_div(column, size):
+    """SQL floor(column / size) that works whether CAST truncates (SQLite) or rounds (PostgreSQL)."""
+    quotient = column / size
+    truncated = cast(quotient, Integer)
+    return truncated - case((quotient < truncated, 1), else_=0)
+
+
+def rebuild_density(level_id=None):
+    """Recomputes heatmap_density from GameEvent history (one level or all levels)."""
+    table = HeatmapDensity.__table__
+    cell_size = density_cell_size()
+    cell_x = floor_div(GameEvent.position_x, cell_size)
+    cell_z = floor_div(GameEvent.position_z, cell_size)
+    filters = [
+        GameEvent.event_type == 'position_update',
+        GameEvent.level_id.isnot(None),
+        GameEvent.position_x.isnot(None),
+        GameEvent.position_z.isnot(None),
+    ]
+    cleanup = delete(table)
+    if level_id is not None:
+        filters.append(GameEvent.level_id == level_id)
+        cleanup = cleanup.where(table.c.level_id == level_id)
+    db.session.execute(cleanup)
+
+    columns = ['level_id', 'session_id', 'cell_x', 'cell_z', 'count']
+    per_session = select(GameEvent.level_id, GameEvent.session_id, cell_x, cell_z, func.count())\
+        .where(*filters, GameEvent.session_id.isnot(None), GameEvent.session_id != ALL_SESSIONS)\
+        .group_by(GameEvent.level_id, GameEvent.session_id, cell_x, cell_z)
+    level_wide = select(GameEvent.level_id, literal(ALL_SESSIONS), cell_x, cell_z, func.count())\
+        .where(*filters)\
+        .group_by(GameEvent.level_id, cell_x, cell_z)
+    db.session.execute(insert(table).from_select(columns, per_session))
+    db.session.execute(insert(table).from_select(columns, level_wide))
+
+
+def remove_density_for_level(level_id):
+    db.session.execute(delete(HeatmapDensity.__table__).where(HeatmapDensity.level_id == level_id))
+
+
+def remove_density_for_session(session_id):
+    """Subtracts a session's cells from the level-wide rows and drops its own rows."""
+    table = HeatmapDensity.__table__
+    session_cells = db.session.execute(
+        select(table.c.level_id, table.c.cell_x, table.c.cell_z, table.c.count)
+        .where(table.c.session_id == session_id)
+    ).all()
+    for level_id, cx, cz, n in session_cells:
+        db.session.execute(
+            update(table)
+            .where(table.c.level_id == level_id, table.c.session_id == ALL_SESSIONS,
+                   table.c.cell_x == cx, table.c.cell_z == cz)
+            .values(count=table.c.count - n)
+        )
+    db.session.execute(delete(table).where(table.c.session_id == session_id))
+    db.session.execute(delete(table).where(table.c.session_id == ALL_SESSIONS, table.c.count <= 0))
+
+
+def remove_density_for_event(event):
+    """Decrements the cells of a single deleted position_update event."""
+    if event.event_type != 'position_update' or event.level_id is None \
+            or event.position_x is None or event.position_z is None:
+        return
+    table = HeatmapDensity.__table__
+    cell_size = density_cell_size()
+    cx = math.floor(event.position_x / cell_size)
+    cz = math.floor(event.position_z / cell_size)
+    sessions = [ALL_SESSIONS] + ([event.session_id] if event.session_id else [])
+    db.session.execute(
+        update(table)
+        .where(table.c.level_id == event.level_id, table.c.session_id.in_(sessions),
+               table.c.cell_x == cx, table.c.cell_z == cz)
+        .values(count=table.c.count - 1)
+    )
+    db.session.execute(delete(table).where(table.c.level_id == event.level_id, table.c.count <= 0))
+
+
+def fetch_density_cells(level_id, session_id=None):
+    """
+    Returns (cells, counts): an (n, 2) array of world X/Z cell centres and the
+    matching sample counts, or (None, None) when the level has no density rows.
+    """
+    table = HeatmapDensity.__table__
+    result = db.session.connection().execute(
+        select(table.c.cell_x, table.c.cell_z, table.c.count)
+        .where(table.c.level_id == level_id, table.c.session_id == (session_id or ALL_SESSIONS))
+    )
+    rows = result.fetchall()
+    if not rows:
+        return None, None
+    data = np.array(rows, dtype=np.float64)
+    cell_size = density_cell_size()
+    return (data[:, :2] + 0.5) * cell_size, data[:, 2]
+
+
+# --- Level summaries (level_summary, level_event_type_count, level_session) ---
+
+def refresh_level_summaries(level_ids=None, count_sessions=True):
+    """
+    Recomputes level_summary rows (given levels or all) from the per-type
+    and per-session rows: O(event types + sessions) of the level, not events.
+    Ingest passes count_sessions=False and adds its new sessions itself, so
+    a batch does not recount every session of the level.
+    """
+    summary = LevelSummary.__table__
+    types = LevelEventTypeCount.__table__
+    sessions = LevelSession.__table__
+    of_level = types.c.level_id == summary.c.level_id
+    values = dict(
+        event_count=select(func.coalesce(func.sum(types.c.count), 0)).where(of_level).scalar_subquery(),
+        death_count=select(func.coalesce(func.sum(types.c.count), 0))
+            .where(of_level, types.c.event_type == 'death').scalar_subquery(),
+        first_event=select(func.min(types.c.first_event)).where(of_level).scalar_subquery(),
+        last_event=select(func.max(types.c.last_event)).where(of_level).scalar_subquery(),
+    )
+    if count_sessions:
+        values['session_count'] = select(func.count()).where(sessions.c.level_id == summary.c.level_id).scalar_subquery()
+    statement = update(summary).values(**values)
+    if level_ids is not None:
+        statement = statement.where(summary.c.level_id.in_(sorted(level_ids)))
+    db.session.execute(statement)
+
+
+def update_level_summaries(rows):
+    """Adds freshly ingested rows to the level summary tables."""
+    type_counts = {}
+    session_counts = {}
+    for event_type, timestamp, session_id, level_id, *_rest in rows:
+        if level_id is None or event_type is None:
+            continue
+        for counts, key in ((type_counts, (level_id, event_type)), (session_counts, (level_id, session_id))):
+            if key[1] is None:
+                continue
+            entry = counts.get(key)
+            if entry is None:
+                counts[key] = [1, timestamp, timestamp]
+            else:
+                entry[0] += 1
+                entry[1] = min(entry[1], timestamp)
+                entry[2] = max(entry[2], timestamp)
+    if not type_counts:
+        return
+
+    level_counts = Counter()
+    for (level_id, _type), (n, _first, _last) in type_counts.items():
+        level_counts[level_id] += n
+    # Level rows first: on PostgreSQL concurrent batches of a level queue on this row lock,
+    # so the refresh below always sees the other writers' committed per-session rows
+    upsert_add(
+        LevelSummary.__table__, ('level_id',), ('event_count',),
+        [{"level_id": level_id, "event_count": n} for level_id, n in level_counts.items()]
+    )
+    # Sessions new to their level (read after the level row lock, see above): added to session_count
+    new_sessions = Counter()
+    sessions_by_level = {}
+    for level_id, session_id in session_counts:
+        sessions_by_level.setdefault(level_id, []).append(session_id)
+    for level_id, session_ids in sessions_by_level.items():
+        known = set(db.session.execute(
+            select(LevelSession.session_id)
+            .where(LevelSession.level_id == level_id, LevelSession.session_id.in_(session_ids))
+        ).scalars())
+        new_sessions[level_id] = len(set(session_ids) - known)
+    upsert_add(
+        LevelEventTypeCount.__table__, ('level_id', 'event_type'), ('count',),
+        [
+            {"level_id": level_id, "event_type": event_type, "count": n, "first_event": first, "last_event": last}
+            for (level_id, event_type), (n, first, last) in type_counts.items()
+        ],
+        min_columns=('first_event',), max_columns=('last_event',)
+    )
+    upsert_add(
+        LevelSession.__table__, ('level_id', 'session_id'), ('event_count',),
+        [
+            {"level_id": level_id, "session_id": session_id, "event_count": n, "first_event": first, "last_event": last}
+            for (level_id, session_id), (n, first, last) in session_counts.items()
+        ],
+        min_columns=('first_event',), max_columns=('last_event',)
+    )
+    upsert_add(
+        LevelSummary.__table__, ('level_id',), ('session_count',),
+        [{"level_id": level_id, "session_count": n} for level_id, n in new_sessions.items() if n]
+    )
+    refresh_level_summaries(level_counts.keys(), count_sessions=False)
+
+
+def _kept(ignore):
+    """WHERE clause keeping the rows not matched by `ignore` (rows where it is NULL included)."""
+    return case((ignore, false()), else_=true())
+
+
+def rebuild_level_summaries(level_id=None, ignore=None):
+    """
+    Recomputes the level summary tables from GameEvent history (one level or all).
+
+    `ignore` is an optional SQL condition of rows to leave out: the delete
+    hooks run before their DELETE and pass the rows about to be removed.
+    """
+    filters = [GameEvent.level_id.isnot(None), GameEvent.event_type.isnot(None)]
+    if level_id is not None:
+        filters.append(GameEvent.level_id == level_id)
+    if ignore is not None:
+        filters.append(_kept(ignore))
+    tables = (LevelSummary.__table__, LevelEventTypeCount.__table__, LevelSession.__table__)
+    for table in tables:
+        cleanup = delete(table)
+        if level_id is not None:
+            cleanup = cleanup.where(table.c.level_id == level_id)
+        db.session.execute(cleanup)
+
+    first, last = func.min(GameEvent.timestamp), func.max(GameEvent.timestamp)
+    db.session.execute(insert(LevelEventTypeCount.__table__).from_select(
+        ['level_id', 'event_type', 'count', 'first_event', 'last_event'],
+        select(GameEvent.level_id, GameEvent.event_type, func.count(), first, last)
+        .where(*filters).group_by(GameEvent.level_id, GameEvent.event_type)
+    ))
+    db.session.execute(insert(LevelSession.__table__).from_select(
+        ['level_id', 'session_id', 'event_count', 'first_event', 'last_event'],
+        select(GameEvent.level_id, GameEvent.session_id, func.count(), first, last)
+        .where(*filters, GameEvent.session_id.isnot(None)).group_by(GameEvent.level_id, GameEvent.session_id)
+    ))
+    types = LevelEventTypeCount.__table__
+    levels = select(types.c.level_id).distinct()
+    if level_id is not None:
+        levels = levels.where(types.c.level_id == level_id)
+    db.session.execute(insert(LevelSummary.__table__).from_select(['level_id'], levels))
+    refresh_level_summaries([level_id] if level_id is not None else None)
+
+
+# --- Session summaries (session_summary) ---
+
+def update_session_summaries(rows):
+    """Adds freshly ingested rows to session_summary (after update_level_summaries)."""
+    sessions = {}
+    for _type, timestamp, session_id, level_id, *_rest in rows:
+        if session_id is None or timestamp is None:
+            continue
+        entry = sessions.get(session_id)
+        if entry is None:
+            sessions[session_id] = [1, level_id, timestamp, timestamp]
+            continue
+        entry[0] += 1
+        if level_id is not None and (entry[1] is None or level_id < entry[1]):
+            entry[1] = level_id
+        entry[2] = min(entry[2], timestamp)
+        entry[3] = max(entry[3], timestamp)
+    if not sessions:
+        return
+    table = SessionSummary.__table__
+    upsert_add(
+        table, ('session_id',), ('event_count',),
+        [
+            {"session_id": session_id, "event_count": n, "first_level_id": level_id, "level_count": 0,
+             "start_time": first, "end_time": last}
+            for session_id, (n, level_id, first, last) in sessions.items()
+        ],
+        min_columns=('first_level_id', 'start_time'), max_columns=('end_time',)
+    )
+    # Levels touched, from the (level, session) rows written just before
+    level_sessions = LevelSession.__table__
+    db.session.execute(
+        update(table).where(table.c.session_id.in_(sorted(sessions))).values(
+            level_count=select(func.count()).where(level_sessions.c.session_id == table.c.session_id)
+                .scalar_subquery()
+        )
+    )
+
+
+SESSION_REBUILD_CHUNK = 500
+
+
+def rebuild_session_summaries(session_ids=None, ignore=None):
+    """
+    Recomputes session_summary from GameEvent history (given sessions or all).
+
+    `ignore` is an optional SQL condition of rows to leave out, as in
+    rebuild_level_summaries(). Sessions left without events lose their row.
+    """
+    table = SessionSummary.__table__
+    columns = ['session_id', 'first_level_id', 'level_count', 'start_time', 'end_time', 'event_count']
+    summary = select(
+        GameEvent.session_id, func.min(GameEvent.level_id), func.count(distinct(GameEvent.level_id)),
+        func.min(GameEvent.timestamp), func.max(GameEvent.timestamp), func.count()
+    ).where(GameEvent.session_id.isnot(None), GameEvent.timestamp.isnot(None))
+    if ignore is not None:
+        summary = summary.where(_kept(ignore))
+
+    if session_ids is None:
+        db.session.execute(delete(table))
+        db.session.execute(insert(table).from_select(columns, summary.group_by(GameEvent.session_id)))
+        return
+    session_ids = sorted(set(session_ids) - {None})
+    for i in range(0, len(session_ids), SESSION_REBUILD_CHUNK):
+        chunk = session_ids[i:i + SESSION_REBUILD_CHUNK]
+        db.session.execute(delete(table).where(table.c.session_id.in_(chunk)))
+        db.session.execute(insert(table).from_select(
+            columns, summary.where(GameEvent.session_id.in_(chunk)).group_by(GameEvent.session_id)
+        ))
+
+
+def available_level_ids():
+    """
+    Level IDs for selectors, from level_summary (one row per level). Falls
+    back to scanning game_event while the summaries are not built yet
+    (`flask rebuild-level-summaries` after upgrading).
+    """
+    level_ids = db.session.execute(
+        select(LevelSummary.level_id).order_by(LevelSummary.level_id)
+    ).scalars().all()
+    if not level_ids:
+        level_ids = db.session.execute(
+            select(GameEvent.level_id).where(GameEvent.level_id.isnot(None)).distinct().order_by(GameEvent.level_id)
+        ).scalars().all()
+    return level_ids
+
+
+# --- Level data versions (watermark of cached analyses) ---
+
+def bump_level_versions(level_ids):
+    """Increments the data version of every given level."""
+    upsert_add(
+        LevelDataVersion.__table__,
+        ('level_id',),
+        ('version',),
+        [{"level_id": level_id, "version": 1} for level_id in set(level_ids) if level_id is not None]
+    )
+
+
+def level_data_version(level_id):
+    """Current data version of a level (0 if it never changed)."""
+    return db.session.execute(
+        select(LevelDataVersion.version).where(LevelDataVersion.level_id == level_id)
+    ).scalar() or 0
+
+
+def apply_ingested_rows(rows):
+    """Updates every ingest-time aggregate for freshly inserted rows."""
+    update_density(rows)
+    update_level_summaries(rows)
+    update_session_summaries(rows)
+    bump_level_versions({row[3] for row in rows})
+
+
+# --- Keeping derived tables in step with deletes (same transaction as the DELETE) ---
+
+def _subtract_event(table, key, count_column, range_columns, event, others):
+    """
+    Subtracts one event from a counter row: count - 1 (upsert_add), row
+    deleted at 0. The time range is re-read from the other events (`others`)
+    only if the event was its first or last one. Returns True if the row was deleted.
+    """
+    key_filter = [table.c[c] == value for c, value in key.items()]
+    first_column, last_column = range_columns
+    row = db.session.execute(
+        select(table.c[first_column], table.c[last_column]).where(*key_filter)
+    ).first()
+    if row is None: # Summaries not built for it (yet)
+        return False
+    # The range is only there for NOT NULL columns of the (never taken) insert path
+    upsert_add(table, tuple(key), (count_column,), [
+        dict(key, **{count_column: -1, first_column: row[0], last_column: row[1]})
+    ])
+    if db.session.execute(select(table.c[count_column]).where(*key_filter)).scalar() <= 0:
+        db.session.execute(delete(table).where(*key_filter))
+        return True
+    if event.timestamp is not None and event.timestamp in (row[0], row[1]):
+        first, last = db.session.execute(
+            select(func.min(GameEvent.timestamp), func.max(GameEvent.timestamp))
+            .where(GameEvent.id != event.id, *others)
+        ).one()
+        db.session.execute(update(table).where(*key_filter).values({first_column: first, last_column: last}))
+    return False
+
+
+def _forget_level_event(event):
+    """Level summary tables without one event. Returns True if its session left the level."""
+    level_id, event_type, session_id = event.level_id, event.event_type, event.session_id
+    if level_id is None or event_type is None:
+        return False
+    of_level = [GameEvent.level_id == level_id, GameEvent.event_type.isnot(None)]
+    _subtract_event(
+        LevelEventTypeCount.__table__, {"level_id": level_id, "event_type": event_type}, 'count',
+        ('first_event', 'last_event'), event, [GameEvent.level_id == level_id, GameEvent.event_type == event_type]
+    )
+    session_left = session_id is not None and _subtract_event(
+        LevelSession.__table__, {"level_id": level_id, "session_id": session_id}, 'event_count',
+        ('first_event', 'last_event'), event, of_level + [GameEvent.session_id == session_id]
+    )
+
+    summary = LevelSummary.__table__
+    upsert_add(summary, ('level_id',), ('event_count', 'death_count', 'session_count'), [{
+        "level_id": level_id, "event_count": -1,
+        "death_count": -1 if event_type == 'death' else 0, "session_count": -1 if session_left else 0,
+    }])
+    row = db.session.execute(
+        select(summary.c.event_count, summary.c.first_event, summary.c.last_event)
+        .where(summary.c.level_id == level_id)
+    ).one()
+    if row.event_count <= 0:
+        db.session.execute(delete(summary).where(summary.c.level_id == level_id))
+    elif event.timestamp is not None and event.timestamp in (row.first_event, row.last_event):
+        # Level range from its per-type rows (already updated above)
+        types = LevelEventTypeCount.__table__
+        of_types = types.c.level_id == level_id
+        db.session.execute(update(summary).where(summary.c.level_id == level_id).values(
+            first_event=select(func.min(types.c.first_event)).where(of_types).scalar_subquery(),
+            last_event=select(func.max(types.c.last_event)).where(of_types).scalar_subquery(),
+        ))
+    return session_left
+
+
+def _forget_session_event(event, left_level):
+    """session_summary without one event; left_level: the session has no more events on the event's level."""
+    session_id = event.session_id
+    if session_id is None or event.timestamp is None:
+        return
+    table = SessionSummary.__table__
+    deleted = _subtract_event(
+        table, {"session_id": session_id}, 'event_count', ('start_time', 'end_time'), event,
+        [GameEvent.session_id == session_id, GameEvent.timestamp.isnot(None)]
+    )
+    if left_level and not deleted:
+        level_sessions = LevelSession.__table__
+        of_session = level_sessions.c.session_id == session_id
+        db.session.execute(update(table).where(table.c.session_id == session_id).values(
+            level_count=select(func.count()).where(of_session).scalar_subquery(),
+            first_level_id=select(func.min(level_sessions.c.level_id)).where(of_session).scalar_subquery(),
+        ))
+
+
+def forget_event(event):
+    """
+    Removes one event (about to be deleted) from every derived table by
+    negative deltas: O(1) statements, independent of the level's size.
+    """
+    remove_density_for_event(event)
+    remove_position_sample_for_event(event)
+    remove_event_search_for_event(event)
+    left_level = _forget_level_event(event)
+    _forget_session_event(event, left_level)
+    bump_level_versions([event.level_id])
+
+
+# event_rows=False leaves the rows kept per event (position samples, search
+# index) to the caller: the chunked purges in partitions.py delete them in batches
+
+def forget_session(session_id, event_rows=True):
+    levels = db.session.execute(
+        select(GameEvent.level_id).where(GameEvent.session_id == session_id).distinct()
+    ).scalars().all()
+    remove_density_for_session(session_id)
+    if event_rows:
+        remove_position_samples_for_session(session_id)
+        remove_event_search_for_session(session_id)
+    for level_id in levels:
+        if level_id is not None:
+            rebuild_level_summaries(level_id, ignore=GameEvent.session_id == session_id)
+    db.session.execute(delete(SessionSummary.__table__).where(SessionSummary.session_id == session_id))
+    bump_level_versions(levels)
+
+
+def forget_level(level_id, event_rows=True):
+    sessions = db.session.execute(
+        select(GameEvent.session_id).where(GameEvent.level_id == level_id).distinct()
+    ).scalars().all()
+    rebuild_session_summaries(sessions, ignore=GameEvent.level_id == level_id)
+    remove_density_for_level(level_id)
+    if event_rows:
+        remove_position_samples_for_level(level_id)
+        remove_event_search(GameEvent.level_id == level_id)
+    for table in (LevelSummary.__table__, LevelEventTypeCount.__table__, LevelSession.__table__):
+        db.session.execute(delete(table).where(table.c.level_id == level_id))
+    bump_level_versions([level_id])
@@ -1,22 +1,82 @@
 # app/analysis.py
 
 import numpy as np
+from scipy.spatial import cKDTree
 from sklearn.cluster import DBSCAN
 from sklearn.preprocessing import StandardScaler
 from flask import current_app
+from sqlalchemy import func, select
+from . import db
+from .aggregates import floor_div
 from .models import GameEvent
-from . import db # Might not be needed if only querying
+from .heatmap import compute_display_scaling, fetch_xz_array, position_select
+from .positions import build_filter
+from .timestamps import time_window
+
+# Levels with more position samples than this are clustered on grid cells (method='auto')
+DEFAULT_CLUSTER_MAX_POINTS = 200000
+# Grid cell side as a fraction of eps (in standardized units): a sample is
+# represented by its cell mean, at most sqrt(2)/2 * GRID_CELL_EPS_FRACTION * eps away
+GRID_CELL_EPS_FRACTION = 0.25
+
+def _position_stats(statement):
+    """Count, bounds, mean and population std of X/Z in one aggregate query."""
+    positions = statement.subquery()
+    x, z = list(positions.c)
+    count, min_x, max_x, min_z, max_z, mean_x, mean_z, mean_xx, mean_zz = db.session.execute(select(
+        func.count(x), func.min(x), func.max(x), func.min(z), func.max(z),
+        func.avg(x), func.avg(z), func.avg(x * x), func.avg(z * z)
+    )).one()
+    if not count:
+        return 0, None, None, None
+    mean = np.array([mean_x, mean_z], dtype=np.float64)
+    std = np.sqrt(np.maximum(np.array([mean_xx, mean_zz], dtype=np.float64) - mean ** 2, 0.0))
+    return count, (min_x, max_x, min_z, max_z), mean, std
+
+def _grid_cells(statement, cell_size):
+    """
+    Collapses samples into square cells of `cell_size` world units in SQL.
 
-def cluster_level_zones(level_id, session_id=None, eps=0.3, min_samples=10):
+    Returns:
+        tuple: ((m, 2) array of the mean X/Z of each occupied cell, (m,) sample counts)
+    """
+    positions = statement.subquery()
+    x, z = list(positions.c)
+    cell_x = floor_div(x, cell_size)
+    cell_z = floor_div(z, cell_size)
+    rows = db.session.connection().execute(
+        select(func.avg(x), func.avg(z), func.count()).group_by(cell_x, cell_z)
+    ).fetchall()
+    cells = np.array(rows, dtype=np.float64).reshape(-1, 3)
+    return cells[:, :2], cells[:, 2]
+
+def cluster_level_zones(level_id, session_id=None, eps=0.3, min_samples=10, start=None, end=None, method='auto',
+                        build=None):
     """
     Performs DBSCAN clustering on position data (X, Z) for a given level ID.
     Calculates scaling parameters to map original coordinates to a target display area.
 
+    Two methods:
+    * 'exact' - DBSCAN on every sample (memory grows with the sample count);
+    * 'grid'  - samples are collapsed in SQL into cells of
+      GRID_CELL_EPS_FRACTION * eps standard deviations, and DBSCAN runs on the
+      cell means weighted by their counts (sample_weight), so memory and time
+      grow with the number of occupied cells. Every sample moves to its cell
+      mean, i.e. by at most ~0.18 * eps: only samples within that distance of
+      a neighbourhood boundary can change side. Zone sizes and centroids
+      normally stay within a few percent of the exact run (see the commit
+      introducing this mode for measurements).
+    'auto' picks 'grid' above ZONE_CLUSTER_MAX_POINTS samples.
+
     Args:
         level_id (str): The ID of the level to analyze.
         session_id (str, optional): Filter by a specific session ID. Defaults to None.
         eps (float): DBSCAN parameter: Maximum distance between samples.
         min_samples (int): DBSCAN parameter: Minimum samples in a neighborhood.
+        start (datetime, optional): Only use samples at or after this time (UTC).
+        end (datetime, optional): Only use samples before this time (UTC).
+        method (str): 'auto', 'exact' or 'grid'.
+        build (str, optional): Only use sessions played on this client build.
 
     Returns:
         dict: A dictionary containing results including scaling parameters:
@@ -24,86 +84,94 @@ def cluster_level_zones(level_id, session_id=None, eps=0.3, min_samples=10):
               or {'error': message}
     """
     
-    # 1. Query Data
-    query = GameEvent.query.filter(
-        GameEvent.event_type == 'position_update',
-        GameEvent.level_id == level_id,
-        GameEvent.position_x.isnot(None),
-        GameEvent.position_z.isnot(None)
+    result, points_array, weights, mean, std = load_zone_input(
+        level_id, session_id=session_id, eps=eps, min_samples=min_samples, start=start, end=end, method=method,
+        build=build
     )
-    if session_id:
-        query = query.filter(GameEvent.session_id == session_id)
-        
-    # Fetch X and Z coordinates
-    points = query.with_entities(GameEvent.position_x, GameEvent.position_z).all()
+    if points_array is None:
+        return result
+    return cluster_zone_input(result, points_array, weights, mean, std)
+
+def load_zone_input(level_id, session_id=None, eps=0.3, min_samples=10, start=None, end=None, method='auto',
+                    build=None):
+    """
+    Database stage of cluster_level_zones(): statistics, scaling and the
+    points to cluster (every sample, or weighted grid cells). No clustering.
+
+    Returns:
+        tuple: (result, points, weights, mean, std). `result` is the response
+        without zones; with too few samples it is already final and points is
+        None. mean/std are None in exact mode (StandardScaler is fitted on
+        the points).
+    """
+    # 1. Query Data: bounds and spread first, in SQL
+    statement = position_select(level_id, session_id, start, end, build)
+    count, bounds, mean, std = _position_stats(statement)
+    parameters = {"eps": eps, "min_samples": min_samples}
 
-    if not points or len(points) < min_samples: # Need enough points for DBSCAN
+    if count < min_samples: # Need enough points for DBSCAN
         return {
             "levelId": level_id,
             "sessionId": session_id,
             "zones": [],
-            "noise_points": len(points), # All points are noise if too few
-            "parameters": {"eps": eps, "min_samples": min_samples},
+            "noise_points": int(count), # All points are noise if too few
+            "parameters": parameters,
             "scaling": None, # No scaling if no data
             "message": "Not enough data points for clustering."
-        }
+        }, None, None, None, None
 
-    points_array = np.array([(p[0], p[1]) for p in points])
+    if method == 'auto':
+        max_points = current_app.config.get('ZONE_CLUSTER_MAX_POINTS', DEFAULT_CLUSTER_MAX_POINTS)
+        method = 'grid' if count > max_points else 'exact'
+    parameters["method"] = method
     
     # --- Calculate Scaling Parameters --- 
-    # Based on the actual points used for clustering
-    min_x = np.min(points_array[:, 0])
-    max_x = np.max(points_array[:, 0])
-    min_z = np.min(points_array[:, 1])
-    max_z = np.max(points_array[:, 1])
-
-    range_x = max_x - min_x
-    range_z = max_z - min_z
-
-    target_width = 580 # Match heatmap target size
-    target_height = 380
-    padding = 10
-
-    scale = 1.0 # Default scale
-    offset_x = padding
-    offset_y = padding
-    
-    if range_x == 0 and range_z == 0:
-        offset_x = target_width / 2 + padding
-        offset_y = target_height / 2 + padding
-    elif range_x == 0:
-        scale = target_height / range_z if range_z > 0 else 1
-        offset_x = target_width / 2 + padding
-    elif range_z == 0:
-        scale = target_width / range_x if range_x > 0 else 1
-        offset_y = target_height / 2 + padding
-    else:
-         scale_x = target_width / range_x
-         scale_z = target_height / range_z
-         scale = min(scale_x, scale_z)
-    # Keep default offsets (padding) when both ranges > 0
-         
-    scaling_params = {
-        "min_x": float(min_x), "max_x": float(max_x),
-        "min_z": float(min_z), "max_z": float(max_z),
-        "scale": float(scale), 
-        "offset_x": float(offset_x),
-        "offset_y": float(offset_y)
-    }
+    # Based on the actual points used for clustering (same mapping as the heatmap)
+    scaling_params = compute_display_scaling(*bounds)
     # ----------------------------------
 
-    # 2. Scale Data
-    scaler = StandardScaler()
-    scaled_points = scaler.fit_transform(points_array)
+    # 2. Load (exact) or grid-collapse the samples
+    result = {
+        "levelId": level_id,
+        "sessionId": session_id,
+        "zones": [],
+        "noise_points": 0,
+        "parameters": parameters,
+        "scaling": scaling_params # Add scaling info to response
+    }
+    if method == 'grid':
+        safe_std = np.where(std > 0, std, 1.0) # Like StandardScaler for constant features
+        cell_size = float(GRID_CELL_EPS_FRACTION * eps * safe_std.min())
+        points_array, weights = _grid_cells(statement, cell_size)
+        parameters["grid_cell"] = cell_size
+        parameters["grid_cells"] = int(points_array.shape[0])
+        return result, points_array, weights, mean, safe_std
+    points_array = fetch_xz_array(statement)
+    return result, points_array, np.ones(points_array.shape[0]), None, None
+
+def cluster_zone_input(result, points_array, weights, mean=None, std=None):
+    """
+    CPU stage of cluster_level_zones(): DBSCAN and zone statistics on the
+    output of load_zone_input(). Pure NumPy/sklearn, no database or app
+    context, so it can run in worker processes (see batch_analysis.py).
+    """
+    parameters = result["parameters"]
+    eps = parameters["eps"]
+    min_samples = parameters["min_samples"]
+    if mean is not None:
+        scaled_points = (points_array - mean) / std
+    else:
+        scaler = StandardScaler()
+        scaled_points = scaler.fit_transform(points_array)
 
     # 3. Apply DBSCAN
-    dbscan = DBSCAN(eps=eps, min_samples=min_samples).fit(scaled_points)
+    dbscan = DBSCAN(eps=eps, min_samples=min_samples).fit(scaled_points, sample_weight=weights)
     labels = dbscan.labels_
     unique_labels = set(labels)
 
     # 4. Analyze Clusters
     cluster_results = []
-    noise_points_count = int(np.sum(labels == -1))
+    noise_points_count = int(weights[labels == -1].sum())
 
     all_sizes = []
     cluster_data_temp = {}
@@ -112,12 +180,13 @@ def cluster_level_zones(level_id, session_id=None, eps=0.3, min_samples=10):
         if k == -1: continue # Skip noise for now
 
         class_member_mask = (labels == k)
-        cluster_points = points_array[class_member_mask] # Original coords
-        cluster_size = cluster_points.shape[0]
+        cluster_points = points_array[class_member_mask] # Original coords (cell means in grid mode)
+        cluster_weights = weights[class_member_mask]
+        cluster_size = int(cluster_weights.sum()) # Samples, not cells
         all_sizes.append(cluster_size)
         
         # Calculate centroid (mean) and potentially bounding box or convex hull later
-        centroid = np.mean(cluster_points, axis=0)
+        centroid = np.average(cluster_points, axis=0, weights=cluster_weights)
 
         cluster_data_temp[k] = {
             "cluster_id": int(k),
@@ -147,74 +216,107 @@ def cluster_level_zones(level_id, session_id=None, eps=0.3, min_samples=10):
     # Sort results by size descending for clarity
     cluster_results.sort(key=lambda x: x['size'], reverse=True)
 
-    return {
-        "levelId": level_id,
-        "sessionId": session_id,
-        "zones": cluster_results,
-        "noise_points": noise_points_count,
-        "parameters": {"eps": eps, "min_samples": min_samples},
-        "scaling": scaling_params # Add scaling info to response
-    } 
+    result = dict(result)
+    result["zones"] = cluster_results
+    result["noise_points"] = noise_points_count
+    return result
 
-def get_event_coords_by_zone(level_id, session_id=None, event_type='death', zones=None):
+def assign_to_zones(points, centroids, max_distance=None):
     """
-    Получает события указанного типа и распределяет их координаты по ближайшим зонам.
+    Ближайший центроид для каждой точки: один пакетный запрос к cKDTree
+    (O(n log k)) вместо цикла по событиям с перебором всех зон.
 
     Args:
-        level_id (str): ID уровня.
-        session_id (str, optional): ID сессии (если нужно фильтровать).
-        event_type (str): Тип события для поиска (e.g., 'death').
-        zones (list, optional): Список словарей зон из cluster_level_zones
-                                (должен содержать 'cluster_id', 'centroid_x', 'centroid_z').
-                                Если None, зоны не будут определены.
+        points (np.ndarray): Массив (n, 2) координат X/Z.
+        centroids (np.ndarray): Массив (k, 2) центроидов зон.
+        max_distance (float, optional): Точки дальше этого расстояния от любого
+                                        центроида считаются шумом.
 
     Returns:
-        dict: Словарь, где ключ - cluster_id, а значение - список кортежей (x, z)
-              координат событий этого типа в данной зоне.
-              Ключ -1 используется для событий, не попавших ни в одну зону (шум).
+        np.ndarray: Индексы центроидов (n,), -1 для шума.
     """
-    if not zones:
-        return {}
-
-    try:
-        # 1. Запросить события нужного типа с координатами
-        query = db.session.query(GameEvent.position_x, GameEvent.position_z)\
-                    .filter(GameEvent.level_id == level_id)\
-                    .filter(GameEvent.event_type == event_type)\
-                    .filter(GameEvent.position_x.isnot(None))\
-                    .filter(GameEvent.position_z.isnot(None))
+    tree = cKDTree(centroids)
+    upper_bound = np.inf if max_distance is None else max_distance
+    _, nearest = tree.query(points, k=1, distance_upper_bound=upper_bound, workers=-1)
+    nearest[nearest == len(centroids)] = -1 # cKDTree returns k for "no neighbour within bound"
+    return nearest
 
-        if session_id:
-            query = query.filter(GameEvent.session_id == session_id)
-
-        event_coords = query.all() # Список кортежей (x, z)
-
-        if not event_coords:
-            return {}
+def count_events_by_zone(points, zones, max_distance=None):
+    """
+    Число событий в каждой зоне без списков координат (np.bincount по
+    результату assign_to_zones).
 
-        # 2. Подготовить данные для сопоставления
-        event_points = np.array([(x, z) for x, z in event_coords])
-        zone_centroids = np.array([(z['centroid_x'], z['centroid_z']) for z in zones if z.get('cluster_id', -1) != -1])
-        zone_ids = [z['cluster_id'] for z in zones if z.get('cluster_id', -1) != -1]
+    Args:
+        points (np.ndarray): Массив (n, 2) координат X/Z событий.
+        zones (list): Зоны из cluster_level_zones.
+        max_distance (float, optional): Как в assign_to_zones.
 
-        if zone_centroids.shape[0] == 0: # Если зон нет (только шум в cluster_level_zones)
-             return {-1: event_coords} # Все события считаем шумом
+    Returns:
+        dict: {cluster_id: count} для каждой зоны (включая зоны без событий),
+              ключ -1 - шум. Пустой словарь, если событий нет.
+    """
+    if points.shape[0] == 0:
+        return {}
+    zone_ids = [z['cluster_id'] for z in zones if z.get('cluster_id', -1) != -1]
+    if not zone_ids:
+        return {-1: int(points.shape[0])}
+    centroids = np.array([(z['centroid_x'], z['centroid_z']) for z in zones if z.get('cluster_id', -1) != -1])
+    nearest = assign_to_zones(points, centroids, max_distance)
+    slot = np.where(nearest >= 0, nearest, len(zone_ids)) # Последний слот - шум
+    counts = np.bincount(slot, minlength=len(zone_ids) + 1)
+    return {zid: int(n) for zid, n in zip(zone_ids + [-1], counts)} # Пустые зоны тоже: они входят в среднее
+
+def set_zone_death_counts(zone_data, deaths_by_zone):
+    """
+    Записывает число смертей в результат кластеризации: zone['deaths'] для
+    каждой зоны и zone_data['noise_deaths'] для смертей вне зон. Счетчики
+    кэшируются вместе с зонами (zone_cache) и попадают в ответ /api/zones,
+    поэтому отчет и API не пересчитывают их.
 
-        events_by_zone = {zid: [] for zid in zone_ids}
-        events_by_zone[-1] = [] # Для шума
+    Args:
+        zone_data (dict): Результат cluster_level_zones (изменяется на месте).
+        deaths_by_zone (dict): {cluster_id: count} из count_events_by_zone.
+    """
+    for zone in zone_data.get('zones', []):
+        zone['deaths'] = int(deaths_by_zone.get(zone.get('cluster_id'), 0))
+    zone_data['noise_deaths'] = int(deaths_by_zone.get(-1, 0))
+    return zone_data
 
-        # 3. Сопоставить каждое событие с ближайшим центроидом зоны
-        for i, point in enumerate(event_points):
-            distances = np.linalg.norm(zone_centroids - point, axis=1)
-            closest_zone_index = np.argmin(distances)
-            # TODO: Возможно, добавить порог максимального расстояния до центроида,
-            # чтобы считать событие шумом, если оно слишком далеко от любой зоны.
-            # пока просто присваиваем ближайшей.
-            assigned_zone_id = zone_ids[closest_zone_index]
-            events_by_zone[assigned_zone_id].append(event_coords[i]) # Добавляем оригинальные координаты (x, z)
+def zone_death_counts(zone_data):
+    """
+    {cluster_id: count} (ключ -1 - шум), записанные set_zone_death_counts,
+    или None, если в zone_data их нет (например, запись кэша старого формата).
+    """
+    if not zone_data or 'noise_deaths' not in zone_data:
+        return None
+    # Зоны с 0 смертей остаются: они входят в среднее правила "Zone of Death"
+    counts = {zone['cluster_id']: zone['deaths'] for zone in zone_data.get('zones', []) if 'deaths' in zone}
+    counts[-1] = zone_data['noise_deaths']
+    return counts
+
+def count_zone_deaths(level_id, zones, session_id=None, start=None, end=None, build=None):
+    """
+    Смерти по зонам за один проход: координаты читаются одним запросом в
+    массив (n, 2) и распределяются count_events_by_zone, без списков координат.
 
-        return events_by_zone
+    Returns:
+        dict: {cluster_id: count}, ключ -1 - шум.
+    """
+    if not zones:
+        return {}
+    deaths = fetch_xz_array(event_points_select(level_id, 'death', session_id, start, end, build))
+    return count_events_by_zone(deaths, zones, current_app.config.get('ZONE_ASSIGN_MAX_DISTANCE'))
 
-    except Exception as e:
-        current_app.logger.error(f"Error getting '{event_type}' events by zone for level {level_id}: {e}", exc_info=True)
-        return {} # Возвращаем пустой словарь в случае ошибки
\ No newline at end of file
+def event_points_select(level_id, event_type, session_id=None, start=None, end=None, build=None):
+    """SELECT of (x, z) of the events of one type on a level (optionally one session / time window / build)."""
+    statement = select(GameEvent.position_x, GameEvent.position_z).where(
+        GameEvent.level_id == level_id,
+        GameEvent.event_type == event_type,
+        GameEvent.position_x.isnot(None),
+        GameEvent.position_z.isnot(None),
+        *time_window(GameEvent.timestamp, start, end),
+        *build_filter(GameEvent.session_id, build)
+    )
+    if session_id:
+        statement = statement.where(GameEvent.session_id == session_id)
+    return statement
@@ -1,67 +1,70 @@
 from flask import Blueprint, request, jsonify, current_app
-from datetime import datetime, timezone, timedelta
-import json
+import numpy as np
 
 from . import db
-from .models import GameEvent, User # Import necessary models
 # Potentially import services if complex processing needed later
 # from .services import process_incoming_event
-from sqlalchemy import func # Needed for event counts
-from .recommendations import generate_recommendations # Import for recommendations
+from .aggregates import density_cell_size, fetch_density_cells
+from .heatmap import (
+    DEFAULT_GRID_CELL, MAX_GRID_CELL, bin_canvas_points, compute_display_scaling, fetch_xz_array,
+    json_response, position_select, to_canvas
+)
+from .ingestion import (
+    BINARY_POSITIONS_MIMETYPE, build_event_rows, decode_position_payload, store_event_rows
+)
+from .timestamps import parse_iso_timestamp
 
 # Define the blueprint
 bp = Blueprint('api', __name__, url_prefix='/api')
 
-def parse_iso_timestamp(timestamp_str):
-    """Парсит строку ISO 8601, обрабатывая 'Z' и лишние доли секунды."""
-    if not timestamp_str:
-        return None
+def _accept_event_rows(session_id, rows, build=None):
+    """Сохраняет строки батча (синхронно или через write-behind очередь) и формирует ответ."""
+    builds = {session_id: build} if build else None # Сборка клиента сохраняется в session_key
     try:
-        # Заменяем 'Z' на '+00:00' для совместимости
-        if timestamp_str.endswith('Z'):
-            timestamp_str = timestamp_str[:-1] + '+00:00'
-
-        # Проверяем и обрезаем доли секунды до 6 знаков
-        dot_index = timestamp_str.find('.')
-        # Ищем начало смещения (+ или -) после точки
-        offset_index = -1
-        plus_index = timestamp_str.find('+', dot_index if dot_index != -1 else 0)
-        minus_index = timestamp_str.find('-', dot_index if dot_index != -1 else 0)
-        if plus_index != -1 and minus_index != -1:
-            offset_index = min(plus_index, minus_index)
-        elif plus_index != -1:
-            offset_index = plus_index
-        elif minus_index != -1:
-            offset_index = minus_index
-        # else: offset_index remains -1 if no offset found
-            
-        if dot_index != -1:
-            # Определяем конец дробной части (либо знак смещения, либо конец строки)
-            end_fraction_index = offset_index if offset_index > dot_index else len(timestamp_str)
-            fractional_part = timestamp_str[dot_index + 1 : end_fraction_index]
-
-            if len(fractional_part) > 6:
-                # Обрезаем до 6 знаков
-                timestamp_str = timestamp_str[:dot_index + 1] + fractional_part[:6] + timestamp_str[end_fraction_index:]
-
-        # Теперь парсим
-        dt = datetime.fromisoformat(timestamp_str)
-
-        # Убедимся, что время в UTC (на всякий случай, если +00:00 не было)
-        if dt.tzinfo is None:
-            dt = dt.replace(tzinfo=timezone.utc)
-        return dt
-    except ValueError as e:
-        # Используем оригинальную строку в логе ошибки для ясности
-        original_str = request.get_json().get('timeStamp', '') # Try to get original for log
-        print(f"Warning: Could not parse timestamp string '{original_str}' (processed as '{timestamp_str}'), Error: {e}")
-        return None
+        # --- Write-behind: только ставим батч в очередь, запись делает фоновый поток ---
+        writer = current_app.extensions.get('ingest_writer')
+        if writer is not None and rows:
+            if not writer.submit(rows, builds):
+                response = jsonify({"error": "Ingestion queue is full, retry later"})
+                response.headers['Retry-After'] = '1'
+                return response, 429
+            return jsonify({"message": f"{len(rows)} events accepted for processing"}), 202
+
+        # --- Сохранение всех событий батча в БД ---
+        if rows:
+            store_event_rows(rows, builds)
+            db.session.commit()
+            print(f"Successfully processed {len(rows)} events for session {session_id}")
+            return jsonify({"message": f"{len(rows)} events received and processed"}), 201
+        else:
+            print(f"No valid events found in batch for session {session_id}")
+            return jsonify({"message": "No valid events processed from the batch"}), 200
+
+    except Exception as e:
+        db.session.rollback()
+        # Логируем ошибку подробнее
+        import traceback
+        print(f"Error processing event batch for session {session_id}: {e}")
+        traceback.print_exc()
+        return jsonify({"error": "Failed to process event batch due to server error"}), 500
 
 @bp.route('/events', methods=['POST'])
 def receive_events():
-    """Принимает батч событий от игрового клиента (Unity)."""
+    """Принимает батч событий от игрового клиента (Unity): JSON или компактный бинарный формат позиций."""
+    # --- Бинарный батч обновлений позиции ---
+    if request.mimetype == BINARY_POSITIONS_MIMETYPE:
+        try:
+            session_id, level_id, rows = decode_position_payload(
+                request.get_data(), request.content_encoding, current_app.config['INGEST_MAX_DECOMPRESSED_BYTES']
+            )
+        except ValueError as e:
+            return jsonify({"error": f"Invalid binary position batch: {e}"}), 400
+        if not session_id:
+            return jsonify({"error": "Missing sessionId"}), 400
+        return _accept_event_rows(session_id, rows)
+
     if not request.is_json:
-        return jsonify({"error": "Request must be JSON"}), 400
+        return jsonify({"error": f"Request must be JSON or {BINARY_POSITIONS_MIMETYPE}"}), 400
 
     data = request.get_json()
     
@@ -70,6 +73,7 @@ def receive_events():
     level_id = data.get('levelId') # Может быть null/пустым, если не установлен
     position_updates = data.get('positionUpdates', [])
     player_actions = data.get('playerActions', [])
+    build = data.get('buildVersion') # Необязательно: версия сборки клиента
 
     if not session_id:
         return jsonify({"error": "Missing sessionId"}), 400
@@ -77,190 +81,127 @@ def receive_events():
          return jsonify({"error": "Invalid format for positionUpdates (must be a list)"}), 400
     if not isinstance(player_actions, list):
          return jsonify({"error": "Invalid format for playerActions (must be a list)"}), 400
+    if build is not None and (not isinstance(build, str) or len(build) > 100):
+         return jsonify({"error": "Invalid buildVersion (must be a string of at most 100 characters)"}), 400
 
-    events_added = []
-    try:
-        # --- Обработка обновлений позиции ---
-        for pos_event in position_updates:
-            if not isinstance(pos_event, dict): continue # Пропускаем невалидные элементы
-
-            timestamp_str = pos_event.get('timeStamp')
-            position_data = pos_event.get('position')
-
-            event_timestamp = parse_iso_timestamp(timestamp_str)
-
-            # Пропускаем событие, если время или позиция невалидны
-            if event_timestamp is None or position_data is None or not isinstance(position_data, dict):
-                print(f"Warning: Skipping invalid position_update event (timestamp or position missing/invalid): {pos_event}")
-                continue
-
-            event = GameEvent(
-                event_type='position_update',
-                timestamp=event_timestamp,
-                session_id=session_id,
-                level_id=level_id,
-                position_x=position_data.get('x'),
-                position_y=position_data.get('y'),
-                position_z=position_data.get('z'),
-                event_data=None # Для position_update пока не храним доп. данные
-            )
-            events_added.append(event)
-
-        # --- Обработка действий игрока ---
-        for action_event in player_actions:
-            if not isinstance(action_event, dict): continue # Пропускаем невалидные элементы
-
-            timestamp_str = action_event.get('timeStamp')
-            event_type_str = action_event.get('eventType') # Тип действия (jump, interact, etc.)
-            position_data = action_event.get('position')
-            action_details = action_event.get('actionDetails') # Опциональные детали
-
-            event_timestamp = parse_iso_timestamp(timestamp_str)
-
-            # Пропускаем событие, если время, тип или позиция невалидны
-            if event_timestamp is None or event_type_str is None or position_data is None or not isinstance(position_data, dict):
-                print(f"Warning: Skipping invalid player_action event (timestamp, eventType, or position missing/invalid): {action_event}")
-                continue
-
-            # Сохраняем actionDetails как JSON строку в event_data
-            event_data_json = None
-            if action_details is not None:
-                try:
-                    # Создаем словарь для консистентности
-                    event_data_dict = {"details": action_details}
-                    event_data_json = json.dumps(event_data_dict)
-                except TypeError:
-                     print(f"Warning: Could not serialize actionDetails to JSON: {action_details}")
-
-
-            event = GameEvent(
-                event_type=event_type_str, # Используем тип действия
-                timestamp=event_timestamp,
-                session_id=session_id,
-                level_id=level_id,
-                position_x=position_data.get('x'),
-                position_y=position_data.get('y'),
-                position_z=position_data.get('z'),
-                event_data=event_data_json # Сохраняем детали
-            )
-            events_added.append(event)
-
-        # --- Сохранение всех событий батча в БД ---
-        if events_added:
-            db.session.add_all(events_added)
-            db.session.commit()
-            print(f"Successfully processed {len(events_added)} events for session {session_id}")
-            return jsonify({"message": f"{len(events_added)} events received and processed"}), 201
-        else:
-            print(f"No valid events found in batch for session {session_id}")
-            return jsonify({"message": "No valid events processed from the batch"}), 200
-
-    except Exception as e:
-        db.session.rollback()
-        # Логируем ошибку подробнее
-        import traceback
-        print(f"Error processing event batch for session {session_id}: {e}")
-        traceback.print_exc()
-        return jsonify({"error": "Failed to process event batch due to server error"}), 500
+    # --- Валидация и сборка строк для bulk insert ---
+    rows = build_event_rows(session_id, level_id, position_updates, player_actions)
+    return _accept_event_rows(session_id, rows, build)
 
 # Add other API endpoints here later (e.g., for heatmap data)
 
+def _analysis_filters():
+    """
+    Optional filters shared by the analysis endpoints: ?from= / ?to= (ISO 8601,
+    UTC, the window is [from, to)) and ?build= (client build of the sessions).
+
+    Returns:
+        tuple: (start, end, build, error) - error is a message for a 400 response or None.
+    """
+    time_from = request.args.get('from', '').strip()
+    time_to = request.args.get('to', '').strip()
+    start = parse_iso_timestamp(time_from) if time_from else None
+    end = parse_iso_timestamp(time_to) if time_to else None
+    if (time_from and start is None) or (time_to and end is None):
+        return None, None, None, "Invalid from/to (ISO 8601 expected)."
+    build = request.args.get('build', '').strip() or None
+    return start, end, build, None
+
 @bp.route('/heatmap', methods=['GET'])
 def get_heatmap_data():
-    """Provides position data for generating a heatmap."""
+    """
+    Provides position data for generating a heatmap.
+
+    Query parameters: level_id, session_id (optional), mode ('points' - one
+    entry per sample, default; 'grid' - counts per non-empty cell of `cell`
+    canvas pixels, default 4), from / to / build (optional, see _analysis_filters).
+    """
     level_id = request.args.get('level_id')
     session_id = request.args.get('session_id') # Optional
+    mode = request.args.get('mode', 'points')
+    cell = request.args.get('cell', DEFAULT_GRID_CELL, type=int)
+    start, end, build, filter_error = _analysis_filters()
 
     if not level_id:
         return jsonify({"error": "Missing required parameter: level_id"}), 400
+    if mode not in ('points', 'grid'):
+        return jsonify({"error": "Invalid mode (expected 'points' or 'grid')"}), 400
+    if cell is None or not 1 <= cell <= MAX_GRID_CELL:
+        return jsonify({"error": f"Invalid cell (expected an integer between 1 and {MAX_GRID_CELL})"}), 400
+    if filter_error:
+        return jsonify({"error": filter_error}), 400
 
     try:
-        query = GameEvent.query.filter(
-            GameEvent.event_type == 'position_update',
-            GameEvent.level_id == level_id
-        )
-
-        if session_id:
-            query = query.filter(GameEvent.session_id == session_id)
-
-        # Select X and Z coordinates (Y is usually height in Unity)
-        position_events = query.with_entities(
-            GameEvent.position_x,
-            # GameEvent.position_y,
-            GameEvent.position_z
-        ).filter(
-            GameEvent.position_x.isnot(None),
-            GameEvent.position_z.isnot(None)
-        ).all()
-
-        if not position_events:
+        # Grid mode reads the pre-aggregated heatmap_density cells (small indexed
+        # range scan); raw samples are only scanned for points mode or when the
+        # level has no density rows yet (e.g. before `flask rebuild-heatmap-density`).
+        # The density cells cover the whole history of every build, so a time
+        # window or build filter reads the matching samples instead. On small
+        # levels a density cell (fixed world size) is wider than a canvas cell
+        # once scaled, which would coarsen the map: raw samples are binned then.
+        weights = None
+        source = 'raw'
+        filtered = start is not None or end is not None or build is not None
+        if mode == 'grid' and not filtered and current_app.config.get('HEATMAP_USE_DENSITY', True):
+            points_array, weights = fetch_density_cells(level_id, session_id)
+            if points_array is not None:
+                density_scaling = compute_display_scaling(
+                    points_array[:, 0].min(), points_array[:, 0].max(),
+                    points_array[:, 1].min(), points_array[:, 1].max()
+                )
+                if density_cell_size() * density_scaling['scale'] <= cell:
+                    source = 'density'
+                else:
+                    weights = None
+        if source == 'raw':
+            # (n, 2) float array of X/Z read straight from the cursor, no Row objects
+            points_array = fetch_xz_array(position_select(level_id, session_id, start, end, build))
+
+        if points_array.shape[0] == 0:
              return jsonify({
                 "levelId": level_id,
                 "sessionId": session_id,
+                "mode": mode,
+                "max": 0,
                 "points": [],
                 "message": "No position data found for the given criteria."
             })
 
         # --- Scaling Logic --- Find min/max and scale to fit 600x400 container ---
-        min_x = min(p.position_x for p in position_events)
-        max_x = max(p.position_x for p in position_events)
-        min_z = min(p.position_z for p in position_events)
-        max_z = max(p.position_z for p in position_events)
-
-        range_x = max_x - min_x
-        range_z = max_z - min_z
-
-        # Target dimensions (slightly smaller than container for padding)
-        target_width = 580
-        target_height = 380
-        padding = 10 # Padding from edges
-
-        # Handle cases where range is zero (all points are the same)
-        if range_x == 0 and range_z == 0:
-            scale = 1 # No scaling needed, place in center
-            offset_x = target_width / 2 + padding
-            offset_y = target_height / 2 + padding
-        elif range_x == 0:
-            # Scale based on Z only
-            scale = target_height / range_z if range_z > 0 else 1
-            offset_x = target_width / 2 + padding # Center horizontally
-            offset_y = padding
-        elif range_z == 0:
-            # Scale based on X only
-            scale = target_width / range_x if range_x > 0 else 1
-            offset_x = padding
-            offset_y = target_height / 2 + padding # Center vertically
+        xs = points_array[:, 0]
+        zs = points_array[:, 1]
+        scaling = compute_display_scaling(xs.min(), xs.max(), zs.min(), zs.max())
+        canvas_x, canvas_y = to_canvas(xs, zs, scaling)
+
+        if mode == 'grid':
+            # Server-side 2D histogram: one entry per non-empty cell, bounded by canvas size
+            heatmap_data, max_value = bin_canvas_points(canvas_x, canvas_y, cell, weights=weights)
         else:
-             # Calculate scale based on the dimension that needs more scaling
-             scale_x = target_width / range_x
-             scale_z = target_height / range_z
-             scale = min(scale_x, scale_z) # Use smaller scale to fit and maintain aspect ratio
-             offset_x = padding
-             offset_y = padding
-
-        heatmap_data = [
-            {
-                # Scale and translate coordinates
-                "x": int(offset_x + (event.position_x - min_x) * scale),
-                "y": int(offset_y + (event.position_z - min_z) * scale), # Use Z for Y axis
-                "value": 1
-            }
-            for event in position_events
-        ]
+            # astype() truncates like int() did per point
+            heatmap_data = [
+                {"x": x, "y": y, "value": 1}
+                for x, y in zip(canvas_x.astype(np.int64).tolist(), canvas_y.astype(np.int64).tolist())
+            ]
+            max_value = 1
         # -----------------------------------------------------------------------------
 
         response_data = {
             "levelId": level_id,
             "sessionId": session_id,
-            "min_x": min_x, # Include bounds for debugging/info
-            "max_x": max_x,
-            "min_z": min_z,
-            "max_z": max_z,
-            "scale": scale,
+            "mode": mode,
+            "source": source,
+            "min_x": scaling['min_x'], # Include bounds for debugging/info
+            "max_x": scaling['max_x'],
+            "min_z": scaling['min_z'],
+            "max_z": scaling['max_z'],
+            "scale": scaling['scale'],
+            "max": max_value,
             "points": heatmap_data
         }
+        if mode == 'grid':
+            response_data["cell"] = cell
 
-        return jsonify(response_data)
+        return json_response(response_data)
 
     except Exception as e:
         # Log the exception for debugging
@@ -269,12 +210,53 @@ def get_heatmap_data():
         traceback.print_exc()
         return jsonify({"error": "Failed to retrieve heatmap data", "details": str(e)}), 500
 
+# --- Heatmap tile pyramid (zoom/pan) ---
+from .heatmap_tiles import get_pyramid, get_tile
+
+@bp.route('/heatmap/tiles/<string:level_id>', methods=['GET'])
+def get_heatmap_tiles_meta(level_id):
+    """Describes the tile pyramid of a level (rebuilt in the background if new data arrived)."""
+    session_id = request.args.get('session_id') # Optional
+    try:
+        pyramid = get_pyramid(level_id, session_id, check_stale=True)
+    except Exception as e:
+        current_app.logger.error(f"Error building heatmap tiles for level '{level_id}', session '{session_id}': {e}", exc_info=True)
+        return jsonify({"error": "Failed to build heatmap tiles", "details": str(e)}), 500
+    if pyramid is None:
+        return jsonify({"error": "No position data found for the given criteria."}), 404
+    return jsonify(pyramid['meta'])
+
+@bp.route('/heatmap/tiles/<string:level_id>/<int:z>/<int:x>/<int:y>', methods=['GET'])
+def get_heatmap_tile(level_id, z, x, y):
+    """Returns the non-empty density cells of one tile of the level's pyramid."""
+    session_id = request.args.get('session_id') # Optional
+    try:
+        pyramid = get_pyramid(level_id, session_id)
+    except Exception as e:
+        current_app.logger.error(f"Error loading heatmap tiles for level '{level_id}', session '{session_id}': {e}", exc_info=True)
+        return jsonify({"error": "Failed to load heatmap tiles", "details": str(e)}), 500
+    if pyramid is None:
+        return jsonify({"error": "No position data found for the given criteria."}), 404
+
+    tile = get_tile(pyramid, z, x, y)
+    if tile is None:
+        return jsonify({"error": f"Tile {z}/{x}/{y} is out of range"}), 404
+    tile["levelId"] = level_id
+    tile["sessionId"] = session_id
+    return json_response(tile)
+
 # --- Endpoint for Zone Clustering --- 
-from .analysis import cluster_level_zones # Import the clustering function
+from .jobs import job_status, submit_job, zone_analysis
 
 @bp.route('/zones', methods=['GET'])
 def get_level_zones():
-    """Performs clustering and generates recommendations, returns zones & recs."""
+    """
+    Performs clustering and generates recommendations, returns zones & recs.
+
+    With ?async=1 the analysis runs as a background job: the response is
+    202 with the job id, poll /api/jobs/<id> for progress and the result.
+    from / to / build limit the analysed data (see _analysis_filters).
+    """
     level_id = request.args.get('level_id')
     session_id = request.args.get('session_id') # Optional
     
@@ -284,46 +266,46 @@ def get_level_zones():
         min_samples = int(request.args.get('min_samples', 10))
     except ValueError:
         return jsonify({"error": "Invalid format for eps or min_samples parameters."}), 400
+    method = request.args.get('method', 'auto') # auto | exact | grid
+    if method not in ('auto', 'exact', 'grid'):
+        return jsonify({"error": "Invalid method. Use 'auto', 'exact' or 'grid'."}), 400
+    start, end, build, filter_error = _analysis_filters()
+    if filter_error:
+        return jsonify({"error": filter_error}), 400
 
     if not level_id:
         return jsonify({"error": "Missing required parameter: level_id"}), 400
 
-    recommendations = [] # Initialize recommendations list
+    if request.args.get('async', '').lower() in ('1', 'true', 'yes'):
+        try:
+            job = submit_job('zones', {
+                "level_id": level_id, "session_id": session_id,
+                "eps": eps, "min_samples": min_samples, "method": method,
+                "start": start.isoformat() if start else None, "end": end.isoformat() if end else None,
+                "build": build,
+            })
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Error submitting zone job for level '{level_id}': {e}", exc_info=True)
+            return jsonify({"error": "Failed to start zone analysis", "details": str(e)}), 500
+        status_url = f"/api/jobs/{job.id}"
+        response = jsonify({"jobId": job.id, "status": job.status, "statusUrl": status_url})
+        response.status_code = 202
+        response.headers['Location'] = status_url
+        return response
+
     try:
-        # --- 1. Perform Clustering --- 
-        zone_data = cluster_level_zones(
-            level_id=level_id, 
+        # Clustering (cached) + recommendations; the same code runs in background jobs
+        response_data = zone_analysis(
+            level_id, 
             session_id=session_id, 
             eps=eps, 
-            min_samples=min_samples
+            min_samples=min_samples,
+            method=method,
+            start=start,
+            end=end,
+            build=build
         )
-        
-        # --- 2. Generate Recommendations (if clustering successful) ---
-        if "error" not in zone_data:
-            try:
-                # Get event counts (filtered by session if provided)
-                event_counts_query = db.session.query(GameEvent.event_type, func.count(GameEvent.id))\
-                                        .filter(GameEvent.level_id == level_id)
-                if session_id:
-                     event_counts_query = event_counts_query.filter(GameEvent.session_id == session_id)
-                event_counts_dict = dict(event_counts_query.group_by(GameEvent.event_type).all())
-                
-                # Generate recommendations based on current zone data and counts
-                recommendations = generate_recommendations(
-                    level_id=level_id,
-                    zone_data=zone_data, 
-                    event_counts=event_counts_dict,
-                    session_id=session_id
-                )
-            except Exception as rec_e:
-                 current_app.logger.error(f"Error generating recommendations within /api/zones for level {level_id}: {rec_e}", exc_info=True)
-                 recommendations.append("Ошибка при формировании автоматических рекомендаций.")
-        
-        # --- 3. Prepare Response --- 
-        # Add recommendations to the response, even if clustering had an error (e.g., not enough data)
-        response_data = zone_data.copy()
-        response_data['recommendations'] = recommendations
-        
         return jsonify(response_data)
 
     except Exception as e:
@@ -333,4 +315,13 @@ def get_level_zones():
             "error": "Failed processing zones/recommendations", 
             "details": str(e),
             "recommendations": ["Ошибка при обработке данных для рекомендаций."] # Return error message
-            }), 500 
\ No newline at end of file
+            }), 500 
+
+# --- Background job status ---
+@bp.route('/jobs/<string:job_id>', methods=['GET'])
+def get_job_status(job_id):
+    """Status, progress and (when done) the result of a background analysis job."""
+    status = job_status(job_id)
+    if status is None:
+        return jsonify({"error": f"Job '{job_id}' not found"}), 404
+    return jsonify(status)
@@ -0,0 +1,196 @@
+# app/batch_analysis.py
+"""
+Zone clustering and recommendations for many levels at once (`flask analyze-levels`).
+
+Levels are independent and the clustering is CPU-bound, so the work is
+split in two stages:
+
+* the parent process runs the SQL of every level (load_zone_input(),
+  death coordinates, event counts) and copies the resulting float64 arrays
+  into one shared memory block per level;
+* a ProcessPoolExecutor attaches to the block, runs DBSCAN
+  (cluster_zone_input()), counts deaths per zone (stored in the zone data,
+  as get_zone_data does) and generates the recommendations, without a
+  database connection or app context. Only the block name, array shapes
+  and the small result dicts are pickled.
+
+The parent keeps loading the next levels while the workers cluster; at most
+2 * workers blocks exist at a time. Finished results are stored in the zone
+cache, so the reports of the analysed levels open without recomputing.
+"""
+
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import func, select
+
+from . import db
+from .aggregates import available_level_ids, level_data_version
+from .analysis import (
+    cluster_zone_input, count_events_by_zone, event_points_select, load_zone_input, set_zone_death_counts
+)
+from .heatmap import fetch_xz_array
+from .models import GameEvent
+from .recommendations import generate_recommendations
+from .zone_cache import store_zone_data
+
+
+def _to_shared(arrays):
+    """Copies float64 arrays into one new shared memory block. Returns (block, shapes)."""
+    arrays = [np.ascontiguousarray(a, dtype=np.float64) for a in arrays]
+    block = shared_memory.SharedMemory(create=True, size=max(sum(a.nbytes for a in arrays), 1))
+    try:
+        offset = 0
+        for a in arrays:
+            np.ndarray(a.shape, dtype=np.float64, buffer=block.buf, offset=offset)[...] = a
+            offset += a.nbytes
+    except BaseException:
+        _release(block)
+        raise
+    return block, [a.shape for a in arrays]
+
+
+def _release(block):
+    block.close()
+    block.unlink()
+
+
+def _from_shared(block, shapes):
+    """Views of the arrays stored by _to_shared (valid while the block is open)."""
+    arrays = []
+    offset = 0
+    for shape in shapes:
+        a = np.ndarray(shape, dtype=np.float64, buffer=block.buf, offset=offset)
+        arrays.append(a)
+        offset += a.nbytes
+    return arrays
+
+
+def _analyze_level(task):
+    """Worker: clustering + recommendations of one level from shared memory."""
+    started = time.perf_counter()
+    block = shared_memory.SharedMemory(name=task['block'])
+    try:
+        points, weights, deaths, stats = _from_shared(block, task['shapes'])
+        mean, std = (stats[0], stats[1]) if task['scaled'] else (None, None)
+        zone_data = cluster_zone_input(task['result'], points, weights, mean, std)
+        set_zone_death_counts(zone_data, count_events_by_zone(deaths, zone_data['zones'], task['max_distance']))
+        del points, weights, deaths, stats # Release the views before closing the block
+    finally:
+        block.close()
+    recommendations = generate_recommendations(
+        level_id=task['level_id'],
+        zone_data=zone_data,
+        event_counts=task['event_counts']
+    )
+    return zone_data, recommendations, time.perf_counter() - started
+
+
+def _level_event_counts(level_ids):
+    """{level_id: {event_type: count}} for all levels in one grouped query."""
+    counts = {level_id: {} for level_id in level_ids}
+    rows = db.session.execute(
+        select(GameEvent.level_id, GameEvent.event_type, func.count())
+        .where(GameEvent.level_id.in_(level_ids))
+        .group_by(GameEvent.level_id, GameEvent.event_type)
+    ).all()
+    for level_id, event_type, n in rows:
+        counts[level_id][event_type] = n
+    return counts
+
+
+def analyze_levels(level_ids=None, workers=None, eps=0.3, min_samples=10, method='auto', on_result=None):
+    """
+    Clusters and generates recommendations for every level (default: all) in parallel.
+
+    Args:
+        workers (int, optional): Worker processes (default: CPU count).
+        on_result (callable, optional): on_result(level_id, entry), called in
+                                        the parent as each level finishes.
+
+    Returns:
+        dict: {level_id: {'zones', 'noise_points', 'recommendations', 'load_s', 'cluster_s', 'error'?}}
+    """
+    if level_ids is None:
+        level_ids = available_level_ids()
+    level_ids = list(level_ids)
+    event_counts = _level_event_counts(level_ids)
+    max_distance = current_app.config.get('ZONE_ASSIGN_MAX_DISTANCE')
+    results = {}
+
+    def finish(level_id, entry):
+        results[level_id] = entry
+        if on_result is not None:
+            on_result(level_id, entry)
+
+    def collect(future):
+        level_id, block, version, load_s = pending.pop(future)
+        blocks.remove(block)
+        _release(block)
+        try:
+            zone_data, recommendations, cluster_s = future.result()
+        except Exception as e:
+            current_app.logger.error(f"Batch analysis failed for level {level_id}: {e}", exc_info=True)
+            finish(level_id, {"error": str(e), "load_s": load_s})
+            return
+        store_zone_data(level_id, zone_data, version, eps=eps, min_samples=min_samples, method=method)
+        finish(level_id, {
+            "zones": zone_data["zones"],
+            "noise_points": zone_data["noise_points"],
+            "method": zone_data["parameters"].get("method"),
+            "recommendations": recommendations,
+            "load_s": load_s,
+            "cluster_s": cluster_s,
+        })
+
+    pending = {} # future -> (level_id, block, version, load_s)
+    blocks = [] # Shared memory blocks not released yet
+    workers = workers or os.cpu_count() or 1
+    max_pending = 2 * workers # Shared memory blocks alive at once
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for level_id in level_ids:
+                started = time.perf_counter()
+                version = level_data_version(level_id) # Read before the data: a concurrent ingest makes the entry stale
+                result, points, weights, mean, std = load_zone_input(
+                    level_id, eps=eps, min_samples=min_samples, method=method
+                )
+                if points is None: # Too few samples, nothing to cluster
+                    store_zone_data(level_id, result, version, eps=eps, min_samples=min_samples, method=method)
+                    finish(level_id, {
+                        "zones": [], "noise_points": result["noise_points"], "method": None,
+                        "recommendations": generate_recommendations(level_id, result, event_counts[level_id]),
+                        "load_s": time.perf_counter() - started, "cluster_s": 0.0,
+                    })
+                    continue
+                scaled = mean is not None
+                stats = np.array([mean, std]) if scaled else np.zeros((2, 2))
+                block, shapes = _to_shared([points, weights, fetch_xz_array(event_points_select(level_id, 'death')), stats])
+                blocks.append(block)
+                del points, weights
+                load_s = time.perf_counter() - started
+
+                future = executor.submit(_analyze_level, {
+                    "level_id": level_id, "block": block.name, "shapes": shapes, "scaled": scaled,
+                    "result": result, "event_counts": event_counts[level_id], "max_distance": max_distance,
+                })
+                pending[future] = (level_id, block, version, load_s)
+                while len(pending) >= max_pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect(future)
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(future)
+    finally:
+        # A level failing to load (or the pool failing) must not leak blocks in /dev/shm
+        for block in blocks:
+            _release(block)
+    db.session.commit() # Persistent zone cache entries
+    return results
@@ -20,5 +20,38 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(instance_folder_path, 'app.db') # Use instance folder
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Event ingestion: batches of at least this many rows use COPY on PostgreSQL (0 disables COPY)
+    INGEST_COPY_THRESHOLD = int(os.environ.get('INGEST_COPY_THRESHOLD', 1000))
+    # Write-behind mode: /api/events answers 202 and a background thread commits batches in groups
+    INGEST_WRITE_BEHIND = os.environ.get('INGEST_WRITE_BEHIND', '').lower() in ('1', 'true', 'yes')
+    INGEST_QUEUE_MAX_BATCHES = int(os.environ.get('INGEST_QUEUE_MAX_BATCHES', 1000)) # Full queue -> 429
+    INGEST_FLUSH_INTERVAL_MS = int(os.environ.get('INGEST_FLUSH_INTERVAL_MS', 200))
+    INGEST_FLUSH_MAX_ROWS = int(os.environ.get('INGEST_FLUSH_MAX_ROWS', 5000))
+    # Compressed binary position batches are rejected once they inflate past this many bytes
+    INGEST_MAX_DECOMPRESSED_BYTES = int(os.environ.get('INGEST_MAX_DECOMPRESSED_BYTES', 64 * 1024 * 1024))
+    # Heatmap density table maintained at ingest (world units per cell; run `flask rebuild-heatmap-density` after changing).
+    # Grid heatmaps use it only while one density cell fits in a canvas cell, else they bin the raw samples
+    HEATMAP_DENSITY_CELL_SIZE = float(os.environ.get('HEATMAP_DENSITY_CELL_SIZE', 1.0))
+    HEATMAP_USE_DENSITY = os.environ.get('HEATMAP_USE_DENSITY', 'true').lower() in ('1', 'true', 'yes')
+    # Heatmap tile pyramid (/api/heatmap/tiles); stored under instance/heatmap_tiles unless HEATMAP_TILE_DIR is set
+    HEATMAP_TILE_DIR = os.environ.get('HEATMAP_TILE_DIR')
+    HEATMAP_TILE_MAX_ZOOM = int(os.environ.get('HEATMAP_TILE_MAX_ZOOM', 5))
+    HEATMAP_TILE_CELLS = int(os.environ.get('HEATMAP_TILE_CELLS', 64)) # Cells per tile side
+    # Zone analysis: events farther than this (world units) from every zone centroid count as noise (unset = nearest zone)
+    ZONE_ASSIGN_MAX_DISTANCE = float(os.environ['ZONE_ASSIGN_MAX_DISTANCE']) if os.environ.get('ZONE_ASSIGN_MAX_DISTANCE') else None
+    # Zone clustering: above this many position samples DBSCAN runs on weighted grid cells instead of raw samples
+    ZONE_CLUSTER_MAX_POINTS = int(os.environ.get('ZONE_CLUSTER_MAX_POINTS', 200000))
+    # Zone clustering cache: in-process LRU size (0 disables) and optional shared table (zone_cache_entry)
+    ZONE_CACHE_SIZE = int(os.environ.get('ZONE_CACHE_SIZE', 128))
+    ZONE_CACHE_PERSISTENT = os.environ.get('ZONE_CACHE_PERSISTENT', '').lower() in ('1', 'true', 'yes')
+    # Background analysis jobs (/api/jobs/<id>): worker threads per process, retention of finished jobs
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+    JOB_RETENTION_HOURS = int(os.environ.get('JOB_RETENTION_HOURS', 24))
+    # Level report: run uncached zone analysis as a background job instead of inside the request
+    REPORT_ASYNC_ANALYSIS = os.environ.get('REPORT_ASYNC_ANALYSIS', 'true').lower() in ('1', 'true', 'yes')
+    # Raw event export (/database/export, flask export-events): rows read and encoded per chunk
+    EXPORT_CHUNK_ROWS = int(os.environ.get('EXPORT_CHUNK_ROWS', 5000))
+    # Retention and level/session purges: events deleted per transaction
+    PURGE_CHUNK_ROWS = int(os.environ.get('PURGE_CHUNK_ROWS', 10000))
     # Add other configurations like Redis URL if needed
     # REDIS_URL = os.environ.get('REDIS_URL') or 'redis://localhost:6379/0' 
\ No newline at end of file
@@ -1,50 +1,80 @@
-from flask import Blueprint, render_template, request, flash, redirect, url_for, abort, current_app
+from flask import Blueprint, render_template, request, flash, redirect, url_for, abort, current_app, stream_with_context
 from flask_login import login_required, current_user
-from sqlalchemy import desc, asc, func, distinct
+from sqlalchemy import func, select
 
 from . import db
-from .models import GameEvent
+from .models import GameEvent, LevelSession, LevelSummary, SessionSummary
+from .event_search import event_data_filters, not_selective
+from .export import DEFAULT_CHUNK_ROWS, EXPORT_FORMATS, stream_events
+from .pagination import keyset_page
+from .aggregates import available_level_ids, forget_event
+from .jobs import submit_job
 from .admin import analyst_or_admin_required, admin_required
+from .timestamps import parse_iso_timestamp
 
 # Define the blueprint
 bp = Blueprint('db_viewer', __name__, url_prefix='/database')
 
+EVENT_COUNT_CAP = 10000 # Filtered session event totals are counted up to this ("10000+")
+
+def session_event_types(session_id):
+    """
+    Distinct event types of a session without reading all its rows: a loose
+    index scan over ix_game_event_level_session_type_timestamp, i.e. one
+    "smallest type greater than the previous one" probe per (level, type).
+    """
+    levels = db.session.execute(
+        select(LevelSession.level_id).where(LevelSession.session_id == session_id)
+    ).scalars().all()
+    event_types = set()
+    for level_id in levels + [None]: # None: events without a level
+        level_filter = GameEvent.level_id.is_(None) if level_id is None else GameEvent.level_id == level_id
+        previous = None
+        while True:
+            probe = select(func.min(GameEvent.event_type)).where(level_filter, GameEvent.session_id == session_id)
+            if previous is not None:
+                probe = probe.where(GameEvent.event_type > previous)
+            previous = db.session.execute(probe).scalar()
+            if previous is None:
+                break
+            event_types.add(previous)
+    return sorted(event_types)
+
 @bp.route('/sessions')
 @login_required
 @analyst_or_admin_required
 def view_sessions():
-    """Displays a list of game sessions with summary info."""
-    page = request.args.get('page', 1, type=int)
+    """
+    Displays a list of game sessions with summary info, newest first.
+
+    Reads session_summary (maintained at ingest) with keyset pagination on
+    (end_time, session_id): ?after= / ?before= cursors instead of page
+    numbers, so deep pages cost the same as the first one.
+    """
     per_page = 30 # Show more sessions per page
     filter_level_id = request.args.get('level_id', '').strip()
+    after = request.args.get('after')
+    before = request.args.get('before')
 
-    # Query to get session summaries
-    # We need session_id, first level_id, min timestamp, max timestamp, count
-    subquery = db.session.query(
-        GameEvent.session_id,
-        func.min(GameEvent.level_id).label('first_level_id'), # Get one level ID (e.g., the min alphabetically)
-        func.min(GameEvent.timestamp).label('start_time'),
-        func.max(GameEvent.timestamp).label('end_time'),
-        func.count(GameEvent.id).label('event_count')
-    ).group_by(GameEvent.session_id).subquery()
-
-    query = db.session.query(subquery)
-
-    # Apply level filter if provided
+    statement = select(SessionSummary)
+    # Apply level filter if provided: sessions with any event on the level
     if filter_level_id:
-        # We need to join back to GameEvent to filter by level_id associated with the session
-        # This is a bit complex, maybe filter on the first_level_id for simplicity?
-        # Or filter sessions based on *any* event matching the level ID
-        query = query.filter(subquery.c.session_id.in_(
-            db.session.query(GameEvent.session_id).filter(GameEvent.level_id == filter_level_id).distinct()
+        statement = statement.where(SessionSummary.session_id.in_(
+            select(LevelSession.session_id).where(LevelSession.level_id == filter_level_id)
         ))
-        
-    # Default sort: newest sessions first
-    query = query.order_by(desc(subquery.c.end_time))
 
+    total_sessions = None
     try:
-        pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+        pagination = keyset_page(
+            statement, [SessionSummary.end_time, SessionSummary.session_id], per_page, after=after, before=before
+        )
         sessions = pagination.items
+        if filter_level_id:
+            total_sessions = db.session.execute(
+                select(LevelSummary.session_count).where(LevelSummary.level_id == filter_level_id)
+            ).scalar()
+        else:
+            total_sessions = db.session.execute(select(func.count()).select_from(SessionSummary)).scalar()
     except Exception as e:
         current_app.logger.error(f"Error querying sessions: {e}", exc_info=True)
         flash("Error loading session list.", "danger")
@@ -54,10 +84,7 @@ def view_sessions():
     # Get distinct levels for the filter dropdown
     available_levels = []
     try:
-         levels_query = db.session.query(GameEvent.level_id)\
-                             .filter(GameEvent.level_id.isnot(None))\
-                             .distinct().order_by(GameEvent.level_id)
-         available_levels = [level[0] for level in levels_query.all()]
+         available_levels = available_level_ids() # From level_summary
     except Exception as e:
          current_app.logger.error(f"Error querying available levels for filter: {e}", exc_info=True)
 
@@ -65,6 +92,7 @@ def view_sessions():
         'database_sessions.html', 
         sessions=sessions, 
         pagination=pagination,
+        total_sessions=total_sessions,
         available_levels=available_levels,
         filter_level_id=filter_level_id
     )
@@ -73,52 +101,76 @@ def view_sessions():
 @login_required
 @analyst_or_admin_required
 def view_session_events(session_id):
-    """Display GameEvents for a specific session with filtering and sorting."""
-    page = request.args.get('page', 1, type=int)
+    """
+    Display GameEvents for a specific session with filtering and sorting.
+
+    Keyset pagination: every sort is made unique with the event id
+    ((timestamp, id), (event_type, id), ...) and pages are fetched with
+    ?after= / ?before= cursors (?last=1 for the final page), so page depth
+    does not matter. The total is exact from session_summary when no
+    filter is applied; with filters it is counted up to EVENT_COUNT_CAP
+    ("N+") unless ?count=exact is requested.
+    """
     per_page = 50 # Show more events per page for a single session
+    after = request.args.get('after')
+    before = request.args.get('before')
+    last = request.args.get('last') == '1'
+    exact_count = request.args.get('count') == 'exact'
 
     # --- Filtering (within session) --- 
     filter_event_type = request.args.get('event_type', '').strip()
     # filter_level_id is not needed here, session is specific
-    filter_event_data = request.args.get('event_data_query', '').strip()
+    filter_event_data = request.args.get('event_data_query', '').strip() # Syntax: app/event_search.py
 
     # Base query filtered by session_id
-    query = GameEvent.query.filter(GameEvent.session_id == session_id)
+    filters = [GameEvent.session_id == session_id]
 
     if filter_event_type:
-        query = query.filter(GameEvent.event_type == filter_event_type)
+        filters.append(GameEvent.event_type == filter_event_type)
     if filter_event_data:
-        query = query.filter(GameEvent.event_data.ilike(f'%{filter_event_data}%'))
+        search_filters = event_data_filters(filter_event_data, session_id=session_id) # key=value and indexed text terms
+        if search_filters:
+            filters[0] = not_selective(filters[0]) # Start from the matching ids, not the whole session
+            filters.extend(search_filters)
 
     # --- Sorting --- 
     sort_by = request.args.get('sort_by', 'timestamp') 
     order = request.args.get('order', 'asc') # Default to chronological order within session
-    # print(f"--- Sorting requested: sort_by='{sort_by}', order='{order}'") # DEBUG
-    order_func = desc if order == 'desc' else asc
+    if order not in ('asc', 'desc'):
+        order = 'asc'
 
+    # Sort key expressions + how to read them from an event (id breaks ties)
     sortable_columns = {
-        'id': GameEvent.id,
-        'timestamp': GameEvent.timestamp,
-        'event_type': GameEvent.event_type,
-        'level_id': GameEvent.level_id, # Might change within session
+        'id': ([GameEvent.id], lambda e: (e.id,)),
+        'timestamp': ([GameEvent.timestamp, GameEvent.id], lambda e: (e.timestamp, e.id)),
+        'event_type': ([GameEvent.event_type, GameEvent.id], lambda e: (e.event_type, e.id)),
+        # Might change within session; NULL would break the (key, id) comparison
+        'level_id': ([func.coalesce(GameEvent.level_id, ''), GameEvent.id], lambda e: (e.level_id or '', e.id)),
     }
-
-    sort_column_obj = sortable_columns.get(sort_by) # Get column object
-    if sort_column_obj is not None:
-        # print(f"--- Applying sort: {order_func.__name__}({sort_column_obj})") # DEBUG
-        query = query.order_by(order_func(sort_column_obj))
-    else:
+    if sort_by not in sortable_columns:
         sort_by = 'timestamp' # Fallback to default
-        # print(f"--- Applying fallback sort: asc(GameEvent.timestamp) (original sort_by='{sort_by}')") # DEBUG
-        query = query.order_by(asc(GameEvent.timestamp))
         order = 'asc' # Ensure order reflects fallback
-
-    # DEBUG query print removed for brevity
+    sort_keys, sort_values = sortable_columns[sort_by]
 
     # --- Pagination --- 
+    total_events = None
+    total_is_capped = False
     try:
-        pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+        pagination = keyset_page(
+            select(GameEvent).where(*filters), sort_keys, per_page,
+            after=after, before=before, last=last, descending=(order == 'desc'), key_values=sort_values
+        )
         events = pagination.items
+        if len(filters) == 1 and not exact_count:
+            total_events = db.session.execute(
+                select(SessionSummary.event_count).where(SessionSummary.session_id == session_id)
+            ).scalar()
+        if total_events is None:
+            limit = None if exact_count else EVENT_COUNT_CAP + 1
+            matching = select(GameEvent.id).where(*filters).limit(limit).subquery()
+            total_events = db.session.execute(select(func.count()).select_from(matching)).scalar()
+            if limit is not None and total_events > EVENT_COUNT_CAP:
+                total_events, total_is_capped = EVENT_COUNT_CAP, True
     except Exception as e:
         current_app.logger.error(f"Error querying events for session {session_id}: {e}", exc_info=True)
         flash(f"Error loading events for session {session_id}.", "danger")
@@ -129,10 +181,7 @@ def view_session_events(session_id):
     distinct_event_types = []
     if events: # Query only if there are events to avoid unnecessary query
         try:
-            types_query = db.session.query(GameEvent.event_type)\
-                                .filter(GameEvent.session_id == session_id)\
-                                .distinct().order_by(GameEvent.event_type)
-            distinct_event_types = [item[0] for item in types_query.all()]
+            distinct_event_types = session_event_types(session_id)
         except Exception as e:
             current_app.logger.error(f"Error querying event types for session {session_id}: {e}", exc_info=True)
 
@@ -147,9 +196,52 @@ def view_session_events(session_id):
         distinct_event_types=distinct_event_types,
         # Pass sorting values back to template
         current_sort_by=sort_by,
-        current_order=order
+        current_order=order,
+        total_events=total_events,
+        total_is_capped=total_is_capped
     )
 
+@bp.route('/export')
+@login_required
+@analyst_or_admin_required
+def export_events():
+    """
+    Streams the raw events of a level and/or session as a download.
+
+    Query: level_id and/or session_id (at least one), optional from/to
+    (ISO 8601, UTC), format=csv|ndjson|parquet. The response is chunked:
+    rows are read and encoded EXPORT_CHUNK_ROWS at a time (app/export.py).
+    """
+    level_id = request.args.get('level_id', '').strip()
+    session_id = request.args.get('session_id', '').strip()
+    fmt = request.args.get('format', 'csv')
+    time_from = request.args.get('from', '').strip()
+    time_to = request.args.get('to', '').strip()
+    start = parse_iso_timestamp(time_from) if time_from else None
+    end = parse_iso_timestamp(time_to) if time_to else None
+
+    if not level_id and not session_id:
+        abort(400, description="Specify level_id and/or session_id.")
+    if fmt not in EXPORT_FORMATS:
+        abort(400, description=f"Unknown format. Use one of: {', '.join(EXPORT_FORMATS)}.")
+    if (time_from and start is None) or (time_to and end is None):
+        abort(400, description="Invalid from/to timestamp (ISO 8601 expected).")
+
+    try:
+        chunks = stream_events(
+            fmt, level_id=level_id or None, session_id=session_id or None, start=start, end=end,
+            chunk_rows=current_app.config.get('EXPORT_CHUNK_ROWS', DEFAULT_CHUNK_ROWS)
+        )
+    except ValueError as e: # Parquet without pyarrow
+        abort(501, description=str(e))
+
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    name = '_'.join(part for part in ('events', level_id, session_id) if part)
+    filename = "".join(c if c.isalnum() or c in '-_.' else '_' for c in name) + '.' + extension
+    response = current_app.response_class(stream_with_context(chunks), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
 @bp.route('/events/<int:event_id>/delete', methods=['POST'])
 @login_required
 @analyst_or_admin_required
@@ -162,6 +254,7 @@ def delete_event(event_id):
 
     session_id_redirect = event_to_delete.session_id # Get session id before deleting
     try:
+        forget_event(event_to_delete) # Keep ingest-time aggregates consistent
         db.session.delete(event_to_delete)
         db.session.commit()
         flash(f"Event #{event_id} deleted successfully.", "success")
@@ -178,55 +271,35 @@ def delete_event(event_id):
 @login_required
 @admin_required # Require admin for bulk delete
 def delete_session_events_all(session_id):
-    """Deletes ALL GameEvents for a specific session."""
+    """Starts a background job deleting ALL GameEvents of a session (partitions.purge_session_events)."""
     try:
-        # Count events before deleting (optional, for flash message)
-        count = GameEvent.query.filter_by(session_id=session_id).count()
-        
-        # Perform bulk delete
-        deleted_count = GameEvent.query.filter_by(session_id=session_id).delete()
-        db.session.commit()
-        
-        if deleted_count > 0:
-            flash(f"Successfully deleted {deleted_count} events for session {session_id}.", "success")
-        else:
-            flash(f"No events found to delete for session {session_id}.", "info")
-            
+        job = submit_job('purge_session', {"session_id": session_id})
+        flash(f"Deleting all events for session {session_id} in the background.", "info")
     except Exception as e:
         db.session.rollback()
-        current_app.logger.error(f"Error deleting all events for session {session_id}: {e}", exc_info=True)
+        current_app.logger.error(f"Error starting the purge of session {session_id}: {e}", exc_info=True)
         flash(f"Error deleting events for session {session_id}.", "danger")
+        return redirect(url_for('.view_sessions'))
 
-    # Redirect back to the main session list
-    return redirect(url_for('.view_sessions'))
+    # The session list polls the job and shows its progress
+    return redirect(url_for('.view_sessions', purge_job=job.id))
 
 @bp.route('/level/<string:level_id>/delete_all', methods=['POST'])
 @login_required
 @admin_required # Require admin for bulk delete
 def delete_level_events_all(level_id):
-    """Deletes ALL GameEvents for a specific level."""
+    """Starts a background job deleting ALL GameEvents of a level (partitions.purge_level_events)."""
     if not level_id:
         flash("Level ID cannot be empty.", "warning")
         return redirect(url_for('.view_sessions'))
-        
+
     try:
-        # Count events before deleting
-        count = GameEvent.query.filter_by(level_id=level_id).count()
-        
-        # Perform bulk delete
-        deleted_count = GameEvent.query.filter_by(level_id=level_id).delete()
-        db.session.commit()
-        
-        if deleted_count > 0:
-            flash(f"Successfully deleted {deleted_count} events for level '{level_id}'.", "success")
-        else:
-            flash(f"No events found to delete for level '{level_id}'.", "info")
-            
+        job = submit_job('purge_level', {"level_id": level_id})
+        flash(f"Deleting all events for level '{level_id}' in the background.", "info")
     except Exception as e:
         db.session.rollback()
-        current_app.logger.error(f"Error deleting all events for level {level_id}: {e}", exc_info=True)
+        current_app.logger.error(f"Error starting the purge of level {level_id}: {e}", exc_info=True)
         flash(f"Error deleting events for level '{level_id}'.", "danger")
+        return redirect(url_for('.view_sessions'))
 
-    # Redirect back to the main session list, preserving filter maybe?
-    # For now, just redirect to the base list
-    return redirect(url_for('.view_sessions'))
\ No newline at end of file
+    return redirect(url_for('.view_sessions', purge_job=job.id))
\ No newline at end of file
@@ -0,0 +1,244 @@
+# app/event_search.py
+"""
+Indexed search over GameEvent.event_data (the actionDetails of player actions).
+
+`event_data_query` of the session event viewer accepts whitespace separated
+terms (double quotes group words):
+
+* `key=value` - an actionDetails field equals the value (case-insensitive),
+  nested fields with dots: `weapon.name="iron sword"`;
+* anything else - the event data contains the text (case-insensitive).
+
+All terms must match. The two kinds use different indexes:
+
+* key=value terms read event_attribute, filled at ingest with one row per
+  scalar field of actionDetails (`index_events`);
+* text terms use a text index over the event data: on SQLite the
+  event_data_fts table (FTS5, trigram tokenizer, so it matches substrings
+  like LIKE did; rowid = game_event.id), written next to event_attribute;
+  on PostgreSQL a pg_trgm GIN index on event_data::text that serves ILIKE
+  directly. Terms shorter than a trigram, and databases without either
+  index, fall back to scanning with LIKE.
+
+The tables and the index are created by the migration;
+`rebuild_event_search` fills them from existing history. The aggregates'
+forget_* hooks and the retention purge remove the rows of deleted events.
+"""
+
+import json
+import shlex
+
+from sqlalchemy import Text, cast, column, delete, func, insert, select, table, text
+
+from . import db
+from .models import EventAttribute, GameEvent
+
+FTS_TABLE = 'event_data_fts'
+FTS_MIN_TERM_LENGTH = 3 # Trigram tokenizer: shorter terms cannot use the index
+MAX_KEY_LENGTH = 100
+MAX_VALUE_LENGTH = 200
+MAX_DEPTH = 3 # actionDetails nesting levels that are extracted
+REBUILD_CHUNK_ROWS = 20000
+
+# pg_trgm index serving ILIKE over the serialized event data (also recreated by partitions.convert_to_partitioned)
+POSTGRESQL_SEARCH_INDEX = (
+    f"CREATE INDEX IF NOT EXISTS ix_game_event_event_data_trgm ON {GameEvent.__tablename__} "
+    "USING gin ((event_data::text) gin_trgm_ops)"
+)
+
+_fts = table(FTS_TABLE, column('rowid'), column('body'), column(FTS_TABLE))
+
+
+def _has_event_data():
+    # Rows inserted with event_data=None hold the JSON text 'null', not SQL NULL
+    return GameEvent.event_data.isnot(None) & (cast(GameEvent.event_data, Text) != 'null')
+
+
+def _attribute_value(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value).lower()[:MAX_VALUE_LENGTH]
+
+
+def _decode(event_data):
+    """event_data as stored at ingest (JSON text) or already decoded -> decoded value."""
+    if isinstance(event_data, str):
+        try:
+            return json.loads(event_data)
+        except ValueError:
+            return event_data
+    return event_data
+
+
+def extract_attributes(event_data):
+    """
+    (key, value) pairs of the actionDetails in a decoded event_data value.
+
+    Scalar fields become pairs, nested objects dotted keys (up to MAX_DEPTH),
+    lists and nulls are skipped. Scalar actionDetails are stored under the
+    key "details".
+    """
+    if not isinstance(event_data, dict) or 'details' not in event_data:
+        return []
+
+    pairs = []
+
+    def walk(prefix, value, depth):
+        if isinstance(value, dict):
+            if depth < MAX_DEPTH:
+                for key, nested in value.items():
+                    walk(f"{prefix}.{key}" if prefix else str(key), nested, depth + 1)
+        elif isinstance(value, (str, int, float, bool)) and prefix and len(prefix) <= MAX_KEY_LENGTH:
+            pairs.append((prefix, _attribute_value(value)))
+
+    details = event_data['details']
+    walk('' if isinstance(details, dict) else 'details', details, 0)
+    return pairs
+
+
+def index_events(events):
+    """
+    Writes the search rows (attributes, SQLite text index) of freshly
+    inserted events, inside the current transaction. `events` yields
+    (event_id, session_id, event_data). Returns the number of attributes.
+    """
+    attributes = []
+    texts = []
+    for event_id, session_id, event_data in events:
+        decoded = _decode(event_data)
+        if decoded is None:
+            continue
+        attributes.extend(
+            {"event_id": event_id, "session_id": session_id, "key": key, "value": value}
+            for key, value in extract_attributes(decoded)
+        )
+        texts.append({"rowid": event_id, "body": json.dumps(decoded, ensure_ascii=False)})
+    if attributes:
+        db.session.execute(insert(EventAttribute.__table__), attributes)
+    if texts and _use_fts():
+        db.session.execute(insert(_fts), texts)
+    return len(attributes)
+
+
+def parse_event_data_query(query):
+    """
+    Splits a search string into ([(key, value), ...], [text, ...]).
+
+    Unbalanced quotes are treated as plain characters.
+    """
+    try:
+        tokens = shlex.split(query)
+    except ValueError:
+        tokens = query.split()
+    pairs, texts = [], []
+    for token in tokens:
+        key, sep, value = token.partition('=')
+        if sep and key and value:
+            pairs.append((key, value.lower()))
+        elif token:
+            texts.append(token)
+    return pairs, texts
+
+
+def _use_fts():
+    """True on SQLite databases that have the FTS5 table (created by the migration)."""
+    if db.session.get_bind().dialect.name != 'sqlite':
+        return False
+    return db.session.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": FTS_TABLE}
+    ).scalar() is not None
+
+
+def _text_condition(term, use_fts):
+    if use_fts and len(term) >= FTS_MIN_TERM_LENGTH:
+        phrase = '"' + term.replace('"', '""') + '"' # FTS5 string: the term as one substring
+        return GameEvent.id.in_(select(_fts.c.rowid).where(_fts.c[FTS_TABLE].op('MATCH')(phrase)))
+    # PostgreSQL: same expression as ix_game_event_event_data_trgm, so the GIN index is used
+    return cast(GameEvent.event_data, Text).ilike(f'%{term}%')
+
+
+def not_selective(condition):
+    """
+    Marks a filter combined with the search as non-selective for the planner.
+
+    Without statistics (no ANALYZE) SQLite assumes `session_id = ?` matches
+    a handful of rows and walks the whole session through its index,
+    testing every row against the search subqueries; likely() makes it start
+    from the matching ids instead. Other databases plan from statistics.
+    """
+    if db.session.get_bind().dialect.name == 'sqlite':
+        return func.likely(condition)
+    return condition
+
+
+def event_data_filters(query, session_id=None):
+    """
+    GameEvent filter conditions for an event_data search string (see the
+    module docstring for the syntax). `session_id` narrows the attribute
+    lookups to one session's index range.
+    """
+    pairs, texts = parse_event_data_query(query)
+    filters = []
+    for key, value in pairs:
+        matching = select(EventAttribute.event_id).where(EventAttribute.key == key, EventAttribute.value == value)
+        if session_id is not None:
+            matching = matching.where(EventAttribute.session_id == session_id)
+        filters.append(GameEvent.id.in_(matching))
+    if texts:
+        use_fts = _use_fts()
+        filters.extend(_text_condition(term, use_fts) for term in texts)
+    return filters
+
+
+def rebuild_event_search(session_id=None):
+    """
+    Recomputes event_attribute from game_event history (one session or all)
+    and, on SQLite, rebuilds the FTS5 table. Returns the number of attributes.
+    """
+    filters = [_has_event_data()]
+    if session_id is not None:
+        remove_event_search_for_session(session_id)
+        filters.append(GameEvent.session_id == session_id)
+    else:
+        db.session.execute(delete(EventAttribute.__table__))
+        if _use_fts():
+            db.session.execute(delete(_fts))
+
+    total = 0
+    last_id = 0
+    while True:
+        chunk = db.session.execute(
+            select(GameEvent.id, GameEvent.session_id, GameEvent.event_data)
+            .where(*filters, GameEvent.id > last_id).order_by(GameEvent.id).limit(REBUILD_CHUNK_ROWS)
+        ).all()
+        if not chunk:
+            break
+        last_id = chunk[-1][0]
+        total += index_events(chunk)
+    return total
+
+
+# --- Deletes mirrored from game_event (run before the events are deleted) ---
+
+def remove_event_search(event_filter):
+    """Deletes the search rows of the events matching a GameEvent condition."""
+    event_ids = select(GameEvent.id).where(event_filter, _has_event_data())
+    db.session.execute(delete(EventAttribute.__table__).where(EventAttribute.event_id.in_(event_ids)))
+    if _use_fts():
+        db.session.execute(delete(_fts).where(_fts.c.rowid.in_(event_ids)))
+
+
+def remove_event_search_for_session(session_id):
+    db.session.execute(delete(EventAttribute.__table__).where(EventAttribute.session_id == session_id))
+    if _use_fts():
+        db.session.execute(delete(_fts).where(_fts.c.rowid.in_(
+            select(GameEvent.id).where(GameEvent.session_id == session_id, _has_event_data())
+        )))
+
+
+def remove_event_search_for_event(event):
+    if event.event_data is None:
+        return
+    db.session.execute(delete(EventAttribute.__table__).where(EventAttribute.event_id == event.id))
+    if _use_fts():
+        db.session.execute(delete(_fts).where(_fts.c.rowid == event.id))
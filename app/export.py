@@ -0,0 +1,222 @@
+# app/export.py
+"""
+Streaming export of raw game events (GET /database/export, `flask export-events`).
+
+Events of a level and/or session, optionally limited to a [start, end) time
+window, are read with a streaming cursor (yield_per: a server-side cursor
+on PostgreSQL, incremental fetches on SQLite) and encoded one chunk of
+EXPORT_CHUNK_ROWS rows at a time, so memory use does not depend on the
+size of the export. Formats:
+
+* csv - header row, timestamps as ISO 8601 UTC, event_data as JSON text;
+* ndjson - one JSON object per line, event_data decoded;
+* parquet - one row group per chunk (needs the optional pyarrow package).
+"""
+
+import csv
+import io
+import json
+
+from sqlalchemy import Text, cast, select
+
+from . import db
+from .models import GameEvent
+from .timestamps import time_window
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError: # Optional: only needed for Parquet exports
+    pyarrow = None
+
+DEFAULT_CHUNK_ROWS = 5000
+
+EXPORT_COLUMNS = (
+    'id',
+    'event_type',
+    'timestamp',
+    'session_id',
+    'level_id',
+    'position_x',
+    'position_y',
+    'position_z',
+    'event_data',
+)
+
+# format -> (mimetype, file extension)
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+
+def export_select(level_id=None, session_id=None, start=None, end=None):
+    """
+    SELECT of EXPORT_COLUMNS for the given filters, in id (insertion) order.
+    event_data is read as its stored text, not decoded per row.
+    """
+    columns = [getattr(GameEvent, name) for name in EXPORT_COLUMNS[:-1]]
+    statement = select(*columns, cast(GameEvent.event_data, Text).label('event_data'))\
+        .where(*time_window(GameEvent.timestamp, start, end))
+    if level_id:
+        statement = statement.where(GameEvent.level_id == level_id)
+    if session_id:
+        statement = statement.where(GameEvent.session_id == session_id)
+    return statement.order_by(GameEvent.id)
+
+
+def iter_event_chunks(statement, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Yields lists of at most chunk_rows result rows, fetched incrementally (Core, no ORM row processing)."""
+    result = db.session.connection().execute(statement.execution_options(yield_per=chunk_rows))
+    try:
+        for partition in result.partitions():
+            yield partition
+    finally:
+        result.close()
+
+
+def _timestamp_text(value):
+    return value.isoformat() + 'Z' if value is not None else None
+
+
+def _encode_csv(chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(EXPORT_COLUMNS)
+    yield buffer.getvalue().encode('utf-8') # Header even when nothing matches
+    buffer.seek(0)
+    buffer.truncate()
+    for rows in chunks:
+        writer.writerows(
+            (event_id, event_type, _timestamp_text(timestamp), session_id, level_id, x, y, z, _event_data_text(event_data))
+            for event_id, event_type, timestamp, session_id, level_id, x, y, z, event_data in rows
+        )
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def _event_data_text(stored):
+    """JSON text of a stored event_data value, None when empty."""
+    if stored is None or stored == 'null': # None is stored as JSON null
+        return None
+    if stored.startswith('"'): # Ingest stores the JSON text as a JSON string
+        try:
+            return json.loads(stored)
+        except ValueError:
+            pass
+    return stored
+
+
+def _decoded_event_data(stored):
+    text = _event_data_text(stored)
+    if text is None:
+        return None
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def _encode_ndjson(chunks):
+    for rows in chunks:
+        lines = []
+        for event_id, event_type, timestamp, session_id, level_id, x, y, z, event_data in rows:
+            lines.append(json.dumps({
+                "id": event_id, "event_type": event_type, "timestamp": _timestamp_text(timestamp),
+                "session_id": session_id, "level_id": level_id,
+                "position_x": x, "position_y": y, "position_z": z,
+                "event_data": _decoded_event_data(event_data),
+            }, ensure_ascii=False))
+        lines.append('')
+        yield '\n'.join(lines).encode('utf-8')
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands out what was written since the last take()."""
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def take(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+def _parquet_schema():
+    return pyarrow.schema([
+        ('id', pyarrow.int64()),
+        ('event_type', pyarrow.string()),
+        ('timestamp', pyarrow.timestamp('us', tz='UTC')),
+        ('session_id', pyarrow.string()),
+        ('level_id', pyarrow.string()),
+        ('position_x', pyarrow.float64()),
+        ('position_y', pyarrow.float64()),
+        ('position_z', pyarrow.float64()),
+        ('event_data', pyarrow.string()),
+    ])
+
+
+def _encode_parquet(chunks):
+    schema = _parquet_schema()
+    sink = _ChunkSink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema, compression='zstd')
+    try:
+        for rows in chunks:
+            columns = list(zip(*rows))
+            columns[-1] = [_event_data_text(stored) for stored in columns[-1]]
+            writer.write_table(pyarrow.Table.from_arrays(
+                [pyarrow.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema
+            ))
+            yield sink.take()
+    finally:
+        writer.close()
+    yield sink.take() # Footer
+
+
+_ENCODERS = {
+    'csv': _encode_csv,
+    'ndjson': _encode_ndjson,
+    'parquet': _encode_parquet,
+}
+
+
+def stream_events(fmt, level_id=None, session_id=None, start=None, end=None, chunk_rows=DEFAULT_CHUNK_ROWS,
+                  on_chunk=None):
+    """
+    Generator of the encoded export, chunk by chunk (bytes).
+
+    Args:
+        fmt (str): One of EXPORT_FORMATS.
+        on_chunk (callable, optional): on_chunk(row_count), called after each
+                                       chunk is read (progress reporting).
+
+    Raises:
+        ValueError: Unknown format, or Parquet without pyarrow installed.
+    """
+    if fmt not in _ENCODERS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    if fmt == 'parquet' and pyarrow is None:
+        raise ValueError("Parquet export requires the 'pyarrow' package")
+
+    def chunks():
+        for rows in iter_event_chunks(export_select(level_id, session_id, start, end), chunk_rows):
+            if on_chunk is not None:
+                on_chunk(len(rows))
+            yield rows
+
+    return _ENCODERS[fmt](chunks())
@@ -0,0 +1,162 @@
+# app/heatmap.py
+"""
+Heatmap helpers shared by /api/heatmap and the zone analysis.
+
+Positions are drawn on a 600x400 canvas (heatmap.js container); world X/Z
+coordinates are fitted into a 580x380 target area with 10px padding.
+"""
+
+import json
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import select
+
+from . import db
+from .models import GameEvent
+from .positions import build_filter, level_key_id, position_sample_select
+from .timestamps import time_window
+
+try:
+    import orjson
+except ImportError: # Optional: faster JSON encoding of large heatmap payloads
+    orjson = None
+
+FETCH_CHUNK_ROWS = 50000 # Rows pulled from the DBAPI cursor per fetchmany()
+
+TARGET_WIDTH = 580 # Slightly smaller than the 600x400 container, for padding
+TARGET_HEIGHT = 380
+PADDING = 10
+CANVAS_WIDTH = TARGET_WIDTH + 2 * PADDING
+CANVAS_HEIGHT = TARGET_HEIGHT + 2 * PADDING
+
+DEFAULT_GRID_CELL = 4 # Canvas pixels per grid cell in ?mode=grid
+MAX_GRID_CELL = 100
+
+
+def compute_display_scaling(min_x, max_x, min_z, max_z):
+    """
+    Calculates scale/offsets that map world (X, Z) into the display area.
+
+    Returns:
+        dict: {'min_x', 'max_x', 'min_z', 'max_z', 'scale', 'offset_x', 'offset_y'}
+    """
+    range_x = max_x - min_x
+    range_z = max_z - min_z
+
+    scale = 1.0 # Default scale
+    offset_x = PADDING
+    offset_y = PADDING
+
+    # Handle cases where range is zero (all points are the same)
+    if range_x == 0 and range_z == 0:
+        offset_x = TARGET_WIDTH / 2 + PADDING # No scaling needed, place in center
+        offset_y = TARGET_HEIGHT / 2 + PADDING
+    elif range_x == 0:
+        scale = TARGET_HEIGHT / range_z # Scale based on Z only
+        offset_x = TARGET_WIDTH / 2 + PADDING # Center horizontally
+    elif range_z == 0:
+        scale = TARGET_WIDTH / range_x # Scale based on X only
+        offset_y = TARGET_HEIGHT / 2 + PADDING # Center vertically
+    else:
+        # Use smaller scale to fit and maintain aspect ratio
+        scale = min(TARGET_WIDTH / range_x, TARGET_HEIGHT / range_z)
+
+    return {
+        "min_x": float(min_x), "max_x": float(max_x),
+        "min_z": float(min_z), "max_z": float(max_z),
+        "scale": float(scale),
+        "offset_x": float(offset_x),
+        "offset_y": float(offset_y)
+    }
+
+
+def to_canvas(xs, zs, scaling):
+    """Maps world X/Z arrays to float canvas coordinates (Z becomes the canvas Y axis)."""
+    canvas_x = scaling['offset_x'] + (xs - scaling['min_x']) * scaling['scale']
+    canvas_y = scaling['offset_y'] + (zs - scaling['min_z']) * scaling['scale']
+    return canvas_x, canvas_y
+
+
+def bin_canvas_points(canvas_x, canvas_y, cell=DEFAULT_GRID_CELL, weights=None):
+    """
+    Aggregates canvas points into a 2D histogram of `cell`-pixel squares.
+
+    The payload is bounded by the canvas size (at most 600/cell * 400/cell
+    cells), not by the number of samples.
+
+    Returns:
+        tuple: (points, max) where points is a list of {'x', 'y', 'value'} for
+               non-empty cells, placed at the cell centre.
+    """
+    x_edges = np.arange(0, CANVAS_WIDTH + cell, cell)
+    y_edges = np.arange(0, CANVAS_HEIGHT + cell, cell)
+    counts, _, _ = np.histogram2d(canvas_x, canvas_y, bins=(x_edges, y_edges), weights=weights)
+
+    ix, iy = np.nonzero(counts)
+    values = counts[ix, iy]
+    half = cell / 2
+    points = [
+        {"x": int(x), "y": int(y), "value": int(v)}
+        for x, y, v in zip(x_edges[ix] + half, y_edges[iy] + half, values)
+    ]
+    max_value = int(values.max()) if values.size else 0
+    return points, max_value
+
+
+def position_select(level_id, session_id=None, start=None, end=None, build=None):
+    """
+    SELECT of (x, z) for the position samples of a level (optionally one
+    session, a [start, end) time window and one client build).
+
+    Reads the compact position_sample table; levels that have no samples
+    there yet (history not rebuilt after an upgrade) fall back to game_event.
+    """
+    if level_key_id(level_id) is not None:
+        return position_sample_select(level_id, session_id, start, end, build)
+
+    # Select X and Z coordinates (Y is usually height in Unity)
+    statement = select(GameEvent.position_x, GameEvent.position_z).where(
+        GameEvent.event_type == 'position_update',
+        GameEvent.level_id == level_id,
+        GameEvent.position_x.isnot(None),
+        GameEvent.position_z.isnot(None),
+        *time_window(GameEvent.timestamp, start, end),
+        *build_filter(GameEvent.session_id, build)
+    )
+    if session_id:
+        statement = statement.where(GameEvent.session_id == session_id)
+    return statement
+
+
+def fetch_xz_array(statement):
+    """
+    Executes a two-column (x, z) SELECT and returns an (n, 2) float64 array.
+
+    Rows are read in chunks straight from the DBAPI cursor, so no SQLAlchemy
+    Row objects are built for what can be millions of samples.
+    """
+    # Core execution on the session's connection gives a plain CursorResult
+    result = db.session.connection().execute(statement)
+    try:
+        cursor = result.cursor
+        chunks = []
+        while True:
+            rows = cursor.fetchmany(FETCH_CHUNK_ROWS)
+            if not rows:
+                break
+            chunks.append(np.array(rows, dtype=np.float64).reshape(-1, 2))
+    finally:
+        result.close()
+    if not chunks:
+        return np.empty((0, 2), dtype=np.float64)
+    return np.concatenate(chunks) if len(chunks) > 1 else chunks[0]
+
+
+def json_response(payload, status=200):
+    """Serializes a (possibly large) payload with orjson when available."""
+    if orjson is not None:
+        body = orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY)
+    else:
+        body = json.dumps(payload, separators=(',', ':'))
+    return current_app.response_class(body, status=status, mimetype='application/json')
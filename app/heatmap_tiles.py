@@ -0,0 +1,280 @@
+# app/heatmap_tiles.py
+"""
+Precomputed multi-resolution heatmap tiles (zoom/pan exploration).
+
+For every level (and optionally a single session) a pyramid of density
+grids is built once and stored on disk as a compressed .npz file in
+`HEATMAP_TILE_DIR` (default: <instance>/heatmap_tiles), one directory per
+level (<level>/level.npz, <level>/sessions/<session>.npz). Each pyramid:
+
+* the level is fitted into a square of side `extent` world units, anchored
+  at (min_x, min_z);
+* zoom z splits that square into 2^z x 2^z tiles of `tile_cells` x
+  `tile_cells` cells, so the finest grid is tile_cells * 2^max_zoom cells
+  across;
+* only non-empty cells are stored, sorted by tile, so serving a tile is a
+  binary search plus a slice: O(visible cells), not O(all events).
+
+A pyramid remembers the level data version it was built from (watermark,
+aggregates.level_data_version, bumped by ingest and by every delete);
+`get_pyramid(..., check_stale=True)` keeps serving it and rebuilds it in a
+background job ('heatmap_tiles') when the level changed.
+Session pyramids follow their level's version. The purge jobs remove the
+files of a deleted level or session (`remove_pyramids`).
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+from urllib.parse import quote
+
+import numpy as np
+from flask import current_app
+
+from .aggregates import level_data_version
+from .heatmap import fetch_xz_array, position_select
+
+DEFAULT_TILE_CELLS = 64
+DEFAULT_MAX_ZOOM = 5
+
+_cache_lock = threading.Lock()
+_pyramid_cache = {} # file path -> pyramid dict
+
+
+def _tile_dir():
+    return current_app.config.get('HEATMAP_TILE_DIR') or \
+        os.path.join(current_app.instance_path, 'heatmap_tiles')
+
+
+def _path_component(identifier):
+    # quote() keeps '.', so '.' / '..' would not be plain directory names
+    return quote(identifier, safe='').replace('.', '%2E')
+
+
+def _level_dir(level_id):
+    return os.path.join(_tile_dir(), _path_component(level_id))
+
+
+def _pyramid_path(level_id, session_id=None):
+    """<dir>/<level>/level.npz, or <dir>/<level>/sessions/<session>.npz for a session pyramid."""
+    if session_id:
+        return os.path.join(_level_dir(level_id), 'sessions', _path_component(session_id) + '.npz')
+    return os.path.join(_level_dir(level_id), 'level.npz')
+
+
+def data_watermark(level_id, session_id=None):
+    """Data version of the level (one primary-key lookup); session pyramids use their level's version."""
+    return level_data_version(level_id)
+
+
+def _combine(ix, iy, counts, n):
+    """Sums counts of duplicate (ix, iy) cells on an n x n grid."""
+    keys, inverse = np.unique(ix * n + iy, return_inverse=True)
+    summed = np.bincount(inverse.ravel(), weights=counts, minlength=keys.size).astype(np.int64)
+    return keys // n, keys % n, summed
+
+
+def build_pyramid(points_array, max_zoom=DEFAULT_MAX_ZOOM, tile_cells=DEFAULT_TILE_CELLS):
+    """
+    Builds the sparse tile pyramid for an (n, 2) array of world X/Z points.
+
+    Returns:
+        dict: {'meta': {...}, 'levels': {z: (tile_ids, cell_x, cell_y, counts)}}
+              with arrays sorted by tile id.
+    """
+    xs = points_array[:, 0]
+    zs = points_array[:, 1]
+    min_x, min_z = float(xs.min()), float(zs.min())
+    extent = float(max(xs.max() - min_x, zs.max() - min_z)) or 1.0 # Square, avoids zero size
+
+    n = tile_cells << max_zoom # Cells across at the finest zoom
+    ix = np.clip(((xs - min_x) / extent * n).astype(np.int64), 0, n - 1)
+    iy = np.clip(((zs - min_z) / extent * n).astype(np.int64), 0, n - 1)
+    ix, iy, counts = _combine(ix, iy, np.ones(ix.size), n)
+
+    levels = {}
+    zoom_max_counts = {}
+    for z in range(max_zoom, -1, -1):
+        if z != max_zoom: # Coarser zoom: merge 2x2 cells
+            n //= 2
+            ix, iy, counts = _combine(ix >> 1, iy >> 1, counts, n)
+        tiles_across = 1 << z
+        tile_ids = (ix // tile_cells) * tiles_across + (iy // tile_cells)
+        order = np.argsort(tile_ids, kind='stable')
+        levels[z] = (
+            tile_ids[order],
+            (ix % tile_cells)[order].astype(np.int32),
+            (iy % tile_cells)[order].astype(np.int32),
+            counts[order],
+        )
+        zoom_max_counts[z] = int(counts.max()) if counts.size else 0
+
+    meta = {
+        "min_x": min_x, "min_z": min_z, "extent": extent,
+        "max_zoom": max_zoom, "tile_cells": tile_cells,
+        "points": int(points_array.shape[0]),
+        "zoom_max_counts": zoom_max_counts,
+    }
+    return {"meta": meta, "levels": levels}
+
+
+def _save(pyramid, path):
+    arrays = {"meta": np.array(json.dumps(pyramid['meta']))}
+    for z, (tile_ids, cell_x, cell_y, counts) in pyramid['levels'].items():
+        arrays[f"z{z}_tile"] = tile_ids
+        arrays[f"z{z}_x"] = cell_x
+        arrays[f"z{z}_y"] = cell_y
+        arrays[f"z{z}_c"] = counts
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    # Unique temp file: two processes rebuilding the same pyramid must not write into one file
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-', suffix='.npz')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(tmp_path, path) # Readers never see a half-written file
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def _load(path):
+    with np.load(path) as data:
+        meta = json.loads(str(data['meta']))
+        meta['zoom_max_counts'] = {int(z): c for z, c in meta['zoom_max_counts'].items()}
+        levels = {
+            z: (data[f"z{z}_tile"], data[f"z{z}_x"], data[f"z{z}_y"], data[f"z{z}_c"])
+            for z in range(meta['max_zoom'] + 1)
+        }
+    return {"meta": meta, "levels": levels}
+
+
+def rebuild_pyramid(level_id, session_id=None):
+    """Builds and stores the pyramid from current data; returns None if the level has no positions."""
+    watermark = data_watermark(level_id, session_id)
+    points_array = fetch_xz_array(position_select(level_id, session_id))
+    path = _pyramid_path(level_id, session_id)
+    if points_array.shape[0] == 0:
+        with _cache_lock:
+            _pyramid_cache.pop(path, None)
+        if os.path.exists(path):
+            os.remove(path)
+        return None
+
+    pyramid = build_pyramid(
+        points_array,
+        max_zoom=current_app.config.get('HEATMAP_TILE_MAX_ZOOM', DEFAULT_MAX_ZOOM),
+        tile_cells=current_app.config.get('HEATMAP_TILE_CELLS', DEFAULT_TILE_CELLS),
+    )
+    pyramid['meta'].update({"levelId": level_id, "sessionId": session_id, "watermark": watermark})
+    _save(pyramid, path)
+    with _cache_lock:
+        _pyramid_cache[path] = pyramid
+    return pyramid
+
+
+def _remove_file(path):
+    with _cache_lock:
+        _pyramid_cache.pop(path, None)
+    try:
+        os.remove(path)
+        return 1
+    except FileNotFoundError:
+        return 0
+
+
+def remove_pyramids(level_id=None, session_id=None):
+    """
+    Deletes the stored pyramids of a level (including its session pyramids)
+    or of a session (on every level). Returns the number of files removed.
+    """
+    directory = _tile_dir()
+    if not os.path.isdir(directory):
+        return 0
+    if level_id is not None:
+        level_dir = _level_dir(level_id)
+        if not os.path.isdir(level_dir):
+            return 0
+        paths = [os.path.join(level_dir, 'level.npz')]
+        sessions_dir = os.path.join(level_dir, 'sessions')
+        if os.path.isdir(sessions_dir):
+            paths += [os.path.join(sessions_dir, name) for name in os.listdir(sessions_dir) if name.endswith('.npz')]
+        removed = sum(_remove_file(path) for path in paths)
+        shutil.rmtree(level_dir, ignore_errors=True)
+        return removed
+    name = _path_component(session_id) + '.npz'
+    return sum(
+        _remove_file(os.path.join(directory, level_name, 'sessions', name))
+        for level_name in os.listdir(directory)
+    )
+
+
+def _schedule_rebuild(level_id, session_id=None):
+    """Rebuilds the pyramid in a background job (one at a time per pyramid, see submit_job)."""
+    from .jobs import submit_job # jobs imports this module
+
+    try:
+        submit_job('heatmap_tiles', {"level_id": level_id, "session_id": session_id})
+    except RuntimeError: # No job runner (init_jobs not called): rebuild here
+        rebuild_pyramid(level_id, session_id)
+
+
+def get_pyramid(level_id, session_id=None, check_stale=False):
+    """
+    Returns the stored pyramid (building it on first use), or None if there is no data.
+
+    With check_stale=True a pyramid older than the level data is still
+    returned, and a background job rebuilds it: ingest bumps the version
+    with every batch, a rebuild per request would redo the whole pyramid.
+    """
+    path = _pyramid_path(level_id, session_id)
+    with _cache_lock:
+        pyramid = _pyramid_cache.get(path)
+    if pyramid is None and os.path.exists(path):
+        pyramid = _load(path)
+        with _cache_lock:
+            _pyramid_cache[path] = pyramid
+    if pyramid is None:
+        return rebuild_pyramid(level_id, session_id)
+    if check_stale and pyramid['meta'].get('watermark') != data_watermark(level_id, session_id):
+        _schedule_rebuild(level_id, session_id)
+    return pyramid
+
+
+def get_tile(pyramid, z, x, y):
+    """
+    Returns the non-empty cells of one tile.
+
+    Returns:
+        dict: {'z', 'x', 'y', 'bounds', 'max', 'cells': [{'x', 'y', 'value'}]}
+              with cell x/y relative to the tile, or None if z/x/y is out of range.
+    """
+    meta = pyramid['meta']
+    tiles_across = 1 << z
+    if z > meta['max_zoom'] or not (0 <= x < tiles_across and 0 <= y < tiles_across):
+        return None
+
+    tile_ids, cell_x, cell_y, counts = pyramid['levels'][z]
+    tile_id = x * tiles_across + y
+    start = np.searchsorted(tile_ids, tile_id, side='left')
+    end = np.searchsorted(tile_ids, tile_id, side='right')
+    tile_counts = counts[start:end]
+
+    tile_size = meta['extent'] / tiles_across # World units covered by one tile
+    return {
+        "z": z, "x": x, "y": y,
+        "bounds": {
+            "min_x": meta['min_x'] + x * tile_size, "max_x": meta['min_x'] + (x + 1) * tile_size,
+            "min_z": meta['min_z'] + y * tile_size, "max_z": meta['min_z'] + (y + 1) * tile_size,
+        },
+        "max": int(tile_counts.max()) if tile_counts.size else 0,
+        "cells": [
+            {"x": cx, "y": cy, "value": c}
+            for cx, cy, c in zip(cell_x[start:end].tolist(), cell_y[start:end].tolist(), tile_counts.tolist())
+        ],
+    }
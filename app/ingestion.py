@@ -0,0 +1,487 @@
+# app/ingestion.py
+"""
+Bulk ingestion of event batches sent by the game client.
+
+`receive_events` used to build one `GameEvent` ORM object per sample and hand
+them to the session, which spends most of its time in unit-of-work
+bookkeeping. Here a batch is validated into plain column tuples (in
+`EVENT_COLUMNS` order) and written with a single Core `INSERT` executed as
+executemany, or with `COPY ... FROM STDIN` on PostgreSQL for large batches.
+"""
+
+import atexit
+import csv
+import io
+import json
+import math
+import queue
+import struct
+import threading
+import time
+import zlib
+from itertools import repeat
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import insert
+
+from . import db
+from .aggregates import apply_ingested_rows
+from .event_search import index_events
+from .models import GameEvent
+from .positions import insert_position_samples, record_session_builds
+from .timestamps import parse_timestamps
+
+# Column order of the tuples produced by build_event_rows()
+EVENT_COLUMNS = (
+    'event_type',
+    'timestamp',
+    'session_id',
+    'level_id',
+    'position_x',
+    'position_y',
+    'position_z',
+    'event_data',
+)
+
+# Batches at least this large go through COPY on PostgreSQL
+DEFAULT_COPY_THRESHOLD = 1000
+
+try:
+    import zstandard
+except ImportError: # Optional: only needed for Content-Encoding: zstd
+    zstandard = None
+
+# --- Compact binary position batches ---
+# Content-Type of the binary format accepted by POST /api/events.
+# Layout (little-endian):
+#   magic  b'GFPB' | version u8 | flags u8 | len(sessionId) u16 | len(levelId) u16
+#   sessionId utf-8 | levelId utf-8 | count u32
+#   count x record: timestamp i64 (epoch microseconds, UTC), x f4, y f4, z f4
+# The body may be compressed with Content-Encoding: gzip or zstd.
+BINARY_POSITIONS_MIMETYPE = 'application/vnd.gameflow.positions'
+BINARY_MAGIC = b'GFPB'
+BINARY_VERSION = 1
+_BINARY_HEADER = struct.Struct('<4sBBHH')
+_BINARY_COUNT = struct.Struct('<I')
+POSITION_RECORD_DTYPE = np.dtype([('t', '<i8'), ('x', '<f4'), ('y', '<f4'), ('z', '<f4')])
+
+
+def _coordinates(position_data):
+    """
+    (x, y, z) of a JSON position, or None if a coordinate is present but not
+    a finite number (strings, booleans, NaN/Infinity). Missing coordinates
+    stay None, as before.
+    """
+    coords = (position_data.get('x'), position_data.get('y'), position_data.get('z'))
+    for value in coords:
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+            return None
+    return coords
+
+
+def build_event_rows(session_id, level_id, position_updates, player_actions):
+    """
+    Validates the samples of one batch and converts them to column tuples.
+
+    Invalid samples are skipped with a warning, exactly as the per-object
+    code path did.
+
+    Returns:
+        list: Tuples ordered like EVENT_COLUMNS.
+    """
+    rows = []
+    append = rows.append
+
+    # Все timeStamp батча декодируются одним вызовом (с кэшем общих префиксов)
+    position_timestamps = parse_timestamps(
+        [e.get('timeStamp') if isinstance(e, dict) else None for e in position_updates]
+    )
+    action_timestamps = parse_timestamps(
+        [e.get('timeStamp') if isinstance(e, dict) else None for e in player_actions]
+    )
+
+    # --- Обработка обновлений позиции ---
+    for pos_event, event_timestamp in zip(position_updates, position_timestamps):
+        if not isinstance(pos_event, dict): continue # Пропускаем невалидные элементы
+
+        position_data = pos_event.get('position')
+
+        # Пропускаем событие, если время или позиция невалидны
+        if event_timestamp is None or not isinstance(position_data, dict):
+            print(f"Warning: Skipping invalid position_update event (timestamp or position missing/invalid): {pos_event}")
+            continue
+        coords = _coordinates(position_data)
+        if coords is None:
+            print(f"Warning: Skipping position_update event with non-numeric or non-finite coordinates: {pos_event}")
+            continue
+
+        append((
+            'position_update',
+            event_timestamp,
+            session_id,
+            level_id,
+            *coords,
+            None, # Для position_update пока не храним доп. данные
+        ))
+
+    # --- Обработка действий игрока ---
+    for action_event, event_timestamp in zip(player_actions, action_timestamps):
+        if not isinstance(action_event, dict): continue # Пропускаем невалидные элементы
+
+        event_type_str = action_event.get('eventType') # Тип действия (jump, interact, etc.)
+        position_data = action_event.get('position')
+        action_details = action_event.get('actionDetails') # Опциональные детали
+
+        # Пропускаем событие, если время, тип или позиция невалидны
+        if event_timestamp is None or event_type_str is None or not isinstance(position_data, dict):
+            print(f"Warning: Skipping invalid player_action event (timestamp, eventType, or position missing/invalid): {action_event}")
+            continue
+        coords = _coordinates(position_data)
+        if coords is None:
+            print(f"Warning: Skipping player_action event with non-numeric or non-finite coordinates: {action_event}")
+            continue
+
+        # Сохраняем actionDetails как JSON строку в event_data
+        event_data_json = None
+        if action_details is not None:
+            try:
+                event_data_json = json.dumps({"details": action_details})
+            except TypeError:
+                print(f"Warning: Could not serialize actionDetails to JSON: {action_details}")
+
+        append((
+            event_type_str,
+            event_timestamp,
+            session_id,
+            level_id,
+            *coords,
+            event_data_json,
+        ))
+
+    return rows
+
+
+# Cap on the decompressed size of a payload (compression bombs); overridable per call
+DEFAULT_MAX_DECOMPRESSED_BYTES = 64 * 1024 * 1024
+_DECOMPRESS_CHUNK = 1024 * 1024
+
+
+def _gunzip(body, max_size):
+    """gzip.decompress() that stops once the output exceeds max_size."""
+    parts, size = [], 0
+    data = body
+    while data:
+        decompressor = zlib.decompressobj(wbits=31) # One gzip member; concatenated members loop
+        while not decompressor.eof:
+            chunk = decompressor.decompress(data, _DECOMPRESS_CHUNK)
+            size += len(chunk)
+            if size > max_size:
+                raise ValueError(f"Decompressed payload exceeds {max_size} bytes")
+            parts.append(chunk)
+            data = decompressor.unconsumed_tail
+            if not data and not chunk:
+                break # Input used up: truncated stream
+        if not decompressor.eof:
+            raise ValueError("Compressed file ended before the end-of-stream marker was reached")
+        data = decompressor.unused_data
+    return b''.join(parts)
+
+
+def _unzstd(body, max_size):
+    parts, size = [], 0
+    with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(body)) as reader:
+        while True:
+            chunk = reader.read(_DECOMPRESS_CHUNK)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_size:
+                raise ValueError(f"Decompressed payload exceeds {max_size} bytes")
+            parts.append(chunk)
+    return b''.join(parts)
+
+
+def _decompress(body, content_encoding, max_size=DEFAULT_MAX_DECOMPRESSED_BYTES):
+    """
+    Decompresses a request body in chunks, never holding more than max_size
+    bytes of output. Raises ValueError for oversized, corrupt or unsupported
+    payloads.
+    """
+    if not content_encoding or content_encoding == 'identity':
+        return body
+    if content_encoding == 'gzip':
+        try:
+            return _gunzip(body, max_size)
+        except zlib.error as e:
+            raise ValueError(f"Could not decompress payload: {e}")
+    if content_encoding == 'zstd':
+        if zstandard is None:
+            raise ValueError("zstd payloads require the 'zstandard' package")
+        try:
+            return _unzstd(body, max_size)
+        except zstandard.ZstdError as e:
+            raise ValueError(f"Could not decompress payload: {e}")
+    raise ValueError(f"Unsupported Content-Encoding: {content_encoding}")
+
+
+def decode_position_payload(body, content_encoding=None, max_size=DEFAULT_MAX_DECOMPRESSED_BYTES):
+    """
+    Decodes a binary position batch (BINARY_POSITIONS_MIMETYPE).
+
+    The records are read zero-copy with numpy.frombuffer; samples with a
+    non-finite coordinate are skipped like invalid JSON samples are.
+    Compressed bodies are rejected once they inflate past max_size bytes.
+
+    Returns:
+        tuple: (session_id, level_id, rows) with rows ordered like EVENT_COLUMNS.
+
+    Raises:
+        ValueError: If the payload is malformed.
+    """
+    body = _decompress(body, content_encoding, max_size)
+    if len(body) < _BINARY_HEADER.size:
+        raise ValueError("Payload too short")
+    magic, version, _flags, session_len, level_len = _BINARY_HEADER.unpack_from(body, 0)
+    if magic != BINARY_MAGIC:
+        raise ValueError("Bad magic, not a GameFlow position batch")
+    if version != BINARY_VERSION:
+        raise ValueError(f"Unsupported binary format version {version}")
+
+    offset = _BINARY_HEADER.size
+    ids_end = offset + session_len + level_len
+    if len(body) < ids_end + _BINARY_COUNT.size:
+        raise ValueError("Payload truncated in header")
+    try:
+        session_id = body[offset:offset + session_len].decode('utf-8')
+        level_id = body[offset + session_len:ids_end].decode('utf-8') or None
+    except UnicodeDecodeError:
+        raise ValueError("sessionId/levelId must be UTF-8")
+    (count,) = _BINARY_COUNT.unpack_from(body, ids_end)
+    offset = ids_end + _BINARY_COUNT.size
+    if len(body) != offset + count * POSITION_RECORD_DTYPE.itemsize:
+        raise ValueError("Record section size does not match count")
+
+    records = np.frombuffer(body, dtype=POSITION_RECORD_DTYPE, count=count, offset=offset)
+    valid = np.isfinite(records['x']) & np.isfinite(records['y']) & np.isfinite(records['z'])
+    if not valid.all():
+        print(f"Warning: Skipping {int(count - valid.sum())} binary position samples with non-finite coordinates")
+        records = records[valid]
+
+    timestamps = records['t'].astype('datetime64[us]').tolist() # Naive UTC datetimes
+    rows = list(zip(
+        repeat('position_update'),
+        timestamps,
+        repeat(session_id),
+        repeat(level_id),
+        records['x'].astype(np.float64).tolist(),
+        records['y'].astype(np.float64).tolist(),
+        records['z'].astype(np.float64).tolist(),
+        repeat(None),
+    ))
+    return session_id, level_id, rows
+
+
+def _copy_rows_postgresql(rows):
+    """Streams rows into game_event with COPY FROM STDIN (psycopg2 only)."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    json_index = EVENT_COLUMNS.index('event_data')
+    for row in rows:
+        values = ['\\N' if value is None else value for value in row]
+        if row[json_index] is not None:
+            # The JSON column stores the encoded value, same as the ORM would
+            values[json_index] = json.dumps(row[json_index])
+        writer.writerow(values)
+    buffer.seek(0)
+
+    dbapi_connection = db.session.connection().connection.dbapi_connection
+    with dbapi_connection.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY {GameEvent.__tablename__} ({', '.join(EVENT_COLUMNS)}) "
+            "FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+            buffer
+        )
+
+
+def bulk_insert_events(rows):
+    """
+    Writes column tuples to game_event inside the current session transaction.
+
+    The caller is responsible for commit/rollback.
+    """
+    if not rows:
+        return 0
+
+    bind = db.session.get_bind()
+    copy_threshold = current_app.config.get('INGEST_COPY_THRESHOLD', DEFAULT_COPY_THRESHOLD)
+    if bind.dialect.name == 'postgresql' and bind.dialect.driver == 'psycopg2' \
+            and copy_threshold and len(rows) >= copy_threshold:
+        _copy_rows_postgresql(rows)
+    else:
+        # A list of parameter dicts makes SQLAlchemy use executemany / insertmanyvalues
+        db.session.execute(
+            insert(GameEvent.__table__),
+            [dict(zip(EVENT_COLUMNS, row)) for row in rows]
+        )
+    return len(rows)
+
+
+def insert_events_returning_ids(rows):
+    """
+    Inserts column tuples into game_event and returns their ids in row order
+    (batched INSERT ... RETURNING where the dialect supports it).
+    """
+    table = GameEvent.__table__
+    params = [dict(zip(EVENT_COLUMNS, row)) for row in rows]
+    if db.session.get_bind().dialect.insert_executemany_returning_sort_by_parameter_order:
+        statement = insert(table).returning(table.c.id, sort_by_parameter_order=True)
+        return db.session.execute(statement, params).scalars().all()
+    return [db.session.execute(insert(table), p).inserted_primary_key[0] for p in params]
+
+
+def store_event_rows(rows, builds=None):
+    """
+    Inserts ingested rows (game_event plus position_sample) and updates the
+    aggregates maintained at ingest time, all inside the current session
+    transaction (caller commits). `builds` ({session_id: build}) records the
+    client build of the batch sessions on session_key.
+
+    Rows carrying event_data (player actions with actionDetails, a small
+    share of a batch) are inserted separately with their ids returned, so
+    their search attributes can reference them.
+    """
+    json_index = EVENT_COLUMNS.index('event_data')
+    detail_rows = [row for row in rows if row[json_index] is not None]
+    if detail_rows:
+        count = bulk_insert_events([row for row in rows if row[json_index] is None])
+        event_ids = insert_events_returning_ids(detail_rows)
+        index_events((event_id, row[2], row[json_index]) for event_id, row in zip(event_ids, detail_rows))
+        count += len(detail_rows)
+    else:
+        count = bulk_insert_events(rows)
+    if count:
+        insert_position_samples(rows)
+        apply_ingested_rows(rows)
+    if builds:
+        record_session_builds(builds)
+    return count
+
+
+class WriteBehindWriter:
+    """
+    Optional write-behind ingestion (INGEST_WRITE_BEHIND).
+
+    `receive_events` validates a batch and hands its rows to `submit()`,
+    which only enqueues them. A background thread drains the bounded queue
+    and coalesces batches from all sessions into one transaction per
+    `flush_interval_ms` / `flush_max_rows`, so request latency no longer
+    depends on commit latency.
+    """
+
+    def __init__(self, app, max_batches=1000, flush_interval_ms=200, flush_max_rows=5000):
+        self.app = app
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.flush_max_rows = flush_max_rows
+        self._queue = queue.Queue(maxsize=max_batches)
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='ingest-writer', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def submit(self, rows, builds=None):
+        """Enqueues rows (and their sessions' builds); returns False when the queue is full (backpressure)."""
+        if self._stopping.is_set():
+            return False
+        try:
+            self._queue.put_nowait((rows, builds))
+        except queue.Full:
+            return False
+        return True
+
+    def flush(self):
+        """Blocks until every batch enqueued so far has been written."""
+        self._queue.join()
+
+    def stop(self, timeout=30):
+        """Flush-on-shutdown hook: stops accepting batches and drains the queue."""
+        if self._stopping.is_set():
+            return
+        self._stopping.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def _collect(self):
+        """Waits for a first batch, then coalesces more until time or size limit."""
+        try:
+            pending = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        row_count = len(pending[0][0])
+        deadline = time.monotonic() + self.flush_interval
+        while row_count < self.flush_max_rows:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            pending.append(batch)
+            row_count += len(batch[0])
+        return pending
+
+    def _write(self, pending):
+        rows = [row for batch_rows, _builds in pending for row in batch_rows]
+        builds = {}
+        for _rows, batch_builds in pending:
+            builds.update(batch_builds or {})
+        with self.app.app_context():
+            try:
+                store_event_rows(rows, builds)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                if len(pending) == 1:
+                    self.app.logger.error(f"Write-behind flush failed, {len(rows)} events dropped: {e}", exc_info=True)
+                else:
+                    # One bad batch must not lose the others of the group: retry them one by one
+                    self.app.logger.warning(f"Write-behind flush of {len(pending)} batches failed, retrying separately: {e}")
+                    self._write_separately(pending)
+        for _ in pending:
+            self._queue.task_done()
+
+    def _write_separately(self, pending):
+        """Writes each batch in its own transaction (inside an app context); failed batches are dropped."""
+        for batch_rows, batch_builds in pending:
+            try:
+                store_event_rows(batch_rows, batch_builds)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                self.app.logger.error(f"Write-behind batch failed, {len(batch_rows)} events dropped: {e}", exc_info=True)
+
+    def _run(self):
+        while not (self._stopping.is_set() and self._queue.empty()):
+            pending = self._collect()
+            if pending:
+                self._write(pending)
+
+
+def init_write_behind(app):
+    """Starts the write-behind writer if INGEST_WRITE_BEHIND is enabled."""
+    if not app.config.get('INGEST_WRITE_BEHIND'):
+        return None
+    writer = WriteBehindWriter(
+        app,
+        max_batches=app.config.get('INGEST_QUEUE_MAX_BATCHES', 1000),
+        flush_interval_ms=app.config.get('INGEST_FLUSH_INTERVAL_MS', 200),
+        flush_max_rows=app.config.get('INGEST_FLUSH_MAX_ROWS', 5000),
+    )
+    app.extensions['ingest_writer'] = writer
+    writer.start()
+    return writer
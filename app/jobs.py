@@ -0,0 +1,257 @@
+# app/jobs.py
+"""
+In-process background jobs for long-running analyses (no external broker).
+
+`submit_job(kind, params)` records a job in the analysis_job table and runs
+its handler on a thread pool (JOB_WORKERS threads) inside an app context.
+Status, progress and the JSON result live in the table, so
+GET /api/jobs/<id> works from any worker process. Submitting a job whose
+kind and parameters match one that is still queued or running returns the
+existing job instead of starting a duplicate.
+
+Handlers are registered in JOB_HANDLERS: handler(params, progress) -> result,
+where progress(fraction, message) updates the job row.
+"""
+
+import atexit
+import datetime
+import hashlib
+import json
+import os
+import socket
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from sqlalchemy import delete, func
+
+from . import db
+from .heatmap_tiles import rebuild_pyramid, remove_pyramids
+from .models import AnalysisJob, GameEvent
+from .partitions import purge_level_events, purge_session_events
+from .positions import build_filter
+from .recommendations import generate_recommendations
+from .timestamps import parse_iso_timestamp, time_window
+from .zone_cache import get_zone_data
+
+DEFAULT_WORKERS = 2
+DEFAULT_RETENTION_HOURS = 24
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+
+def zone_analysis(level_id, session_id=None, eps=0.3, min_samples=10, method='auto',
+                  start=None, end=None, build=None, progress=None):
+    """
+    Zones plus recommendations, the payload of /api/zones.
+
+    Returns:
+        dict: cluster_level_zones() result with a 'recommendations' list.
+    """
+    if progress:
+        progress(0.1, "Clustering positions")
+    zone_data = get_zone_data(
+        level_id=level_id, session_id=session_id, eps=eps, min_samples=min_samples,
+        start=start, end=end, method=method, build=build
+    )
+
+    recommendations = []
+    if "error" not in zone_data:
+        if progress:
+            progress(0.7, "Generating recommendations")
+        try:
+            # Get event counts (filtered by session if provided)
+            event_counts_query = db.session.query(GameEvent.event_type, func.count(GameEvent.id))\
+                                    .filter(GameEvent.level_id == level_id)\
+                                    .filter(*time_window(GameEvent.timestamp, start, end))\
+                                    .filter(*build_filter(GameEvent.session_id, build))
+            if session_id:
+                event_counts_query = event_counts_query.filter(GameEvent.session_id == session_id)
+            event_counts_dict = dict(event_counts_query.group_by(GameEvent.event_type).all())
+
+            recommendations = generate_recommendations(
+                level_id=level_id,
+                zone_data=zone_data,
+                event_counts=event_counts_dict,
+                session_id=session_id,
+                start=start,
+                end=end,
+                build=build
+            )
+        except Exception as rec_e:
+            current_app.logger.error(f"Error generating recommendations for level {level_id}: {rec_e}", exc_info=True)
+            recommendations.append("Ошибка при формировании автоматических рекомендаций.")
+
+    zone_data['recommendations'] = recommendations
+    return zone_data
+
+
+def _zones_job(params, progress):
+    return zone_analysis(
+        params['level_id'],
+        session_id=params.get('session_id'),
+        eps=params.get('eps', 0.3),
+        min_samples=params.get('min_samples', 10),
+        method=params.get('method', 'auto'),
+        start=parse_iso_timestamp(params['start']) if params.get('start') else None,
+        end=parse_iso_timestamp(params['end']) if params.get('end') else None,
+        build=params.get('build'),
+        progress=progress,
+    )
+
+
+def _purge_level_job(params, progress):
+    result = purge_level_events(params['level_id'], progress=progress)
+    result['tile_pyramids_removed'] = remove_pyramids(level_id=params['level_id'])
+    return result
+
+
+def _purge_session_job(params, progress):
+    result = purge_session_events(params['session_id'], progress=progress)
+    result['tile_pyramids_removed'] = remove_pyramids(session_id=params['session_id'])
+    return result
+
+
+def _heatmap_tiles_job(params, progress):
+    pyramid = rebuild_pyramid(params['level_id'], params.get('session_id'))
+    return {"points": pyramid['meta']['points'] if pyramid is not None else 0}
+
+
+JOB_HANDLERS = {
+    'zones': _zones_job,
+    'purge_level': _purge_level_job,
+    'purge_session': _purge_session_job,
+    'heatmap_tiles': _heatmap_tiles_job,
+}
+
+
+def _owner():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _owner_alive(owner):
+    """False only when the owner is a process on this host that has exited."""
+    host, _, pid = (owner or '').rpartition(':')
+    if host != socket.gethostname() or not pid.isdigit():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _params_key(kind, params):
+    return hashlib.sha1(json.dumps([kind, params], sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _update_job(job_id, **values):
+    db.session.query(AnalysisJob).filter(AnalysisJob.id == job_id).update(values)
+    db.session.commit()
+
+
+def _run_job(app, job_id, kind, params):
+    with app.app_context():
+        _update_job(job_id, status='running', started_at=datetime.datetime.utcnow(), progress=0.0)
+
+        def progress(fraction, message=None):
+            _update_job(job_id, progress=float(fraction), message=message)
+
+        try:
+            result = JOB_HANDLERS[kind](params, progress)
+            _update_job(
+                job_id, status='done', progress=1.0, message=None,
+                result=json.dumps(result), finished_at=datetime.datetime.utcnow()
+            )
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f"Job {job_id} ({kind}) failed: {e}", exc_info=True)
+            _update_job(job_id, status='failed', error=str(e), finished_at=datetime.datetime.utcnow())
+        finally:
+            db.session.remove()
+
+
+def submit_job(kind, params):
+    """
+    Queues a job (or returns the identical one already queued/running).
+
+    Returns:
+        AnalysisJob: The job row.
+    """
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    executor = current_app.extensions.get('job_executor')
+    if executor is None:
+        raise RuntimeError("Job runner is not initialized (init_jobs)")
+
+    params_key = _params_key(kind, params)
+    existing = AnalysisJob.query.filter(
+        AnalysisJob.params_key == params_key,
+        AnalysisJob.status.in_(ACTIVE_STATUSES)
+    ).order_by(AnalysisJob.created_at.desc()).first()
+    if existing is not None and _owner_alive(existing.owner):
+        return existing
+
+    _prune_finished_jobs()
+    job = AnalysisJob(
+        id=uuid.uuid4().hex, kind=kind, params=json.dumps(params), params_key=params_key,
+        status='queued', progress=0.0, owner=_owner()
+    )
+    db.session.add(job)
+    db.session.commit()
+    executor.submit(_run_job, current_app._get_current_object(), job.id, kind, params)
+    return job
+
+
+def _prune_finished_jobs():
+    hours = current_app.config.get('JOB_RETENTION_HOURS', DEFAULT_RETENTION_HOURS)
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(hours=hours)
+    db.session.execute(delete(AnalysisJob.__table__).where(
+        AnalysisJob.status.notin_(ACTIVE_STATUSES), AnalysisJob.finished_at < cutoff
+    ))
+
+
+def job_status(job_id):
+    """
+    Returns the public status dict of a job, or None if it does not exist.
+
+    A queued/running job whose worker process on this host has exited is
+    reported (and stored) as failed.
+    """
+    job = db.session.get(AnalysisJob, job_id)
+    if job is None:
+        return None
+    if job.status in ACTIVE_STATUSES and not _owner_alive(job.owner):
+        job.status = 'failed'
+        job.error = "Worker process exited before the job finished"
+        job.finished_at = datetime.datetime.utcnow()
+        db.session.commit()
+
+    status = {
+        "jobId": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "progress": job.progress,
+        "message": job.message,
+        "params": json.loads(job.params),
+        "createdAt": job.created_at.isoformat() + 'Z' if job.created_at else None,
+        "startedAt": job.started_at.isoformat() + 'Z' if job.started_at else None,
+        "finishedAt": job.finished_at.isoformat() + 'Z' if job.finished_at else None,
+    }
+    if job.status == 'done':
+        status["result"] = json.loads(job.result)
+    elif job.status == 'failed':
+        status["error"] = job.error
+    return status
+
+
+def init_jobs(app):
+    """Creates the job thread pool (JOB_WORKERS threads)."""
+    executor = ThreadPoolExecutor(
+        max_workers=app.config.get('JOB_WORKERS', DEFAULT_WORKERS), thread_name_prefix='analysis-job'
+    )
+    app.extensions['job_executor'] = executor
+    atexit.register(executor.shutdown, wait=False)
+    return executor
@@ -42,10 +42,25 @@ class User(UserMixin, db.Model):
 
 # Add models for Game Events, Sessions, Reports etc. later
 class GameEvent(db.Model):
+    # Composite indexes matching the analytical access paths. Coordinates are
+    # key columns rather than INCLUDE columns so the index is covering on
+    # SQLite too (no INCLUDE there).
+    __table_args__ = (
+        # Heatmap / zones / deaths: level + event type (+ session) -> X/Z
+        db.Index('ix_game_event_level_type_session_xz',
+                 'level_id', 'event_type', 'session_id', 'position_x', 'position_z'),
+        # Level report: (session, event type) -> count, time range of a level in one covering scan
+        db.Index('ix_game_event_level_session_type_timestamp', 'level_id', 'session_id', 'event_type', 'timestamp'),
+        # Session event viewer (ordered by time); replaces the plain session_id index
+        db.Index('ix_game_event_session_timestamp', 'session_id', 'timestamp'),
+        # Time-window analyses (report metrics, event counts): level + time range, covering
+        db.Index('ix_game_event_level_timestamp_type_session', 'level_id', 'timestamp', 'event_type', 'session_id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     event_type = db.Column(db.String(100), index=True)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.datetime.utcnow)
-    session_id = db.Column(db.String(100), index=True) # Link to a player session
+    session_id = db.Column(db.String(100)) # Link to a player session
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True) # Link to registered user if applicable
     level_id = db.Column(db.String(100), nullable=True) # Identifier for the game level/map
     position_x = db.Column(db.Float, nullable=True) # Example: player position
@@ -56,5 +71,197 @@ class GameEvent(db.Model):
     def __repr__(self):
         return f'<GameEvent {self.id} ({self.event_type})>'
 
+class HeatmapDensity(db.Model):
+    """
+    Position sample counts per world grid cell, maintained at ingest time.
+
+    Rows with session_id '' hold the level-wide totals, other rows the
+    counts of a single session. cell_x/cell_z are floor(position / cell size)
+    with the cell size from HEATMAP_DENSITY_CELL_SIZE.
+    """
+    __tablename__ = 'heatmap_density'
+    level_id = db.Column(db.String(100), primary_key=True)
+    session_id = db.Column(db.String(100), primary_key=True, default='')
+    cell_x = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    cell_z = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<HeatmapDensity {self.level_id}/{self.session_id or "*"} ({self.cell_x}, {self.cell_z}): {self.count}>'
+
+class LevelSummary(db.Model):
+    """
+    Per-level totals maintained at ingest time (report selector, reports,
+    level filters): derived from level_event_type_count and level_session.
+    """
+    __tablename__ = 'level_summary'
+    level_id = db.Column(db.String(100), primary_key=True)
+    event_count = db.Column(db.BigInteger, nullable=False, default=0)
+    session_count = db.Column(db.Integer, nullable=False, default=0)
+    death_count = db.Column(db.BigInteger, nullable=False, default=0)
+    first_event = db.Column(db.DateTime)
+    last_event = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<LevelSummary {self.level_id}: {self.event_count} events, {self.session_count} sessions>'
+
+class LevelEventTypeCount(db.Model):
+    """Event count and time range per (level, event type), maintained at ingest time."""
+    __tablename__ = 'level_event_type_count'
+    level_id = db.Column(db.String(100), primary_key=True)
+    event_type = db.Column(db.String(100), primary_key=True)
+    count = db.Column(db.BigInteger, nullable=False, default=0)
+    first_event = db.Column(db.DateTime)
+    last_event = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<LevelEventTypeCount {self.level_id}/{self.event_type}: {self.count}>'
+
+class LevelSession(db.Model):
+    """Sessions that played a level: event count and time range per (level, session)."""
+    __tablename__ = 'level_session'
+    level_id = db.Column(db.String(100), primary_key=True)
+    session_id = db.Column(db.String(100), primary_key=True, index=True)
+    event_count = db.Column(db.Integer, nullable=False, default=0)
+    first_event = db.Column(db.DateTime)
+    last_event = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<LevelSession {self.level_id}/{self.session_id}: {self.event_count}>'
+
+class SessionSummary(db.Model):
+    """
+    One row per session (database viewer session list), maintained at
+    ingest time. Listed newest first with keyset pagination on
+    (end_time, session_id).
+    """
+    __tablename__ = 'session_summary'
+    __table_args__ = (
+        db.Index('ix_session_summary_end_time_session', 'end_time', 'session_id'),
+    )
+    session_id = db.Column(db.String(100), primary_key=True)
+    first_level_id = db.Column(db.String(100)) # Smallest level ID touched (as the old GROUP BY showed)
+    level_count = db.Column(db.Integer, nullable=False, default=0) # Levels touched
+    start_time = db.Column(db.DateTime, nullable=False)
+    end_time = db.Column(db.DateTime, nullable=False)
+    event_count = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<SessionSummary {self.session_id}: {self.event_count} events>'
+
+class LevelDataVersion(db.Model):
+    """
+    Per-level change counter, bumped in the same transaction as every ingest
+    or delete touching the level. Cached analyses store the version they
+    were computed from (cache watermark, valid across processes).
+    """
+    __tablename__ = 'level_data_version'
+    level_id = db.Column(db.String(100), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<LevelDataVersion {self.level_id}: {self.version}>'
+
+class ZoneCacheEntry(db.Model):
+    """Persistent backing store of the zone clustering cache (ZONE_CACHE_PERSISTENT)."""
+    __tablename__ = 'zone_cache_entry'
+    cache_key = db.Column(db.String(64), primary_key=True) # sha1 of level/session/parameters
+    level_id = db.Column(db.String(100), nullable=False, index=True)
+    data_version = db.Column(db.BigInteger, nullable=False)
+    result = db.Column(db.Text, nullable=False) # JSON of the cluster_level_zones result
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+    def __repr__(self):
+        return f'<ZoneCacheEntry {self.level_id} v{self.data_version}>'
+
+class AnalysisJob(db.Model):
+    """Background analysis job (app/jobs.py): status, progress and JSON result."""
+    __tablename__ = 'analysis_job'
+    id = db.Column(db.String(32), primary_key=True) # uuid4 hex
+    kind = db.Column(db.String(50), nullable=False)
+    params = db.Column(db.Text, nullable=False) # JSON
+    params_key = db.Column(db.String(64), nullable=False, index=True) # sha1 of kind + params (dedup)
+    status = db.Column(db.String(20), nullable=False, default='queued') # queued, running, done, failed
+    progress = db.Column(db.Float, nullable=False, default=0.0)
+    message = db.Column(db.String(255))
+    result = db.Column(db.Text) # JSON, when done
+    error = db.Column(db.Text)
+    owner = db.Column(db.String(255)) # host:pid of the process running the job
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<AnalysisJob {self.id} {self.kind} {self.status}>'
+
+class LevelKey(db.Model):
+    """Interned level id: position samples reference it by a small integer."""
+    __tablename__ = 'level_key'
+    id = db.Column(db.Integer, primary_key=True)
+    level_id = db.Column(db.String(100), unique=True, nullable=False)
+
+    def __repr__(self):
+        return f'<LevelKey {self.id} {self.level_id}>'
+
+class SessionKey(db.Model):
+    """
+    Interned session id: position samples reference it by a small integer.
+    Also records the client build the session was played on (buildVersion
+    of its event batches), used by the build filter of the analyses.
+    """
+    __tablename__ = 'session_key'
+    id = db.Column(db.Integer, primary_key=True)
+    session_id = db.Column(db.String(100), unique=True, nullable=False)
+    build = db.Column(db.String(100), index=True, nullable=True)
+
+    def __repr__(self):
+        return f'<SessionKey {self.id} {self.session_id}>'
+
+class PositionSample(db.Model):
+    """
+    Compact copy of a position_update event for the hot read paths
+    (heatmap, zone clustering): integer keys instead of strings, float32
+    coordinates, timestamp as integer epoch microseconds (UTC), no JSON.
+    """
+    __tablename__ = 'position_sample'
+    __table_args__ = (
+        db.Index('ix_position_sample_level_session_xz', 'level_key_id', 'session_key_id', 'x', 'z'),
+        # Heatmap / zones over a time window: level + time range, covering
+        db.Index('ix_position_sample_level_time_xz', 'level_key_id', 't_us', 'x', 'z'),
+    )
+
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    level_key_id = db.Column(db.Integer, db.ForeignKey('level_key.id'), nullable=False)
+    session_key_id = db.Column(db.Integer, db.ForeignKey('session_key.id'), nullable=True)
+    t_us = db.Column(db.BigInteger, nullable=False)
+    x = db.Column(db.REAL, nullable=False)
+    y = db.Column(db.REAL, nullable=True)
+    z = db.Column(db.REAL, nullable=False)
+
+    def __repr__(self):
+        return f'<PositionSample {self.id} ({self.x}, {self.z})>'
+
+class EventAttribute(db.Model):
+    """
+    One key=value pair of a GameEvent's actionDetails (event_data), extracted
+    at ingest for the indexed event data search (see app/event_search.py).
+    Values are stored lowercased; nested keys are dotted ("weapon.name").
+    """
+    __tablename__ = 'event_attribute'
+    __table_args__ = (
+        # Session event viewer: key=value within one session
+        db.Index('ix_event_attribute_session_key_value', 'session_id', 'key', 'value', 'event_id'),
+        db.Index('ix_event_attribute_key_value', 'key', 'value', 'event_id'),
+    )
+
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    event_id = db.Column(db.Integer, nullable=False, index=True) # No FK: partitioned game_event has no primary key
+    session_id = db.Column(db.String(100), nullable=True)
+    key = db.Column(db.String(100), nullable=False)
+    value = db.Column(db.String(200), nullable=False)
+
+    def __repr__(self):
+        return f'<EventAttribute {self.event_id} {self.key}={self.value}>'
+
 # Add PlayerSession model
 # Add Report model 
\ No newline at end of file
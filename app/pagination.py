@@ -0,0 +1,111 @@
+# app/pagination.py
+"""
+Keyset (seek) pagination for the database viewer lists.
+
+OFFSET pagination reads and discards every row before the requested page,
+and the page count needs a COUNT(*) over the whole filtered set. Here a
+page is fetched with WHERE (key1, key2) < (cursor values) ORDER BY key1,
+key2 LIMIT n, an index range scan whose cost does not depend on how deep
+the page is. Cursors are opaque URL-safe tokens holding the key values of
+the first/last row shown.
+"""
+
+import base64
+import binascii
+import datetime
+import json
+
+from sqlalchemy import tuple_
+
+from . import db
+
+
+def encode_cursor(values):
+    """Opaque URL-safe token for a tuple of key values (str, int, float, datetime)."""
+    payload = [['d', v.isoformat()] if isinstance(v, datetime.datetime) else ['v', v] for v in values]
+    token = base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode('utf-8'))
+    return token.decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """Key values of a token from encode_cursor(), or None if it is missing or malformed."""
+    if not token:
+        return None
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        return [datetime.datetime.fromisoformat(v) if kind == 'd' else v for kind, v in payload]
+    except (ValueError, TypeError, binascii.Error):
+        return None
+
+
+class KeysetPage:
+    """One page of items plus the cursors of the neighbouring pages (None at either end)."""
+
+    def __init__(self, items, prev_cursor=None, next_cursor=None):
+        self.items = items
+        self.prev_cursor = prev_cursor # ?before= of the previous page in display order
+        self.next_cursor = next_cursor # ?after= of the next page in display order
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def keyset_page(statement, keys, per_page, after=None, before=None, last=False, descending=True, key_values=None):
+    """
+    Fetches one page of an ORM select ordered by `keys` (unique together).
+
+    Args:
+        statement: select(Model) with filters applied, no ORDER BY / LIMIT.
+        keys (list): Sort key expressions, e.g. [end_time, session_id].
+        after (str, optional): Cursor: the page following that row.
+        before (str, optional): Cursor: the page preceding that row.
+        last (bool): Without a cursor, return the last page instead of the first.
+        descending (bool): Display order of the keys.
+        key_values (callable, optional): item -> tuple of key values, for keys
+                                         that are expressions rather than
+                                         plain columns (default: attributes
+                                         named like the keys).
+
+    Returns:
+        KeysetPage
+    """
+    if key_values is None:
+        names = [key.key for key in keys]
+        key_values = lambda item: [getattr(item, name) for name in names]
+    key_tuple = tuple_(*keys)
+
+    def cursor_of(item):
+        return encode_cursor(list(key_values(item)))
+
+    before_values = decode_cursor(before)
+    after_values = decode_cursor(after) if before_values is None else None
+    # Fetch in reverse order, then flip
+    backwards = before_values is not None or (last and after_values is None)
+
+    if after_values is not None:
+        bound = tuple_(*after_values)
+        statement = statement.where(key_tuple < bound if descending else key_tuple > bound)
+    elif before_values is not None:
+        bound = tuple_(*before_values)
+        statement = statement.where(key_tuple > bound if descending else key_tuple < bound)
+    reverse_order = descending != backwards
+    statement = statement.order_by(*[key.desc() if reverse_order else key.asc() for key in keys])
+    items = db.session.scalars(statement.limit(per_page + 1)).all()
+
+    more = len(items) > per_page
+    items = items[:per_page]
+    if not items:
+        return KeysetPage(items)
+    if backwards:
+        items.reverse()
+        prev_cursor = cursor_of(items[0]) if more else None
+        next_cursor = cursor_of(items[-1]) if before_values is not None else None
+    else:
+        prev_cursor = cursor_of(items[0]) if after_values is not None else None
+        next_cursor = cursor_of(items[-1]) if more else None
+    return KeysetPage(items, prev_cursor, next_cursor)
@@ -0,0 +1,391 @@
+# app/partitions.py
+"""
+Storage management for game_event: monthly partitions, retention and bulk purges.
+
+PostgreSQL: `convert_to_partitioned()` turns game_event into a natively
+partitioned table (PARTITION BY RANGE (timestamp)) with one partition per
+month, named game_event_pYYYY_MM, plus game_event_pdefault for rows outside
+the created months. Queries that filter on GameEvent.timestamp (see
+`timestamps.time_window`) are pruned to the matching partitions by the planner, and
+`purge_events_before()` drops whole expired partitions instead of deleting
+rows.
+
+SQLite (and anything else) has no native partitioning: the time window still
+narrows queries through the timestamp indexes, and retention deletes expired
+rows in small committed chunks so the database is never locked for long.
+
+Deleting a whole level or session (`purge_level_events`,
+`purge_session_events`, run as background jobs from the database viewer)
+works the same way: the aggregates are updated first in one short
+transaction, then the events are deleted in id ranges of PURGE_CHUNK_ROWS
+rows, one transaction each, and partitions holding nothing but the purged
+events are dropped whole. Events ingested after the purge started (higher
+ids) are kept.
+"""
+
+import datetime
+
+from flask import current_app
+from sqlalchemy import delete, func, select, text
+
+from . import db
+from .aggregates import (
+    bump_level_versions, forget_level, forget_session, rebuild_density, rebuild_level_summaries,
+    rebuild_session_summaries
+)
+from .event_search import POSTGRESQL_SEARCH_INDEX, remove_event_search
+from .models import GameEvent, LevelKey, LevelSession, LevelSummary, PositionSample, SessionKey, SessionSummary
+from .timestamps import to_epoch_us
+
+PARTITION_PREFIX = 'game_event_p'
+DEFAULT_PARTITION = PARTITION_PREFIX + 'default'
+UNPARTITIONED_TABLE = 'game_event_unpartitioned'
+PURGE_CHUNK_ROWS = 10000
+
+
+def _month_start(value):
+    return datetime.datetime(value.year, value.month, 1)
+
+
+def _next_month(value):
+    return datetime.datetime(value.year + value.month // 12, value.month % 12 + 1, 1)
+
+
+def _partition_name(month):
+    return f"{PARTITION_PREFIX}{month.year:04d}_{month.month:02d}"
+
+
+def _partition_month(name):
+    """Month start encoded in a partition name, or None for other tables."""
+    try:
+        return datetime.datetime.strptime(name[len(PARTITION_PREFIX):], '%Y_%m')
+    except ValueError:
+        return None
+
+
+def _is_postgresql():
+    return db.session.get_bind().dialect.name == 'postgresql'
+
+
+def is_partitioned():
+    """True when game_event is a native partitioned table (PostgreSQL only)."""
+    if not _is_postgresql():
+        return False
+    return db.session.execute(text(
+        "SELECT c.relkind = 'p' FROM pg_class c "
+        "WHERE c.relname = :name AND pg_table_is_visible(c.oid)"
+    ), {"name": GameEvent.__tablename__}).scalar() or False
+
+
+def list_partitions():
+    """Names of the monthly partitions of game_event, oldest first."""
+    names = db.session.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE parent.relname = :name"
+    ), {"name": GameEvent.__tablename__}).scalars().all()
+    return sorted(name for name in names if _partition_month(name) is not None)
+
+
+def _create_partition(month):
+    db.session.execute(text(
+        f'CREATE TABLE IF NOT EXISTS {_partition_name(month)} PARTITION OF {GameEvent.__tablename__} '
+        f"FOR VALUES FROM ('{month.isoformat(sep=' ')}') TO ('{_next_month(month).isoformat(sep=' ')}')"
+    ))
+
+
+def ensure_partitions(months_ahead=3, now=None):
+    """
+    Creates the partitions of the current month and the next `months_ahead`
+    months (run it regularly, e.g. from cron). Returns the created names.
+    """
+    month = _month_start(now or datetime.datetime.utcnow())
+    existing = set(list_partitions())
+    created = []
+    for _ in range(months_ahead + 1):
+        name = _partition_name(month)
+        if name not in existing:
+            _create_partition(month)
+            created.append(name)
+        month = _next_month(month)
+    return created
+
+
+def convert_to_partitioned(months_ahead=3):
+    """
+    Rebuilds game_event as a table partitioned by month (PostgreSQL only).
+
+    Runs in the current transaction (the caller commits): the existing table
+    is renamed, the partitioned parent is created with the same columns and
+    id sequence, a partition is created for every month that has data, the
+    rows are copied over and the old table is dropped. Indexes are created
+    on the parent and propagate to every partition.
+
+    The parent has no primary key: PostgreSQL requires the partition key in
+    every unique constraint, and id stays unique through its sequence.
+    """
+    table = GameEvent.__tablename__
+    sequence = f'{table}_id_seq'
+    statements = [
+        f'ALTER TABLE {table} RENAME TO {UNPARTITIONED_TABLE}',
+        f'ALTER SEQUENCE {sequence} OWNED BY NONE',
+        f'CREATE TABLE {table} (LIKE {UNPARTITIONED_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+        f'PARTITION BY RANGE (timestamp)',
+        f'CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {table} DEFAULT',
+    ]
+    for statement in statements:
+        db.session.execute(text(statement))
+
+    first, last = db.session.execute(text(
+        f'SELECT min(timestamp), max(timestamp) FROM {UNPARTITIONED_TABLE}'
+    )).one()
+    now = datetime.datetime.utcnow()
+    month = _month_start(first or now)
+    last_month = _month_start(max(last or now, now))
+    while month <= last_month:
+        _create_partition(month)
+        month = _next_month(month)
+    ensure_partitions(months_ahead, now)
+
+    statements = [
+        f'INSERT INTO {table} SELECT * FROM {UNPARTITIONED_TABLE}',
+        f'DROP TABLE {UNPARTITIONED_TABLE}',
+        f'ALTER SEQUENCE {sequence} OWNED BY {table}.id',
+        f'ALTER TABLE {table} ADD FOREIGN KEY (user_id) REFERENCES "user" (id)',
+        f'CREATE INDEX ix_{table}_id ON {table} (id)',
+    ]
+    for statement in statements:
+        db.session.execute(text(statement))
+    for index in GameEvent.__table__.indexes:
+        index.create(db.session.connection())
+    if db.session.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).scalar():
+        db.session.execute(text(POSTGRESQL_SEARCH_INDEX)) # Event data search (not part of the model)
+
+
+def purge_chunk_rows():
+    return current_app.config.get('PURGE_CHUNK_ROWS', PURGE_CHUNK_ROWS)
+
+
+def _delete_in_chunks(table, id_column, conditions, chunk_rows):
+    """Deletes matching rows chunk_rows at a time, committing after each chunk."""
+    total = 0
+    while True:
+        ids = select(id_column).where(*conditions).limit(chunk_rows).scalar_subquery()
+        deleted = db.session.execute(delete(table).where(id_column.in_(ids))).rowcount
+        db.session.commit()
+        total += deleted
+        if deleted < chunk_rows:
+            return total
+
+
+def purge_events_before(cutoff, chunk_rows=None):
+    """
+    Data retention: removes every event with timestamp < cutoff.
+
+    On a partitioned PostgreSQL table, months that end before the cutoff are
+    dropped as whole partitions; the remaining expired rows (the partially
+    expired month, the default partition, unpartitioned tables) are deleted
+    in committed chunks. Search rows of the expired events are
+    deleted first, position samples follow the same cutoff and the
+    heatmap density and level/session summaries of the affected levels and
+    sessions are rebuilt.
+
+    Returns:
+        dict: {'partitions_dropped': [...], 'events_deleted': n, 'samples_deleted': n, 'levels': [...]}
+    """
+    chunk_rows = chunk_rows or purge_chunk_rows()
+    levels = db.session.execute(
+        select(GameEvent.level_id).where(GameEvent.timestamp < cutoff, GameEvent.level_id.isnot(None)).distinct()
+    ).scalars().all()
+
+    sessions = db.session.execute(
+        select(GameEvent.session_id).where(GameEvent.timestamp < cutoff, GameEvent.session_id.isnot(None)).distinct()
+    ).scalars().all()
+
+    # Search rows reference event ids: remove them while the events still exist
+    remove_event_search(GameEvent.timestamp < cutoff)
+    db.session.commit()
+
+    dropped = []
+    if is_partitioned():
+        for name in list_partitions():
+            if _next_month(_partition_month(name)) <= cutoff:
+                db.session.execute(text(f'ALTER TABLE {GameEvent.__tablename__} DETACH PARTITION {name}'))
+                db.session.execute(text(f'DROP TABLE {name}'))
+                dropped.append(name)
+        db.session.commit()
+
+    events_deleted = _delete_in_chunks(
+        GameEvent.__table__, GameEvent.id, [GameEvent.timestamp < cutoff], chunk_rows
+    )
+    samples_deleted = _delete_in_chunks(
+        PositionSample.__table__, PositionSample.id, [PositionSample.t_us < to_epoch_us(cutoff)], chunk_rows
+    )
+
+    for level_id in levels:
+        rebuild_density(level_id)
+        rebuild_level_summaries(level_id)
+        db.session.commit()
+    rebuild_session_summaries(sessions)
+    bump_level_versions(levels)
+    db.session.commit()
+
+    current_app.logger.info(
+        f"Purged events before {cutoff}: {len(dropped)} partitions dropped, "
+        f"{events_deleted} events and {samples_deleted} position samples deleted"
+    )
+    return {
+        "partitions_dropped": dropped,
+        "events_deleted": events_deleted,
+        "samples_deleted": samples_deleted,
+        "levels": levels,
+    }
+
+
+# --- Purging a whole level or session ---
+
+def _drop_exclusive_partitions(condition, max_id):
+    """
+    Drops the monthly partitions whose rows all match condition and are not
+    newer than max_id (PostgreSQL). Returns (dropped names, events dropped).
+    """
+    if not is_partitioned():
+        return [], 0
+    compiled = condition.compile(db.session.get_bind(), compile_kwargs={"literal_binds": True})
+    dropped, events = [], 0
+    for name in list_partitions():
+        # The partition is aliased to the parent's name so the compiled condition applies as is
+        # IS NOT TRUE: rows where the condition is NULL (e.g. NULL level_id) are kept, as in _kept()
+        kept = db.session.execute(text(
+            f"SELECT 1 FROM {name} AS {GameEvent.__tablename__} WHERE ({compiled}) IS NOT TRUE OR id > :max_id LIMIT 1"
+        ), {"max_id": max_id}).first()
+        if kept is not None:
+            continue
+        count = db.session.execute(text(f"SELECT count(*) FROM {name}")).scalar() # Only for candidates
+        if not count:
+            continue
+        month = _partition_month(name)
+        remove_event_search((GameEvent.timestamp >= month) & (GameEvent.timestamp < _next_month(month)))
+        db.session.execute(text(f'ALTER TABLE {GameEvent.__tablename__} DETACH PARTITION {name}'))
+        db.session.execute(text(f'DROP TABLE {name}'))
+        db.session.commit()
+        dropped.append(name)
+        events += count
+    return dropped, events
+
+
+def _delete_events_by_id_range(condition, max_id, chunk_rows, on_chunk=None):
+    """
+    Deletes the events matching condition with id <= max_id, one id range
+    of at most chunk_rows matching events per transaction (their search
+    rows go in the same transaction). Returns the number deleted.
+    """
+    total = 0
+    last_id = 0
+    while last_id < max_id:
+        # Upper end of the next range: the chunk_rows-th matching id (or max_id)
+        upper = db.session.execute(
+            select(GameEvent.id).where(condition, GameEvent.id > last_id, GameEvent.id <= max_id)
+            .order_by(GameEvent.id).offset(chunk_rows - 1).limit(1)
+        ).scalar() or max_id
+        in_range = condition & (GameEvent.id > last_id) & (GameEvent.id <= upper)
+        remove_event_search(in_range)
+        total += db.session.execute(delete(GameEvent.__table__).where(in_range)).rowcount
+        db.session.commit()
+        last_id = upper
+        if on_chunk is not None:
+            on_chunk(total)
+    return total
+
+
+def _purge_events(condition, forget, sample_condition, levels, total_hint, chunk_rows=None, progress=None):
+    """
+    Shared body of purge_level_events / purge_session_events.
+
+    1. In one transaction: note the newest event / sample ids and update the
+       aggregates as if the events were gone (forget_*, per-event rows excluded).
+    2. Drop partitions that hold only these events.
+    3. Delete the remaining events, then the position samples, in chunks.
+    """
+    chunk_rows = chunk_rows or purge_chunk_rows()
+    forget()
+    # Read after forget() wrote, in its transaction: later events are not part of the purge
+    max_event_id = db.session.execute(select(func.max(GameEvent.id))).scalar() or 0
+    max_sample_id = db.session.execute(select(func.max(PositionSample.id))).scalar() or 0
+    db.session.commit()
+    if progress:
+        progress(0.05, "Aggregates updated, deleting events")
+
+    dropped, dropped_events = _drop_exclusive_partitions(condition, max_event_id)
+
+    def report(deleted):
+        if progress and total_hint:
+            done = min((dropped_events + deleted) / total_hint, 1.0)
+            progress(0.05 + 0.85 * done, f"{dropped_events + deleted} of ~{total_hint} events deleted")
+
+    events_deleted = dropped_events + _delete_events_by_id_range(condition, max_event_id, chunk_rows, report)
+
+    if progress:
+        progress(0.9, "Deleting position samples")
+    samples_deleted = 0
+    if sample_condition is not None:
+        samples_deleted = _delete_in_chunks(
+            PositionSample.__table__, PositionSample.id,
+            [sample_condition, PositionSample.id <= max_sample_id], chunk_rows
+        )
+    # forget() bumped the versions before the deletes: analyses cached meanwhile saw half-deleted data
+    bump_level_versions(levels)
+    db.session.commit()
+    return {
+        "partitions_dropped": dropped,
+        "events_deleted": events_deleted,
+        "samples_deleted": samples_deleted,
+    }
+
+
+def purge_level_events(level_id, chunk_rows=None, progress=None):
+    """
+    Deletes every event of a level in chunks (see the module docstring).
+    `progress(fraction, message)` is the background job callback.
+
+    Returns:
+        dict: {'partitions_dropped': [...], 'events_deleted': n, 'samples_deleted': n}
+    """
+    total_hint = db.session.execute(
+        select(LevelSummary.event_count).where(LevelSummary.level_id == level_id)
+    ).scalar()
+    key_id = db.session.execute(select(LevelKey.id).where(LevelKey.level_id == level_id)).scalar()
+    result = _purge_events(
+        GameEvent.level_id == level_id,
+        lambda: forget_level(level_id, event_rows=False),
+        PositionSample.level_key_id == key_id if key_id is not None else None,
+        [level_id], total_hint, chunk_rows, progress
+    )
+    current_app.logger.info(f"Purged level {level_id}: {result}")
+    return result
+
+
+def purge_session_events(session_id, chunk_rows=None, progress=None):
+    """
+    Deletes every event of a session in chunks (see the module docstring).
+
+    Returns:
+        dict: {'partitions_dropped': [...], 'events_deleted': n, 'samples_deleted': n}
+    """
+    total_hint = db.session.execute(
+        select(SessionSummary.event_count).where(SessionSummary.session_id == session_id)
+    ).scalar()
+    key_id = db.session.execute(select(SessionKey.id).where(SessionKey.session_id == session_id)).scalar()
+    # Read before forget_session() removes the session's level_session rows
+    levels = db.session.execute(
+        select(LevelSession.level_id).where(LevelSession.session_id == session_id)
+    ).scalars().all()
+    result = _purge_events(
+        GameEvent.session_id == session_id,
+        lambda: forget_session(session_id, event_rows=False),
+        PositionSample.session_key_id == key_id if key_id is not None else None,
+        levels, total_hint, chunk_rows, progress
+    )
+    current_app.logger.info(f"Purged session {session_id}: {result}")
+    return result
@@ -0,0 +1,236 @@
+# app/positions.py
+"""
+Typed position storage (position_sample) for the hot read paths.
+
+`position_update` is by far the highest-volume event type. Besides the
+generic game_event row, every sample is also written to position_sample:
+level and session ids are interned into level_key / session_key and
+referenced by integer, coordinates are float32 and the timestamp is an
+integer (epoch microseconds, UTC). The heatmap and the zone clustering
+read from this table.
+
+game_event keeps its rows (reports, the event viewer and exports still
+use them); `rebuild_position_samples` fills position_sample from that
+history after an upgrade.
+
+session_key also carries the client build of each session
+(`record_session_builds` at ingest); `build_filter` narrows game_event or
+position_sample queries to the sessions of one build.
+"""
+
+from sqlalchemy import bindparam, cast, delete, insert, or_, select, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from . import db
+from .models import GameEvent, LevelKey, PositionSample, SessionKey
+from .timestamps import time_window, to_epoch_us
+
+REBUILD_CHUNK_ROWS = 50000
+
+_IGNORE_INSERTS = {
+    'sqlite': sqlite_insert,
+    'postgresql': postgresql_insert,
+}
+
+
+def _select_ids(column, id_column, values):
+    return dict(db.session.execute(select(column, id_column).where(column.in_(values))).all())
+
+
+def intern_ids(model, column_name, values):
+    """
+    Returns {value: id} for the given strings, creating missing key rows.
+
+    Concurrent writers may intern the same value: the insert ignores
+    conflicts (SQLite / PostgreSQL) and the ids are read back afterwards.
+    """
+    values = {v for v in values if v is not None}
+    if not values:
+        return {}
+    column = getattr(model, column_name)
+    ids = _select_ids(column, model.id, values)
+    missing = sorted(values - ids.keys())
+    if missing:
+        params = [{column_name: v} for v in missing]
+        dialect_insert = _IGNORE_INSERTS.get(db.session.get_bind().dialect.name)
+        if dialect_insert is not None:
+            db.session.execute(dialect_insert(model.__table__).on_conflict_do_nothing(), params)
+        else:
+            db.session.execute(insert(model.__table__), params)
+        ids.update(_select_ids(column, model.id, missing))
+    return ids
+
+
+def record_session_builds(builds):
+    """
+    Stores the client build of sessions ({session_id: build}) on their
+    session_key rows, inside the current transaction. A session reported
+    with another build later keeps the latest one.
+    """
+    builds = {session_id: build for session_id, build in builds.items() if session_id and build}
+    if not builds:
+        return
+    key_ids = intern_ids(SessionKey, 'session_id', builds.keys())
+    table = SessionKey.__table__
+    db.session.execute(
+        update(table)
+        .where(table.c.id == bindparam('key_id'),
+               or_(table.c.build.is_(None), table.c.build != bindparam('new_build')))
+        .values(build=bindparam('new_build')),
+        [{"key_id": key_ids[session_id], "new_build": build} for session_id, build in builds.items()]
+    )
+
+
+def build_filter(column, build=None):
+    """
+    SQL conditions limiting a session column to the sessions of a client
+    build: GameEvent.session_id (or another session id string column), or
+    PositionSample.session_key_id. Empty list when build is None.
+    """
+    if not build:
+        return []
+    key_column = SessionKey.id if column is PositionSample.session_key_id else SessionKey.session_id
+    return [column.in_(select(key_column).where(SessionKey.build == build))]
+
+
+def level_key_id(level_id):
+    """Interned id of a level, or None if it has no position samples yet."""
+    return db.session.execute(select(LevelKey.id).where(LevelKey.level_id == level_id)).scalar()
+
+
+def insert_position_samples(rows):
+    """
+    Writes the position_update rows (EVENT_COLUMNS tuples) of an ingested
+    batch to position_sample, inside the current transaction.
+    """
+    samples = [
+        row for row in rows
+        if row[0] == 'position_update' and row[3] is not None and row[4] is not None and row[6] is not None
+    ]
+    if not samples:
+        return 0
+    level_ids = intern_ids(LevelKey, 'level_id', {row[3] for row in samples})
+    session_ids = intern_ids(SessionKey, 'session_id', {row[2] for row in samples})
+    db.session.execute(
+        insert(PositionSample.__table__),
+        [
+            {
+                "level_key_id": level_ids[level_id],
+                "session_key_id": session_ids.get(session_id),
+                "t_us": to_epoch_us(timestamp),
+                "x": x, "y": y, "z": z,
+            }
+            for _type, timestamp, session_id, level_id, x, y, z, _data in samples
+        ]
+    )
+    return len(samples)
+
+
+def position_sample_select(level_id, session_id=None, start=None, end=None, build=None):
+    """
+    SELECT of (x, z) from position_sample for a level (optionally one
+    session, a [start, end) time window of naive UTC datetimes and one
+    client build).
+    """
+    statement = select(PositionSample.x, PositionSample.z)\
+        .join(LevelKey, LevelKey.id == PositionSample.level_key_id)\
+        .where(LevelKey.level_id == level_id, *build_filter(PositionSample.session_key_id, build))
+    if start is not None or end is not None:
+        statement = statement.where(*time_window(
+            PositionSample.t_us,
+            to_epoch_us(start) if start is not None else None,
+            to_epoch_us(end) if end is not None else None
+        ))
+    if session_id:
+        statement = statement.join(SessionKey, SessionKey.id == PositionSample.session_key_id)\
+            .where(SessionKey.session_id == session_id)
+    return statement
+
+
+def rebuild_position_samples(level_id=None):
+    """
+    Recomputes position_sample from game_event history (one level or all).
+
+    Reads game_event in id order, REBUILD_CHUNK_ROWS at a time. Run it
+    while ingestion for the level is paused; it can be repeated safely.
+    Returns the number of samples written.
+    """
+    table = PositionSample.__table__
+    cleanup = delete(table)
+    if level_id is not None:
+        key_id = level_key_id(level_id)
+        if key_id is not None:
+            db.session.execute(cleanup.where(table.c.level_key_id == key_id))
+    else:
+        db.session.execute(cleanup)
+
+    filters = [
+        GameEvent.event_type == 'position_update',
+        GameEvent.level_id.isnot(None),
+        GameEvent.position_x.isnot(None),
+        GameEvent.position_z.isnot(None),
+    ]
+    if level_id is not None:
+        filters.append(GameEvent.level_id == level_id)
+    columns = (GameEvent.event_type, GameEvent.timestamp, GameEvent.session_id, GameEvent.level_id,
+               GameEvent.position_x, GameEvent.position_y, GameEvent.position_z)
+
+    total = 0
+    last_id = 0
+    while True:
+        chunk = db.session.execute(
+            select(GameEvent.id, *columns).where(*filters, GameEvent.id > last_id)
+            .order_by(GameEvent.id).limit(REBUILD_CHUNK_ROWS)
+        ).all()
+        if not chunk:
+            break
+        last_id = chunk[-1][0]
+        total += insert_position_samples([
+            tuple(row[1:]) + (None,) for row in chunk if row[2] is not None
+        ])
+    return total
+
+
+# --- Deletes mirrored from game_event ---
+
+def remove_position_samples_for_level(level_id):
+    key_id = level_key_id(level_id)
+    if key_id is not None:
+        db.session.execute(delete(PositionSample.__table__).where(PositionSample.level_key_id == key_id))
+
+
+def remove_position_samples_for_session(session_id):
+    key_id = db.session.execute(select(SessionKey.id).where(SessionKey.session_id == session_id)).scalar()
+    if key_id is not None:
+        db.session.execute(delete(PositionSample.__table__).where(PositionSample.session_key_id == key_id))
+
+
+def remove_position_sample_for_event(event):
+    """
+    Deletes the sample matching a deleted position_update event (one row).
+
+    Matched on level, time, coordinates and session
+    (ix_position_sample_level_time_xz): samples of other events at the same
+    instant stay. Coordinates are compared as stored (float32 on PostgreSQL).
+    """
+    if event.event_type != 'position_update' or event.level_id is None \
+            or event.position_x is None or event.position_z is None or event.timestamp is None:
+        return
+    key_id = level_key_id(event.level_id)
+    if key_id is None:
+        return
+    match = select(PositionSample.id).where(
+        PositionSample.level_key_id == key_id,
+        PositionSample.t_us == to_epoch_us(event.timestamp),
+        PositionSample.x == cast(event.position_x, PositionSample.x.type),
+        PositionSample.z == cast(event.position_z, PositionSample.z.type),
+    )
+    if event.session_id:
+        match = match.join(SessionKey, SessionKey.id == PositionSample.session_key_id)\
+            .where(SessionKey.session_id == event.session_id)
+    else:
+        match = match.where(PositionSample.session_key_id.is_(None))
+    sample_id = db.session.execute(match.limit(1)).scalar()
+    if sample_id is not None:
+        db.session.execute(delete(PositionSample.__table__).where(PositionSample.id == sample_id))
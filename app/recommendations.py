@@ -1,6 +1,6 @@
 from flask import current_app
-# Импортируем новую функцию
-from .analysis import get_event_coords_by_zone 
+# Счетчики смертей по зонам (без списков координат)
+from .analysis import count_zone_deaths, zone_death_counts
 
 # --- Thresholds (can be moved to config later) ---
 HIGH_DEATH_COUNT_THRESHOLD = 20 # Example: Warn if more than 20 deaths on level
@@ -9,7 +9,8 @@ ZONE_DEATH_THRESHOLD_ABS = 5  # Минимум N смертей в зоне дл
 ZONE_DEATH_THRESHOLD_REL_AVG = 2.0 # Смертей в зоне в N раз больше среднего по зонам
 ZONE_DEATH_THRESHOLD_REL_TOTAL = 0.1 # Смертей в зоне составляют > N% от всех смертей
 
-def generate_recommendations(level_id, zone_data=None, event_counts=None, session_id=None): # Добавлен session_id
+def generate_recommendations(level_id, zone_data=None, event_counts=None, session_id=None, start=None, end=None,
+                             deaths_by_zone=None, build=None): # Добавлен session_id
     """
     Generates a list of recommendations based on zone analysis and event counts.
 
@@ -19,6 +20,12 @@ def generate_recommendations(level_id, zone_data=None, event_counts=None, sessio
                           (containing 'zones', 'parameters', 'error' etc.).
         event_counts (dict): A dictionary mapping event_type to its count for the level.
         session_id (str, optional): ID сессии (для фильтрации данных для правил).
+        start, end (datetime, optional): Временное окно анализа (UTC), как у zone_data.
+        deaths_by_zone (dict, optional): Готовые {cluster_id: число смертей}
+                          (analysis.count_events_by_zone); если None, берутся
+                          из zone_data (zone['deaths']), а без них
+                          подсчитываются по базе.
+        build (str, optional): Сборка клиента (фильтр сессий), как у zone_data.
 
     Returns:
         list: A list of strings, where each string is a recommendation.
@@ -59,18 +66,24 @@ def generate_recommendations(level_id, zone_data=None, event_counts=None, sessio
     # --- Rule 3: Zone of Death ---
     if zones and total_deaths > 0: # Запускаем только если есть зоны и смерти
         try:
-            # Получаем координаты смертей, распределенные по зонам
-            deaths_by_zone_coords = get_event_coords_by_zone(
-                level_id,
-                session_id=session_id, # Передаем session_id для фильтрации
-                event_type='death',
-                zones=zones
-            )
+            if deaths_by_zone is None:
+                # Счетчики, сохраненные вместе с зонами (get_zone_data, batch_analysis)
+                deaths_by_zone = zone_death_counts(zone_data)
+            if deaths_by_zone is None:
+                # Старая запись кэша без счетчиков: один проход по массиву смертей
+                deaths_by_zone = count_zone_deaths(
+                    level_id,
+                    zones,
+                    session_id=session_id, # Передаем session_id для фильтрации
+                    start=start,
+                    end=end,
+                    build=build
+                )
 
             # Считаем количество смертей в каждой зоне
             death_counts_per_zone = {
-                zone_id: len(coords)
-                for zone_id, coords in deaths_by_zone_coords.items()
+                zone_id: count
+                for zone_id, count in deaths_by_zone.items()
                 if zone_id != -1 # Исключаем шум (-1) из анализа зон смерти
             }
 
@@ -1,14 +1,17 @@
-from flask import Blueprint, render_template, abort, current_app, flash
+from flask import Blueprint, render_template, abort, current_app, flash, request
 from flask_login import login_required
-from sqlalchemy import func, distinct
-import numpy as np
+from sqlalchemy import func, select
 
 # Assuming reports.py is inside 'app' directory
 from . import db 
-from .models import GameEvent
-from .analysis import cluster_level_zones
+from .models import GameEvent, LevelEventTypeCount, LevelSession, SessionKey
+from .aggregates import available_level_ids
+from .jobs import submit_job
+from .positions import build_filter
+from .zone_cache import get_zone_data, peek_zone_data
 from .admin import analyst_or_admin_required # Use existing decorator
 from .recommendations import generate_recommendations # Import the new function
+from .timestamps import parse_iso_timestamp, time_window
 
 # Define the blueprint
 bp = Blueprint('reports', __name__, url_prefix='/reports')
@@ -19,11 +22,7 @@ bp = Blueprint('reports', __name__, url_prefix='/reports')
 def select_level_report():
     """Displays a page to select a level for reporting."""
     try:
-        # Query distinct, non-null level IDs
-        levels_query = db.session.query(GameEvent.level_id)\
-                             .filter(GameEvent.level_id.isnot(None))\
-                             .distinct().order_by(GameEvent.level_id)
-        available_levels = [level[0] for level in levels_query.all()]
+        available_levels = available_level_ids()
     except Exception as e:
         current_app.logger.error(f"Error querying available levels: {e}", exc_info=True)
         available_levels = []
@@ -31,35 +30,107 @@ def select_level_report():
         
     return render_template('reports/select_level.html', levels=available_levels)
 
+def _summary_metrics(level_id):
+    """level_metrics() of the whole history from the summary tables, or None if the level has no summary."""
+    type_rows = db.session.execute(
+        select(LevelEventTypeCount.event_type, LevelEventTypeCount.count,
+               LevelEventTypeCount.first_event, LevelEventTypeCount.last_event)
+        .where(LevelEventTypeCount.level_id == level_id)
+    ).all()
+    if not type_rows:
+        return None
+    sessions = db.session.execute(
+        select(LevelSession.session_id).where(LevelSession.level_id == level_id).order_by(LevelSession.session_id)
+    ).scalars().all()
+    event_counts_dict = {event_type: count for event_type, count, _first, _last in type_rows}
+    firsts = [first for _type, _count, first, _last in type_rows if first is not None]
+    lasts = [last for _type, _count, _first, last in type_rows if last is not None]
+    time_range = (min(firsts) if firsts else None, max(lasts) if lasts else None)
+    return len(sessions), event_counts_dict, time_range, sessions
+
+def level_exists(level_id):
+    """True if the level has any events (summary row, or an indexed probe before the summaries are built)."""
+    for column in (LevelEventTypeCount.level_id, GameEvent.level_id):
+        if db.session.execute(select(column).where(column == level_id).limit(1)).first() is not None:
+            return True
+    return False
+
+def level_builds(level_id):
+    """Client builds recorded for the sessions of a level (for the report's build filter)."""
+    return db.session.execute(
+        select(SessionKey.build).distinct()
+        .join(LevelSession, LevelSession.session_id == SessionKey.session_id)
+        .where(LevelSession.level_id == level_id, SessionKey.build.isnot(None))
+        .order_by(SessionKey.build)
+    ).scalars().all()
+
+def level_metrics(level_id, start=None, end=None, build=None):
+    """
+    Basic metrics of a level, optionally limited to a [start, end) time window
+    and to the sessions of one client build.
+
+    Without filters they come from the summary tables maintained at ingest
+    (level_event_type_count, level_session), independent of event volume.
+    With a filter (or before the summaries are built), one grouped query (session_id, event_type -> count, min/max timestamp)
+    replaces the separate session count, event count, time range and
+    session list queries; everything is derived from its rows.
+    The window is applied as a GameEvent.timestamp range, so on a partitioned
+    PostgreSQL table only the matching monthly partitions are scanned.
+
+    Returns:
+        tuple: (unique_sessions_count, event_counts_dict, time_range, sessions)
+    """
+    if start is None and end is None and not build:
+        metrics = _summary_metrics(level_id)
+        if metrics is not None:
+            return metrics
+
+    rows = db.session.execute(
+        select(GameEvent.session_id, GameEvent.event_type, func.count(),
+               func.min(GameEvent.timestamp), func.max(GameEvent.timestamp))
+        .where(GameEvent.level_id == level_id, *time_window(GameEvent.timestamp, start, end),
+               *build_filter(GameEvent.session_id, build))
+        .group_by(GameEvent.session_id, GameEvent.event_type)
+    ).all()
+
+    event_counts_dict = {}
+    sessions = set()
+    first = last = None
+    for session_id, event_type, count, min_ts, max_ts in rows:
+        event_counts_dict[event_type] = event_counts_dict.get(event_type, 0) + count
+        if session_id is not None:
+            sessions.add(session_id)
+        if min_ts is not None and (first is None or min_ts < first):
+            first = min_ts
+        if max_ts is not None and (last is None or max_ts > last):
+            last = max_ts
+    return len(sessions), event_counts_dict, (first, last), sorted(sessions)
+
 @bp.route('/level/<string:level_id>')
 @login_required
 @analyst_or_admin_required
 def level_report(level_id):
     """Generates and displays a detailed report for a specific level."""
+
+    # Optional time window (?from=...&to=..., ISO 8601, UTC)
+    time_from = request.args.get('from', '').strip()
+    time_to = request.args.get('to', '').strip()
+    start = parse_iso_timestamp(time_from) if time_from else None
+    end = parse_iso_timestamp(time_to) if time_to else None
+    if (time_from and start is None) or (time_to and end is None):
+        flash("Invalid time window, showing all data.", "warning")
+        start = end = None
+    build = request.args.get('build', '').strip() or None # Sessions of one client build
     
     # --- Query Basic Level Metrics --- 
     unique_sessions_count = 'N/A'
     event_counts_dict = {}
     total_activity_duration = 'N/A'
     time_range = (None, None)
+    available_sessions = []
     
     try:
-        # Count unique sessions for this level
-        unique_sessions_query = db.session.query(func.count(distinct(GameEvent.session_id)))\
-                                        .filter(GameEvent.level_id == level_id)
-        unique_sessions_count = unique_sessions_query.scalar()
-        
-        # Count key events (example: position_update, jump, interact, death)
-        event_counts_query = db.session.query(GameEvent.event_type, func.count(GameEvent.id))\
-                                .filter(GameEvent.level_id == level_id)\
-                                .group_by(GameEvent.event_type)
-        event_counts_dict = dict(event_counts_query.all())
-
-        # Estimate activity time (approximation)
-        # Get min/max timestamp for the level (can be slow on large tables without index)
-        time_range_query = db.session.query(func.min(GameEvent.timestamp), func.max(GameEvent.timestamp))\
-                             .filter(GameEvent.level_id == level_id)
-        time_range = time_range_query.first()
+        unique_sessions_count, event_counts_dict, time_range, available_sessions = level_metrics(level_id, start, end, build)
         
         if time_range and time_range[0] and time_range[1]:
             total_activity_duration = time_range[1] - time_range[0]
@@ -71,44 +142,58 @@ def level_report(level_id):
         current_app.logger.error(f"Error querying metrics for level {level_id}: {e}", exc_info=True)
         # Keep default 'N/A' values set above
         
-    # --- Query available Session IDs for this level ---
-    available_sessions = []
-    try:
-        sessions_query = db.session.query(GameEvent.session_id)\
-                            .filter(GameEvent.level_id == level_id)\
-                            .filter(GameEvent.session_id.isnot(None))\
-                            .distinct().order_by(GameEvent.session_id) # Optional: order them
-        available_sessions = [session[0] for session in sessions_query.all()]
-    except Exception as e:
-        current_app.logger.error(f"Error querying sessions for level {level_id}: {e}", exc_info=True)
-        # Continue without session list if query fails
+    # Unknown level: 404 before any clustering job is started for it
+    # (with filters the metrics may be empty for an existing level, so look it up)
+    filtered = bool(start or end or build)
+    if (unique_sessions_count == 0 and not event_counts_dict and not filtered) or \
+            (filtered and not level_exists(level_id)):
+        abort(404, description=f"Level '{level_id}' not found or has no associated event data.")
 
     # --- Get Zone Clustering Data --- 
-    # Using default parameters for now
+    # Using default parameters for now. Not cached yet -> run it as a background
+    # job and let the page poll /api/jobs/<id> instead of blocking this request.
     zone_data = {}
+    analysis_job_id = None
     try:
-        zone_data = cluster_level_zones(level_id=level_id)
+        if current_app.config.get('REPORT_ASYNC_ANALYSIS', True):
+            zone_data = peek_zone_data(level_id=level_id, start=start, end=end, build=build)
+            if zone_data is None:
+                job = submit_job('zones', {
+                    "level_id": level_id, "session_id": None, "eps": 0.3, "min_samples": 10, "method": "auto",
+                    "start": start.isoformat() if start else None, "end": end.isoformat() if end else None,
+                    "build": build,
+                })
+                analysis_job_id = job.id
+                zone_data = {"pending": True, "zones": []}
+        else:
+            zone_data = get_zone_data(level_id=level_id, start=start, end=end, build=build)
     except Exception as e:
          current_app.logger.error(f"Error running clustering for level {level_id}: {e}", exc_info=True)
          # Add error info to zone_data to display on page
          zone_data = {"error": "Clustering failed.", "details": str(e)}
     
     # --- Generate Recommendations ---
+    # (skipped while the zone analysis job runs; the page reloads when it is done)
     recommendations = []
     try:
-        # Pass the results we already have
-        recommendations = generate_recommendations(
-            level_id=level_id,
-            zone_data=zone_data, 
-            event_counts=event_counts_dict
-        )
+        if analysis_job_id is None:
+            # Pass the results we already have; the per-zone death counts are
+            # cached with the zones (zone['deaths']), no death query here
+            recommendations = generate_recommendations(
+                level_id=level_id,
+                zone_data=zone_data, 
+                event_counts=event_counts_dict,
+                start=start,
+                end=end,
+                build=build
+            )
     except Exception as e:
          current_app.logger.error(f"Error generating recommendations for level {level_id}: {e}", exc_info=True)
          # Add a generic error message to recommendations if generation fails
          recommendations.append("Ошибка при формировании автоматических рекомендаций.")
          
     # Check if level exists (basic check based on if any data was found)
-    if unique_sessions_count == 0 and not zone_data.get('zones') and zone_data.get('noise_points', 0) == 0:
+    if analysis_job_id is None and not (start or end or build) and unique_sessions_count == 0 and not zone_data.get('zones') and zone_data.get('noise_points', 0) == 0:
          abort(404, description=f"Level '{level_id}' not found or has no associated event data.")
 
     return render_template(
@@ -120,5 +205,10 @@ def level_report(level_id):
         time_range=time_range, # Pass tuple for potential display
         zone_data=zone_data,
         available_sessions=available_sessions, # Pass session list to template
-        recommendations=recommendations # Pass recommendations to template
+        recommendations=recommendations, # Pass recommendations to template
+        analysis_job_id=analysis_job_id, # Zone analysis still running in the background
+        time_from=time_from if start or end else '',
+        time_to=time_to if start or end else '',
+        build=build or '',
+        builds=level_builds(level_id)
     ) 
\ No newline at end of file
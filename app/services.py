@@ -1,6 +1,7 @@
 # Placeholder for business logic (data processing, analysis, reporting)
 from . import db # Relative import
 from .models import GameEvent # Relative import
+from .timestamps import parse_iso_timestamp
 import datetime # Keep standard imports
 
 # Example function to process incoming game data
@@ -17,10 +18,9 @@ def process_game_event(data):
     ts_str = data.get('timestamp')
     timestamp_obj = None
     if isinstance(ts_str, str):
-        try:
-            # Attempt to parse ISO 8601 format
-            timestamp_obj = datetime.datetime.fromisoformat(ts_str.replace('Z', '+00:00'))
-        except ValueError:
+        # Shared ISO 8601 decoder (same one the /api/events batch path uses)
+        timestamp_obj = parse_iso_timestamp(ts_str)
+        if timestamp_obj is None:
             print(f"Error: Could not parse timestamp '{ts_str}'")
             return None # Or handle error differently
     elif isinstance(ts_str, datetime.datetime):
@@ -0,0 +1,154 @@
+# app/timestamps.py
+"""
+Shared ISO 8601 timestamp decoding for event ingestion.
+
+The Unity client sends `timeStamp` values in a fixed layout
+(`YYYY-MM-DDTHH:MM:SS.fffffffZ`, C# round-trip format). `parse_timestamps`
+decodes a whole batch at once: values in exactly that layout (UTC or
+offset-less) are parsed in one vectorized NumPy `datetime64[us]`
+conversion. Values with an explicit offset, any other layout, or a batch
+NumPy rejects are decoded one by one, with the
+`YYYY-MM-DDTHH:MM` prefix (plus offset) parsed once per batch and cached,
+and anything off the fixed layout goes through `datetime.fromisoformat`.
+
+All results are naive datetimes in UTC, like `GameEvent.timestamp` and its
+`utcnow` default. `to_epoch_us` and `time_window` are the matching helpers
+for storage (position_sample.t_us) and time-filtered queries.
+"""
+
+import re
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+_EPOCH = datetime(1970, 1, 1)
+_ONE_MICROSECOND = timedelta(microseconds=1)
+
+# Seconds, optional fraction and optional offset, matched from position 16
+_TAIL_RE = re.compile(r':(\d\d)(?:\.(\d+))?(Z|z|[+-]\d\d:?\d\d)?$')
+
+
+def _parse_offset(offset):
+    if not offset or offset in ('Z', 'z'):
+        return None
+    sign = -1 if offset[0] == '-' else 1
+    digits = offset[1:].replace(':', '')
+    return sign * timedelta(hours=int(digits[:2]), minutes=int(digits[2:]))
+
+
+def _parse_general(value):
+    """Fallback for layouts the fast path does not handle."""
+    text = value.strip()
+    if text.endswith(('Z', 'z')):
+        text = text[:-1] + '+00:00'
+    # fromisoformat (before 3.11) accepts at most 6 fractional digits
+    dot_index = text.find('.')
+    if dot_index != -1:
+        end_index = dot_index + 1
+        while end_index < len(text) and text[end_index].isdigit():
+            end_index += 1
+        if end_index - dot_index - 1 > 6:
+            text = text[:dot_index + 7] + text[end_index:]
+    dt = datetime.fromisoformat(text)
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def _decode(value, prefix_cache):
+    """Decodes one value using (and filling) the per-batch prefix cache."""
+    match = _TAIL_RE.match(value, 16)
+    if match is None or len(value) < 19:
+        return _parse_general(value)
+
+    seconds, fraction, offset = match.groups()
+    key = (value[:16], offset)
+    base = prefix_cache.get(key)
+    if base is None:
+        prefix = value[:16]
+        if prefix[4] != '-' or prefix[7] != '-' or prefix[10] not in 'Tt ' or prefix[13] != ':':
+            return _parse_general(value)
+        base = datetime(int(prefix[0:4]), int(prefix[5:7]), int(prefix[8:10]),
+                        int(prefix[11:13]), int(prefix[14:16]))
+        offset_delta = _parse_offset(offset)
+        if offset_delta is not None:
+            base -= offset_delta # Offsets are whole minutes, seconds stay untouched
+        prefix_cache[key] = base
+
+    microseconds = int(fraction[:6].ljust(6, '0')) if fraction else 0
+    return base.replace(second=int(seconds), microsecond=microseconds)
+
+
+def _decode_each(values, results, indices):
+    """Per-value path with a prefix cache shared by the whole batch."""
+    prefix_cache = {}
+    for i in indices:
+        value = values[i]
+        try:
+            results[i] = _decode(value, prefix_cache)
+        except ValueError as e:
+            print(f"Warning: Could not parse timestamp string '{value}', Error: {e}")
+
+
+def parse_timestamps(values):
+    """
+    Decodes a batch of ISO 8601 strings.
+
+    Args:
+        values (list): Timestamp strings; non-string or empty items are allowed.
+
+    Returns:
+        list: Naive UTC datetimes, None where a value could not be parsed.
+    """
+    results = [None] * len(values)
+    fast_indices = []
+    fast_values = []
+    slow_indices = []
+    for i, value in enumerate(values):
+        if not value or not isinstance(value, str):
+            continue
+        if value[-1] in 'Zz':
+            value = value[:-1]
+        # Only YYYY-MM-DDTHH:MM:SS[.f] goes to NumPy: it would also take offsets (with a deprecated-timezone
+        # warning) and words like 'now'. Digits are left to NumPy, which rejects the batch otherwise.
+        length = len(value)
+        if length < 19 or value[10] != 'T' or value[16] != ':' or \
+                (length > 19 and (value[19] != '.' or not value[20:].isdigit())):
+            slow_indices.append(i)
+            continue
+        fast_indices.append(i)
+        fast_values.append(value)
+
+    if fast_values:
+        try:
+            decoded = np.array(fast_values, dtype='datetime64[us]').tolist()
+        except ValueError:
+            slow_indices.extend(fast_indices) # At least one malformed value in the batch
+        else:
+            for i, dt in zip(fast_indices, decoded):
+                results[i] = dt
+
+    if slow_indices:
+        slow_indices.sort()
+        _decode_each(values, results, slow_indices)
+    return results
+
+
+def parse_iso_timestamp(value):
+    """Decodes a single ISO 8601 string (naive UTC datetime or None)."""
+    return parse_timestamps([value])[0]
+
+
+def to_epoch_us(value):
+    """Naive UTC datetime -> integer epoch microseconds."""
+    return (value - _EPOCH) // _ONE_MICROSECOND
+
+
+def time_window(column, start=None, end=None):
+    """SQL conditions for start <= column < end (either bound may be None)."""
+    conditions = []
+    if start is not None:
+        conditions.append(column >= start)
+    if end is not None:
+        conditions.append(column < end)
+    return conditions
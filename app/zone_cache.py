@@ -0,0 +1,154 @@
+# app/zone_cache.py
+"""
+Cache of zone clustering results (/api/zones, level reports).
+
+Entries are keyed by (level_id, session_id, clustering parameters, time
+window, build) and remember the level's data version (`aggregates.level_data_version`)
+they were computed from. Ingest and deletes bump that version in their own
+transaction, so a cached result is reused only while the level's data is
+unchanged - in every worker process, not only the one that ingested.
+Results carry the death count of every zone (analysis.set_zone_death_counts),
+so the "Zone of Death" rule reuses them instead of re-reading the deaths.
+
+Two tiers:
+* an in-process LRU (ZONE_CACHE_SIZE entries, 0 disables it);
+* optionally (ZONE_CACHE_PERSISTENT) the zone_cache_entry table, shared by
+  all processes and surviving restarts.
+"""
+
+import copy
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from flask import current_app
+from sqlalchemy import delete, insert
+
+from . import db
+from .aggregates import level_data_version
+from .analysis import cluster_level_zones, count_zone_deaths, set_zone_death_counts
+from .models import ZoneCacheEntry
+
+DEFAULT_CACHE_SIZE = 128
+
+_lock = threading.Lock()
+_entries = OrderedDict() # key -> (data_version, result)
+
+
+def _cache_key(level_id, session_id, eps, min_samples, method, start, end, build):
+    return (
+        level_id, session_id or '', float(eps), int(min_samples), method,
+        start.isoformat() if start else '', end.isoformat() if end else '', build or '',
+    )
+
+
+def _persistent_key(key):
+    return hashlib.sha1(json.dumps(key).encode('utf-8')).hexdigest()
+
+
+def _lru_get(key, version):
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] != version:
+            del _entries[key] # Stale: the level changed since
+            return None
+        _entries.move_to_end(key)
+        return entry[1]
+
+
+def _lru_put(key, version, result):
+    max_size = current_app.config.get('ZONE_CACHE_SIZE', DEFAULT_CACHE_SIZE)
+    if max_size <= 0:
+        return
+    with _lock:
+        _entries[key] = (version, result)
+        _entries.move_to_end(key)
+        while len(_entries) > max_size:
+            _entries.popitem(last=False)
+
+
+def _persistent_get(key, version):
+    row = db.session.get(ZoneCacheEntry, _persistent_key(key))
+    if row is None or row.data_version != version:
+        return None
+    return json.loads(row.result)
+
+
+def _persistent_put(key, version, result):
+    cache_key = _persistent_key(key)
+    try:
+        table = ZoneCacheEntry.__table__
+        db.session.execute(delete(table).where(table.c.cache_key == cache_key))
+        db.session.execute(insert(table).values(
+            cache_key=cache_key, level_id=key[0], data_version=version, result=json.dumps(result)
+        ))
+        db.session.commit()
+    except Exception as e:
+        # Another process stored the same entry concurrently, or the table is missing
+        db.session.rollback()
+        current_app.logger.warning(f"Could not persist zone cache entry for level {key[0]}: {e}")
+
+
+def _lookup(key, version, persistent):
+    result = _lru_get(key, version)
+    if result is None and persistent:
+        result = _persistent_get(key, version)
+        if result is not None:
+            _lru_put(key, version, result)
+    return result
+
+
+def peek_zone_data(level_id, session_id=None, eps=0.3, min_samples=10, start=None, end=None, method='auto',
+                   build=None):
+    """Like get_zone_data(), but returns None instead of clustering on a cache miss."""
+    key = _cache_key(level_id, session_id, eps, min_samples, method, start, end, build)
+    result = _lookup(key, level_data_version(level_id), current_app.config.get('ZONE_CACHE_PERSISTENT', False))
+    return copy.deepcopy(result) if result is not None else None
+
+
+def get_zone_data(level_id, session_id=None, eps=0.3, min_samples=10, start=None, end=None, method='auto',
+                  build=None):
+    """
+    cluster_level_zones() with caching; same arguments and result.
+
+    The returned dict is a copy, callers may modify it.
+    """
+    key = _cache_key(level_id, session_id, eps, min_samples, method, start, end, build)
+    version = level_data_version(level_id)
+    persistent = current_app.config.get('ZONE_CACHE_PERSISTENT', False)
+
+    result = _lookup(key, version, persistent)
+    if result is None:
+        result = cluster_level_zones(
+            level_id=level_id, session_id=session_id, eps=eps, min_samples=min_samples,
+            start=start, end=end, method=method, build=build
+        )
+        if result.get('zones'):
+            set_zone_death_counts(result, count_zone_deaths(
+                level_id, result['zones'], session_id=session_id, start=start, end=end, build=build
+            ))
+        _lru_put(key, version, result)
+        if persistent:
+            _persistent_put(key, version, result)
+    return copy.deepcopy(result)
+
+
+def store_zone_data(level_id, result, version, session_id=None, eps=0.3, min_samples=10, start=None, end=None,
+                    method='auto', build=None):
+    """
+    Stores a result computed elsewhere (e.g. the batch analysis workers).
+    `version` is the level data version read *before* the data was loaded.
+    """
+    key = _cache_key(level_id, session_id, eps, min_samples, method, start, end, build)
+    _lru_put(key, version, result)
+    if current_app.config.get('ZONE_CACHE_PERSISTENT', False):
+        _persistent_put(key, version, result)
+
+
+def clear_zone_cache():
+    """Drops every in-process entry (the persistent table is left alone)."""
+    with _lock:
+        _entries.clear()
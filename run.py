@@ -110,6 +110,278 @@ def create_admin_command():
 
     print("\n--- Admin user creation finished ---")
 
+@app.cli.command("build-heatmap-tiles")
+@click.option('--level', 'level_ids', multiple=True, help='Level ID to build (repeatable). Defaults to all levels.')
+def build_heatmap_tiles_command(level_ids):
+    """Precomputes the heatmap tile pyramids used by /api/heatmap/tiles."""
+    from app.heatmap_tiles import rebuild_pyramid
+    from app.models import GameEvent
+
+    print("--- Running build-heatmap-tiles command ---")
+    with app.app_context():
+        if not level_ids:
+            level_ids = [row[0] for row in db.session.query(GameEvent.level_id)
+                         .filter(GameEvent.level_id.isnot(None)).distinct().order_by(GameEvent.level_id)]
+        for level_id in level_ids:
+            try:
+                pyramid = rebuild_pyramid(level_id)
+            except Exception as e:
+                print(f"  Error building tiles for level '{level_id}': {e}")
+                continue
+            if pyramid is None:
+                print(f"  Level '{level_id}': no position data, skipped.")
+            else:
+                meta = pyramid['meta']
+                print(f"  Level '{level_id}': {meta['points']} points, zoom 0-{meta['max_zoom']}.")
+
+    print("\n--- Heatmap tile build finished ---")
+
+@app.cli.command("rebuild-heatmap-density")
+@click.option('--level', 'level_id', default=None, help='Only rebuild this level. Defaults to all levels.')
+def rebuild_heatmap_density_command(level_id):
+    """Recomputes the heatmap_density table from GameEvent history."""
+    from app.aggregates import rebuild_density
+    from app.models import HeatmapDensity
+
+    target = f"level '{level_id}'" if level_id else "all levels"
+    print(f"--- Running rebuild-heatmap-density for {target} ---")
+    with app.app_context():
+        try:
+            rebuild_density(level_id)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error rebuilding heatmap density: {e}")
+            return
+        query = HeatmapDensity.query
+        if level_id:
+            query = query.filter_by(level_id=level_id)
+        print(f"Heatmap density rebuilt: {query.count()} cell rows.")
+
+    print("\n--- Heatmap density rebuild finished ---")
+
+@app.cli.command("rebuild-position-samples")
+@click.option('--level', 'level_id', default=None, help='Only rebuild this level. Defaults to all levels.')
+def rebuild_position_samples_command(level_id):
+    """Fills the position_sample table from GameEvent history (run after upgrading)."""
+    from app.positions import rebuild_position_samples
+
+    target = f"level '{level_id}'" if level_id else "all levels"
+    print(f"--- Running rebuild-position-samples for {target} ---")
+    with app.app_context():
+        try:
+            count = rebuild_position_samples(level_id)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error rebuilding position samples: {e}")
+            return
+        print(f"Position samples rebuilt: {count} rows.")
+
+    print("\n--- Position sample rebuild finished ---")
+
+@app.cli.command("rebuild-level-summaries")
+@click.option('--level', 'level_id', default=None, help='Only rebuild this level. Defaults to all levels.')
+def rebuild_level_summaries_command(level_id):
+    """Recomputes level_summary / level_event_type_count / level_session from GameEvent history."""
+    from app.aggregates import rebuild_level_summaries
+    from app.models import LevelSummary
+
+    target = f"level '{level_id}'" if level_id else "all levels"
+    print(f"--- Running rebuild-level-summaries for {target} ---")
+    with app.app_context():
+        try:
+            rebuild_level_summaries(level_id)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error rebuilding level summaries: {e}")
+            return
+        query = LevelSummary.query
+        if level_id:
+            query = query.filter_by(level_id=level_id)
+        print(f"Level summaries rebuilt: {query.count()} level(s).")
+
+    print("\n--- Level summary rebuild finished ---")
+
+@app.cli.command("rebuild-session-summaries")
+def rebuild_session_summaries_command():
+    """Recomputes the session_summary table (database viewer session list) from GameEvent history."""
+    from app.aggregates import rebuild_session_summaries
+    from app.models import SessionSummary
+
+    print("--- Running rebuild-session-summaries ---")
+    with app.app_context():
+        try:
+            rebuild_session_summaries()
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error rebuilding session summaries: {e}")
+            return
+        print(f"Session summaries rebuilt: {SessionSummary.query.count()} session(s).")
+
+    print("\n--- Session summary rebuild finished ---")
+
+@app.cli.command("rebuild-event-search")
+@click.option('--session', 'session_id', default=None, help='Only this session (default: all).')
+def rebuild_event_search_command(session_id):
+    """Recomputes the event data search index (event_attribute, SQLite FTS5 table) from GameEvent history."""
+    from app.event_search import rebuild_event_search
+
+    print("--- Running rebuild-event-search ---")
+    with app.app_context():
+        try:
+            total = rebuild_event_search(session_id)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error rebuilding event search index: {e}")
+            return
+        print(f"Event search index rebuilt: {total} attribute(s).")
+
+    print("\n--- Event search rebuild finished ---")
+
+@app.cli.command("partition-game-events")
+@click.option('--months-ahead', default=3, show_default=True, help='Future monthly partitions to create.')
+def partition_game_events_command(months_ahead):
+    """Converts game_event to monthly partitions, or adds upcoming partitions (PostgreSQL only)."""
+    from app.partitions import convert_to_partitioned, ensure_partitions, is_partitioned
+
+    print("--- Running partition-game-events command ---")
+    with app.app_context():
+        if db.session.get_bind().dialect.name != 'postgresql':
+            print("Native partitioning requires PostgreSQL; on this database `flask purge-events` deletes in chunks.")
+            return
+        try:
+            if is_partitioned():
+                created = ensure_partitions(months_ahead)
+                print(f"game_event is already partitioned; created {len(created)} new partitions: {', '.join(created) or '-'}")
+            else:
+                convert_to_partitioned(months_ahead)
+                print("game_event converted to monthly partitions.")
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error partitioning game_event: {e}")
+            return
+
+    print("\n--- Partitioning finished ---")
+
+@app.cli.command("purge-events")
+@click.option('--before', 'before', default=None, help='Delete events before this UTC date/time (ISO 8601).')
+@click.option('--older-than-days', type=int, default=None, help='Delete events older than N days.')
+def purge_events_command(before, older_than_days):
+    """Data retention: drops expired partitions / deletes expired events in chunks."""
+    import datetime
+    from app.partitions import purge_events_before
+    from app.timestamps import parse_iso_timestamp
+
+    if (before is None) == (older_than_days is None):
+        print("Specify exactly one of --before or --older-than-days.")
+        return
+    if before is not None:
+        cutoff = parse_iso_timestamp(before)
+        if cutoff is None:
+            print(f"Invalid --before value: {before}")
+            return
+    else:
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=older_than_days)
+
+    print(f"--- Running purge-events (before {cutoff}) ---")
+    with app.app_context():
+        try:
+            result = purge_events_before(cutoff)
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error purging events: {e}")
+            return
+        print(f"Partitions dropped: {', '.join(result['partitions_dropped']) or '-'}")
+        print(f"Events deleted: {result['events_deleted']}, position samples deleted: {result['samples_deleted']}")
+        print(f"Heatmap density rebuilt for {len(result['levels'])} level(s).")
+
+    print("\n--- Purge finished ---")
+
+@app.cli.command("export-events")
+@click.option('--level', 'level_id', default=None, help='Only events of this level.')
+@click.option('--session', 'session_id', default=None, help='Only events of this session.')
+@click.option('--from', 'time_from', default=None, help='Events at or after this UTC date/time (ISO 8601).')
+@click.option('--to', 'time_to', default=None, help='Events before this UTC date/time (ISO 8601).')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson', 'parquet']), default='csv', show_default=True)
+@click.option('--output', '-o', default=None, help='Output file (default: events.<format>).')
+@click.option('--chunk-rows', type=int, default=None, help='Rows per chunk (default: EXPORT_CHUNK_ROWS).')
+def export_events_command(level_id, session_id, time_from, time_to, fmt, output, chunk_rows):
+    """Streams raw events (all, or a level/session/time range) to a CSV, NDJSON or Parquet file."""
+    import time
+    from app.export import EXPORT_FORMATS, stream_events
+    from app.timestamps import parse_iso_timestamp
+
+    start = parse_iso_timestamp(time_from) if time_from else None
+    end = parse_iso_timestamp(time_to) if time_to else None
+    if (time_from and start is None) or (time_to and end is None):
+        print("Invalid --from/--to value (ISO 8601 expected).")
+        return
+    output = output or f"events.{EXPORT_FORMATS[fmt][1]}"
+
+    print(f"--- Running export-events ({fmt} -> {output}) ---")
+    with app.app_context():
+        rows = [0]
+        def count_rows(n):
+            rows[0] += n
+        started = time.perf_counter()
+        try:
+            chunks = stream_events(
+                fmt, level_id=level_id, session_id=session_id, start=start, end=end,
+                chunk_rows=chunk_rows or app.config.get('EXPORT_CHUNK_ROWS', 5000), on_chunk=count_rows
+            )
+            written = 0
+            with open(output, 'wb') as f:
+                for data in chunks:
+                    f.write(data)
+                    written += len(data)
+        except Exception as e:
+            print(f"Error exporting events: {e}")
+            return
+        elapsed = time.perf_counter() - started
+        print(f"{rows[0]} event(s), {written / 1e6:.1f} MB in {elapsed:.1f} s "
+              f"({rows[0] / elapsed if elapsed else 0:.0f} rows/s).")
+
+    print("\n--- Export finished ---")
+
+@app.cli.command("analyze-levels")
+@click.option('--level', 'level_ids', multiple=True, help='Level ID to analyse (repeatable). Defaults to all levels.')
+@click.option('--workers', type=int, default=None, help='Worker processes. Defaults to the CPU count.')
+@click.option('--eps', type=float, default=0.3, show_default=True, help='DBSCAN eps.')
+@click.option('--min-samples', type=int, default=10, show_default=True, help='DBSCAN min_samples.')
+@click.option('--method', type=click.Choice(['auto', 'exact', 'grid']), default='auto', show_default=True)
+def analyze_levels_command(level_ids, workers, eps, min_samples, method):
+    """Clusters zones and generates recommendations for many levels in parallel (fills the zone cache)."""
+    import time
+    from app.batch_analysis import analyze_levels
+
+    def report(level_id, entry):
+        if 'error' in entry:
+            print(f"  Level '{level_id}': error: {entry['error']}")
+            return
+        print(f"  Level '{level_id}': {len(entry['zones'])} zones, {entry['noise_points']} noise, "
+              f"{len(entry['recommendations'])} recommendations "
+              f"(load {entry['load_s']:.2f}s, cluster {entry['cluster_s']:.2f}s, {entry['method'] or '-'})")
+
+    print("--- Running analyze-levels command ---")
+    started = time.perf_counter()
+    with app.app_context():
+        try:
+            results = analyze_levels(level_ids or None, workers=workers, eps=eps, min_samples=min_samples,
+                                     method=method, on_result=report)
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error analysing levels: {e}")
+            return
+    failed = sum(1 for entry in results.values() if 'error' in entry)
+    print(f"\nAnalysed {len(results)} level(s), {failed} failed, in {time.perf_counter() - started:.2f}s.")
+
+    print("\n--- Level analysis finished ---")
+
 if __name__ == '__main__':
     
     
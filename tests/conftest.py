@@ -0,0 +1,109 @@
+import datetime
+import os
+import random
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+from app import create_app, db
+from app.config import Config
+from app.ingestion import build_event_rows, store_event_rows
+from app.models import Role, User
+from app.zone_cache import clear_zone_cache
+
+
+def _create_test_app(tmp_path, database_uri):
+    class TestConfig(Config):
+        TESTING = True
+        SQLALCHEMY_DATABASE_URI = database_uri
+        INGEST_WRITE_BEHIND = False
+        REPORT_ASYNC_ANALYSIS = False # Render zones inline, no job threads
+        ZONE_CACHE_PERSISTENT = False
+        HEATMAP_TILE_DIR = str(tmp_path / 'heatmap_tiles')
+
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+    clear_zone_cache() # The LRU is per process, shared by every test's app
+    return app
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = _create_test_app(tmp_path, 'sqlite:///' + str(tmp_path / 'test.db'))
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def postgres_app(tmp_path):
+    """
+    App on the PostgreSQL database of TEST_POSTGRES_URL (skipped when unset).
+    Use a scratch database: the tables are dropped afterwards.
+    """
+    url = os.environ.get('TEST_POSTGRES_URL')
+    if not url:
+        pytest.skip("TEST_POSTGRES_URL is not set")
+    app = _create_test_app(tmp_path, url)
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    """Test client logged in as an administrator."""
+    with app.app_context():
+        role = Role(name='Administrator')
+        user = User(username='admin', email='admin@example.com')
+        user.set_password('password')
+        user.roles.append(role)
+        db.session.add(user)
+        db.session.commit()
+    client = app.test_client()
+    client.post('/auth/login', data={'username': 'admin', 'password': 'password'})
+    return client
+
+
+def ingest_session(session_id, level_id, positions=200, deaths=10, seed=0):
+    """Stores one session's batch through the regular ingest path (inside an app context)."""
+    rng = random.Random(seed)
+    t0 = datetime.datetime(2025, 4, 1, 12, 0, 0)
+    position_updates = [
+        {
+            "timeStamp": (t0 + datetime.timedelta(milliseconds=100 * i)).isoformat() + 'Z',
+            "position": {"x": rng.gauss(0, 10), "y": 0.0, "z": rng.gauss(0, 10)},
+        }
+        for i in range(positions)
+    ]
+    player_actions = [
+        {
+            "timeStamp": (t0 + datetime.timedelta(seconds=i)).isoformat() + 'Z',
+            "eventType": 'death',
+            "position": {"x": rng.gauss(0, 10), "y": 0.0, "z": rng.gauss(0, 10)},
+            "actionDetails": {"cause": "fall"},
+        }
+        for i in range(deaths)
+    ]
+    store_event_rows(build_event_rows(session_id, level_id, position_updates, player_actions))
+    db.session.commit()
+
+
+@contextmanager
+def recorded_statements(engine):
+    """Collects (sql, parameters) of every statement executed on the engine inside the block."""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
@@ -0,0 +1,131 @@
+"""
+Query plans of the hot session/level queries (SQLite EXPLAIN QUERY PLAN,
+and PostgreSQL EXPLAIN when TEST_POSTGRES_URL is set).
+
+Guards the composite game_event / position_sample indexes: the statements
+are captured from the real code paths and must be served by their index,
+without a full table scan or a temporary sort.
+"""
+
+import datetime
+
+from sqlalchemy import delete, text
+
+from app import db
+from app.analysis import _grid_cells, _position_stats, event_points_select
+from app.heatmap import fetch_xz_array, position_select
+from app.models import LevelEventTypeCount
+from app.reports import level_metrics
+
+from conftest import ingest_session, recorded_statements
+
+
+def _plan(statement, parameters):
+    rows = db.session.connection().exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).all()
+    return [row[-1] for row in rows]
+
+
+def _game_event_plans(statements, prefix):
+    plans = [_plan(sql, params) for sql, params in statements if sql.startswith(prefix)]
+    assert plans, f"no statement starting with {prefix!r} was executed"
+    return plans
+
+
+def _populate(app):
+    with app.app_context():
+        for i in range(6):
+            ingest_session(f's{i}', f'L{i % 2}', seed=i)
+
+
+def test_session_events_use_session_timestamp_index(app, client):
+    _populate(app)
+    with app.app_context():
+        with recorded_statements(db.engine) as statements:
+            assert client.get('/database/session/s1').status_code == 200
+
+        for plan in _game_event_plans(statements, 'SELECT game_event.id,'):
+            assert any('INDEX ix_game_event_session_timestamp' in step for step in plan), plan
+            assert not any('TEMP B-TREE' in step for step in plan), plan
+
+
+def test_level_metrics_grouped_query_is_covering(app):
+    _populate(app)
+    with app.app_context():
+        # Without summary rows the metrics come from the grouped game_event query
+        db.session.execute(delete(LevelEventTypeCount.__table__).where(LevelEventTypeCount.level_id == 'L1'))
+        db.session.commit()
+        with recorded_statements(db.engine) as statements:
+            sessions, event_counts, _range, _sessions = level_metrics('L1')
+        assert sessions == 3 and event_counts['death'] == 30
+
+        for plan in _game_event_plans(statements, 'SELECT game_event.session_id, game_event.event_type'):
+            assert any('COVERING INDEX ix_game_event_level_session_type_timestamp' in step for step in plan), plan
+            assert not any('TEMP B-TREE' in step for step in plan), plan
+
+
+def test_death_points_use_covering_level_type_index(app):
+    _populate(app)
+    with app.app_context():
+        with recorded_statements(db.engine) as statements:
+            assert fetch_xz_array(event_points_select('L0', 'death')).shape == (30, 2)
+            assert fetch_xz_array(event_points_select('L0', 'death', session_id='s2')).shape == (10, 2)
+
+        for plan in _game_event_plans(statements, 'SELECT game_event.position_x, game_event.position_z'):
+            assert any('COVERING INDEX ix_game_event_level_type_session_xz' in step for step in plan), plan
+
+
+# Position read paths of level L0 -> index expected on position_sample
+_WINDOW_START = datetime.datetime(2025, 4, 1, 12, 0, 5)
+POSITION_QUERIES = {
+    'level': (lambda: fetch_xz_array(position_select('L0'))),
+    'session': (lambda: fetch_xz_array(position_select('L0', session_id='s2'))),
+    'window': (lambda: fetch_xz_array(position_select('L0', start=_WINDOW_START))),
+    'zone stats': (lambda: _position_stats(position_select('L0'))),
+    'zone grid': (lambda: _grid_cells(position_select('L0', start=_WINDOW_START), 1.0)),
+}
+# Both indexes cover a whole-level read (level_key_id leads), the planner may pick either
+_LEVEL_INDEXES = ('ix_position_sample_level_session_xz', 'ix_position_sample_level_time_xz')
+POSITION_INDEXES = {
+    'level': _LEVEL_INDEXES,
+    'session': ('ix_position_sample_level_session_xz',),
+    'window': ('ix_position_sample_level_time_xz',),
+    'zone stats': _LEVEL_INDEXES,
+    'zone grid': ('ix_position_sample_level_time_xz',),
+}
+
+
+def _position_statements():
+    """{query name: [(sql, parameters)]} of the position_sample statements of each read path."""
+    recorded = {}
+    for name, run in POSITION_QUERIES.items():
+        with recorded_statements(db.engine) as statements:
+            run()
+        recorded[name] = [(sql, params) for sql, params in statements if 'FROM position_sample' in sql]
+        assert recorded[name], f"{name}: position_sample was not queried"
+    return recorded
+
+
+def test_position_queries_use_covering_indexes(app):
+    _populate(app)
+    with app.app_context():
+        for name, statements in _position_statements().items():
+            for sql, params in statements:
+                plan = _plan(sql, params)
+                assert any(
+                    f'COVERING INDEX {index}' in step for step in plan for index in POSITION_INDEXES[name]
+                ), (name, plan)
+                assert not any(step.startswith('SCAN') for step in plan), (name, plan)
+
+
+def test_postgresql_position_queries_use_indexes(postgres_app):
+    _populate(postgres_app)
+    with postgres_app.app_context():
+        db.session.execute(text('ANALYZE'))
+        # Tiny test tables: without this the planner rightly prefers a sequential scan
+        db.session.execute(text('SET LOCAL enable_seqscan = off'))
+        for name, statements in _position_statements().items():
+            for sql, params in statements:
+                plan = [row[0] for row in db.session.connection().exec_driver_sql('EXPLAIN ' + sql, params).all()]
+                assert any(index in line for line in plan for index in POSITION_INDEXES[name]), (name, plan)
+                assert not any('Seq Scan' in line for line in plan), (name, plan)
+        db.session.rollback()
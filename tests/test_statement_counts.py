@@ -0,0 +1,59 @@
+"""
+SQL statements per page: bounded and independent of the number of sessions
+and events (no N+1 queries). Counts include the login user/role loads.
+"""
+
+from app import db
+
+from conftest import ingest_session, recorded_statements
+
+# User + roles, metrics (2 summary reads), data version, builds of the level
+REPORT_CACHED_MAX = 6
+# ... plus clustering input (level key, bounds, samples) and the zone death counts
+REPORT_UNCACHED_MAX = 10
+
+
+def _populate(app):
+    with app.app_context():
+        for i in range(3):
+            ingest_session(f'few{i}', 'FEW', seed=i)
+        for i in range(30):
+            ingest_session(f'many{i}', 'MANY', seed=i)
+        return db.engine
+
+
+def _count(engine, client, url):
+    with recorded_statements(engine) as statements:
+        assert client.get(url).status_code == 200
+    return len(statements)
+
+
+def test_level_report_statement_count(app, client):
+    engine = _populate(app)
+    counts = {}
+    for level_id in ('FEW', 'MANY'):
+        uncached = _count(engine, client, f'/reports/level/{level_id}')
+        cached = _count(engine, client, f'/reports/level/{level_id}')
+        counts[level_id] = (uncached, cached)
+
+    assert counts['FEW'] == counts['MANY'], counts
+    uncached, cached = counts['MANY']
+    assert uncached <= REPORT_UNCACHED_MAX, counts
+    assert cached <= REPORT_CACHED_MAX, counts
+
+
+def test_filtered_level_report_statement_count(app, client):
+    engine = _populate(app)
+    few = _count(engine, client, '/reports/level/FEW?from=2025-04-01T12:00:00Z')
+    many = _count(engine, client, '/reports/level/MANY?from=2025-04-01T12:00:00Z')
+    assert few == many
+    assert few <= REPORT_UNCACHED_MAX
+
+
+def test_session_pages_statement_count(app, client):
+    engine = _populate(app)
+    assert _count(engine, client, '/database/sessions?level_id=FEW') == \
+        _count(engine, client, '/database/sessions?level_id=MANY')
+    assert _count(engine, client, '/database/session/few1') == _count(engine, client, '/database/session/many1')
+    # Keyset pages: the last page costs the same as the first
+    assert _count(engine, client, '/database/session/many1') == _count(engine, client, '/database/session/many1?last=1')